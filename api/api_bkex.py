@@ -1,4 +1,5 @@
 import base64
+import collections
 import hashlib
 import hmac
 import json
@@ -7,17 +8,23 @@ import time
 import urllib
 import uuid
 
+import websockets
 from websocket import create_connection
 
+import fastjson
 from keys import personal_keys
 from utils import keysort, round_nearest, uprint
 
-from api.api_general import GeneralAPI
+from api.api_general import GeneralAPI, PriceSellSocket
 
 class BKEX_API(GeneralAPI):
-    def __init__(self):
+    def __init__(self, api_url='https://api.bkex.com',
+                 ws_url='wss://api.bkex.com/socket.io/?EIO=3&transport=websocket'):
         super().__init__()
-        self.api_url = 'https://api.bkex.com'
+        self.api_url = api_url
+        # socket.io server, the quotations are on their own namespace
+        self.ws_url = ws_url
+        self.ws_namespace = '/quotation'
         self.exch_name = 'BKEX'
         self.session = requests.Session()
 
@@ -29,11 +36,16 @@ class BKEX_API(GeneralAPI):
 
         self.pairs_separator = '_'
 
+        # the price socket works, but not along the blocking REST calls of
+        # this api: the reactions poll the REST prices until they are async
         self.support_websocket = False
         self.has_token_fullnames = False
 
         self.valid_code_on_limit_order = 0
 
+        # finished orders by id, from placements and history pages
+        self.order_cache = BKEXOrderCache()
+
     def update_pairs(self):
         method = 'GET'
         endpoint = '/v2/common/symbols'
@@ -241,6 +253,7 @@ class BKEX_API(GeneralAPI):
             uprint(f'[{self.exch_name}: {pair_name}] SUCCESS sell {token_sell}.')
 
             order_id = resp_json['data']
+            self.order_cache.placed(order_id, pair_name)
             if time_in_force == 'IOC':
                 self.cancel_order(order_id)
 
@@ -312,6 +325,14 @@ class BKEX_API(GeneralAPI):
         return resp_json
 
     def get_order_details(self, order_id, token1, token2):
+        """
+        Details of an order, open or finished. A finished order is looked up
+        in the cache, then in the history pages not downloaded yet.
+        """
+        details = self.order_cache.get(order_id)
+        if details is not None:
+            return details
+
         method = 'GET'
         endpoint = '/v2/u/order/openOrder/detail'
 
@@ -335,41 +356,60 @@ class BKEX_API(GeneralAPI):
             return resp_json['data']
 
         # try in the history since the order is not open
-        method2 = 'GET'
-        endpoint2 = '/v2/u/order/historyOrders'
-
-        pair_name, good_order = self.find_pair_from_tokens(token1, token2)
+        pair_name = self.order_cache.pair(order_id)
+        if pair_name is None:
+            pair_name, good_order = self.find_pair_from_tokens(token1, token2)
 
         if pair_name is None:
             return False
 
-        data2 = {'symbol': pair_name}
-        headers2 = self.get_headers(request_type=method2, data_dict=data2)
-
-        response2 = self.session.request(method2,
-                                         url=self.api_url + endpoint2,
-                                         data=data2,
-                                         headers=headers2)
-
-        resp_json2 = response2.json()
-
-        if response2.status_code != 200:
-            uprint(f'[{self.exch_name}] ERROR: failure in request in '
-                   f'`get_order_details` with message: {resp_json2["msg"]}')
+        if not self.fetch_history(pair_name, order_id):
             return False
 
-        if resp_json2['code'] == 0:
-            for order in resp_json2['data']['data'][:5]:
-                if order_id == order['id']:
-                    uprint(f'[{self.exch_name}] Order with id {order_id} '
-                           f'finished in `get_order_details`.')
-                    return order
+        details = self.order_cache.get(order_id)
+        if details is not None:
+            uprint(f'[{self.exch_name}] Order with id {order_id} '
+                   f'finished in `get_order_details`.')
+            return details
 
         uprint(f'[{self.exch_name}] Order with id {order_id} not found in open '
                f'orders and history, are you sure the id is right?')
 
         return False
 
+    def fetch_history(self, pair_name, order_id, page_size=50, max_pages=10):
+        """
+        Download the history of the pair, newest first, until the order is
+        found or the pages reach orders already in the cache. Return False on
+        a failed request.
+        """
+        method = 'GET'
+        endpoint = '/v2/u/order/historyOrders'
+
+        for page in range(1, max_pages + 1):
+            data = {'symbol': pair_name, 'page': page, 'size': page_size}
+            headers = self.get_headers(request_type=method, data_dict=data)
+
+            response = self.session.request(method,
+                                            url=self.api_url + endpoint,
+                                            data=data,
+                                            headers=headers)
+
+            resp_json = response.json()
+
+            if response.status_code != 200 or resp_json['code'] != 0:
+                uprint(f'[{self.exch_name}] ERROR: failure in request in '
+                       f'`fetch_history` with message: {resp_json["msg"]}')
+                return False
+
+            orders = resp_json['data']['data']
+            n_new = self.order_cache.add_history(orders)
+            if (order_id in self.order_cache or n_new < len(orders)
+                    or len(orders) < page_size):
+                break
+
+        return True
+
     def get_execution_price(self, order_response, denomination, second_token):
         details = self.get_order_details(order_response['data'],
                                          denomination,
@@ -427,6 +467,84 @@ class BKEX_API(GeneralAPI):
 
         return balance, available
 
+    async def create_ws_handle(self):
+        ws = await websockets.connect(self.ws_url)
+        # join the namespace, after the engine.io open packet
+        await ws.send(f'40{self.ws_namespace},')
+        return ws
+
+    def get_subscription_data_ws(self, pair):
+        data = ['quotationDepth', {'symbol': pair, 'number': 1}]
+        return f'42{self.ws_namespace},' + json.dumps(data)
+
+
+class BKEXPriceSellSocket(PriceSellSocket):
+    """
+    Top of the book pushed as socket.io events on the quotation namespace.
+    The engine.io ping is a '2' packet, answered by a '3' one.
+    """
+    ping_interval = 20
+    control_prefixes = ('0', '3', '40')
+
+    async def connect(self):
+        ws_handle = await self.exch_api.create_ws_handle()
+        data_subscription = self.exch_api.get_subscription_data_ws(self.pair)
+        await ws_handle.send(data_subscription)
+        self.event_prefix = f'42{self.exch_api.ws_namespace},'
+        return ws_handle
+
+    def decode_ticker(self, received):
+        if not received.startswith(self.event_prefix):
+            return None
+
+        event, data = fastjson.loads(received[len(self.event_prefix):])
+        if event != 'quotationDepth' or not data['bid'] or not data['ask']:
+            return None
+        return float(data['bid'][0][0]), float(data['ask'][0][0]), data.get('ts', 0)
+
+    async def ping(self, ws_handle):
+        await ws_handle.send('2')
+
+
+class BKEXOrderCache:
+    """
+    Finished orders by id, the `max_orders` most recent ones, and the pair of
+    the orders placed. History pages are newest first: a page holding an
+    order already cached means the rest was already downloaded.
+    """
+    def __init__(self, max_orders=10000):
+        self.max_orders = max_orders
+        self.finished = collections.OrderedDict()  # order id -> details
+        self.pairs = collections.OrderedDict()  # order id -> pair name
+
+    def __contains__(self, order_id):
+        return order_id in self.finished
+
+    def get(self, order_id):
+        return self.finished.get(order_id)
+
+    def pair(self, order_id):
+        return self.pairs.get(order_id)
+
+    def placed(self, order_id, pair_name):
+        self.pairs[order_id] = pair_name
+        if len(self.pairs) > self.max_orders:
+            self.pairs.popitem(last=False)
+
+    def add_history(self, orders):
+        """
+        Cache the orders of a history page, return how many were new.
+        """
+        n_new = 0
+        for order in orders:
+            if order['id'] in self.finished:
+                continue
+            self.finished[order['id']] = order
+            n_new += 1
+            if len(self.finished) > self.max_orders:
+                self.finished.popitem(last=False)
+        return n_new
+
 
 if __name__ == '__main__':
     bkex = BKEX_API()
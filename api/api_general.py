@@ -1,3 +1,10 @@
+import asyncio
+import sys
+import time
+
+import websockets
+
+import metrics
 from utils import round_nearest, uprint
 
 class GeneralAPI():
@@ -8,6 +15,11 @@ class GeneralAPI():
         # a dictionary of symbol to name
         self.listed_tokens = []
 
+        # `TickRecorderPool` recording the ticks of the price sockets, if any
+        self.tick_recorders = None
+        # `PriceBoard` the price sockets publish to, or read from, if any
+        self.price_board = None
+
     async def refresh(self):
         await self.update_pairs()
         await self.update_tokens()
@@ -42,6 +54,17 @@ class GeneralAPI():
     async def order_limit(self):
         raise NotImplementedError
 
+    async def order_limit_batch(self, orders):
+        """
+        Place several limit orders concurrently. `orders` is a list of dicts
+        holding the keyword arguments of `order_limit`. Return the responses
+        in the same order, or the exception of an order which failed, so that
+        the orders placed are still known. Fills are awaited separately with
+        `get_fill`.
+        """
+        return await asyncio.gather(*[self.order_limit(**order)
+                                      for order in orders], return_exceptions=True)
+
     async def order_limit_max(self):
         """
         Place order to sell `token_sell` and buy `token_buy`, with the maximum
@@ -52,6 +75,28 @@ class GeneralAPI():
     async def get_order_details(self):
         raise NotImplementedError
 
+    async def get_fill(self):
+        """
+        Wait for the given order response to be filled and return the order
+        details.
+        """
+        raise NotImplementedError
+
+    async def get_fills(self, order_responses):
+        """
+        Wait for several orders, `False` entries (failed orders, or their
+        exception) are kept as `False`.
+        """
+        async def fill_or_false(order_response):
+            if isinstance(order_response, BaseException):
+                return False
+            if not order_response or order_response['code'] != self.valid_code_on_limit_order:
+                return False
+            return await self.get_fill(order_response)
+
+        return await asyncio.gather(*[fill_or_false(resp)
+                                      for resp in order_responses])
+
     async def get_execution_price(self):
         """
         Get the average price of an order from its response.
@@ -159,3 +204,162 @@ class GeneralAPI():
                     base_amount = amount_buy
 
         return (amount_sell, amount_buy, execution_price, base_amount, printing)
+
+
+async def close_ws(ws_handle):
+    """
+    Close a socket whose frames are no longer read. They are drained
+    meanwhile, else the closing frame of the server stays behind the full
+    receive buffer until the close timeout.
+    """
+    async def drain():
+        try:
+            async for _ in ws_handle:
+                pass
+        except websockets.ConnectionClosed:
+            pass
+
+    drainer = asyncio.create_task(drain())
+    try:
+        await ws_handle.close()
+    finally:
+        drainer.cancel()
+
+
+class PriceSellSocket:
+    """
+    Highest price a token can be sold for against USDT, streamed by the
+    exchange. `current_price` is updated on each tick (denominated in USDT)
+    and `event_new_price` set when it changes.
+
+    Subclasses open the subscribed socket in `connect` and decode a frame in
+    `decode_ticker`, into the highest bid, the lowest ask and the exchange
+    time in ms, or None if the frame is not a tick. Frames starting with one
+    of `control_prefixes` are dropped silently.
+    """
+    ping_interval = 8
+    reconnect_interval = None  # seconds after which the socket is reopened
+    control_prefixes = ()
+
+    def __init__(self, exch_api, token_symbol, current_price, event_new_price):
+        self.old_price = -1
+        self.current_price = [current_price]
+        self.exch_api = exch_api
+
+        self.token_symbol = token_symbol
+        self.pair, self.ordered = self.exch_api.find_pair_from_tokens('USDT',
+                                                                      token_symbol)
+
+        self.event_new_price = event_new_price
+
+        if self.ordered is None:
+            uprint(f'ERROR: pair of USDT and {token_symbol} do not exist at'
+                   f'this point although it should.')
+            sys.exit(1)
+
+        self.tick_recorder = None
+        if self.exch_api.tick_recorders is not None:
+            self.tick_recorder = self.exch_api.tick_recorders.get(self.exch_api.exch_name,
+                                                                  self.pair)
+
+        self.board_slot = None
+        if self.exch_api.price_board is not None:
+            try:
+                self.board_slot = self.exch_api.price_board.slot(self.exch_api.exch_name, self.pair,
+                                                                 create=True)
+                self.exch_api.price_board.hold(self.board_slot)
+            except (RuntimeError, ValueError) as e:
+                uprint(f'[{self.exch_api.exch_name}: {token_symbol}] 警告：{e} 报价不发布到价格板。')
+
+        self.ticks_metric = metrics.WS_TICKS.labels(self.exch_api.exch_name)
+        self.reconnects_metric = metrics.RECONNECTS.labels(f'{self.exch_api.exch_name} price socket')
+
+    async def connect(self):
+        raise NotImplementedError
+
+    def decode_ticker(self, received):
+        raise NotImplementedError
+
+    async def ping(self, ws_handle):
+        await ws_handle.ping()
+
+    async def run(self):
+        ws_handle = await self.connect()
+
+        tps_start = time.time()
+        tps = tps_start
+        lock = asyncio.Lock()
+        # the receive is kept across the timeouts; unlike `wait_for`, `wait`
+        # never loses a cancellation arriving together with a frame
+        receive = None
+
+        try:
+            while True:
+                try:
+                    if receive is None:
+                        receive = asyncio.ensure_future(ws_handle.recv())
+                    done, _ = await asyncio.wait((receive,), timeout=1)
+                    if not done:
+                        # a quiet pair keeps its slot
+                        if self.board_slot is not None:
+                            self.exch_api.price_board.hold(self.board_slot)
+                        continue
+                    finished, receive = receive, None
+                    received = finished.result()
+                    recv_ns = time.time_ns()
+                    if isinstance(received, bytes):
+                        # a binary frame, the control prefixes are text
+                        received = received.decode('utf-8')
+                    ticker = self.decode_ticker(received)
+                except websockets.ConnectionClosed:
+                    break
+                except Exception as e:
+                    uprint(f'Exception in {type(self).__name__}: {e}')
+                    continue
+
+                if ticker is None:
+                    if not received.startswith(self.control_prefixes):
+                        uprint(f'WARNING: discard socket data {received}')
+                    continue
+
+                best_bid, best_ask, exch_ms = ticker
+
+                # have the denomination in USDT
+                if not self.ordered:
+                    self.current_price[0] = best_bid
+                else:
+                    self.current_price[0] = 1 / best_ask
+
+                if self.old_price != self.current_price[0]:
+                    async with lock:
+                        self.event_new_price.set()
+                    self.old_price = self.current_price[0]
+
+                # the bookkeeping comes after the price reached the book
+                self.ticks_metric.inc()
+                if self.tick_recorder is not None:
+                    self.tick_recorder.record(recv_ns, exch_ms, best_bid, best_ask)
+                if self.board_slot is not None:
+                    self.exch_api.price_board.write(self.board_slot, recv_ns, exch_ms,
+                                                    best_bid, best_ask)
+
+                current_tps = time.time()
+                # we need to ping to not lose connection
+                if current_tps - tps > self.ping_interval:
+                    await self.ping(ws_handle)
+                    tps = current_tps
+                    if self.board_slot is not None:
+                        self.exch_api.price_board.hold(self.board_slot)
+
+                if (self.reconnect_interval is not None
+                        and current_tps - tps_start > self.reconnect_interval):
+                    await close_ws(ws_handle)
+                    ws_handle = await self.connect()
+                    self.reconnects_metric.inc()
+                    tps_start = time.time()
+        except asyncio.CancelledError:
+            pass
+        finally:
+            if receive is not None:
+                receive.cancel()
+            await close_ws(ws_handle)
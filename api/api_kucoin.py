@@ -1,9 +1,9 @@
 import asyncio
 import base64
+import collections
 import hashlib
 import hmac
 import json
-import sys
 import time
 import uuid
 from datetime import datetime, timedelta
@@ -11,15 +11,17 @@ from datetime import datetime, timedelta
 import aiohttp
 import websockets
 
-from api.api_general import GeneralAPI
+import fastjson
+import metrics
+from api.api_general import GeneralAPI, PriceSellSocket
 from keys import personal_keys
 from utils import uprint
 
 
 class KucoinAPI(GeneralAPI):
-    def __init__(self):
+    def __init__(self, api_url='https://api.kucoin.com'):
         super().__init__()
-        self.api_url = 'https://api.kucoin.com'
+        self.api_url = api_url
         self.exch_name = 'Kucoin'
         self.session = aiohttp.ClientSession()
 
@@ -41,6 +43,23 @@ class KucoinAPI(GeneralAPI):
         self.has_token_fullnames = True
 
         self.valid_code_on_limit_order = '200000'
+        self.max_orders_multi = 5
+        self.order_rtt_metric = metrics.ORDER_RTT.labels(self.exch_name)
+
+        # fills are pushed on the private order channel, with REST as fallback
+        self.private_socket = KucoinPrivateSocket(self)
+        self.fill_tracker = KucoinFillTracker(self)
+        self.private_socket.add_handler('/spotMarket/tradeOrders',
+                                        self.fill_tracker.on_message)
+        # balances for the exits, pushed on the private balance channel
+        self.balance_cache = KucoinBalanceCache(self)
+        self.private_socket.add_handler('/account/balance',
+                                        self.balance_cache.on_message)
+        self.private_socket_task = asyncio.create_task(self.private_socket.run())
+
+    async def close(self):
+        self.private_socket_task.cancel()
+        await self.session.close()
 
     async def update_pairs(self):
         """
@@ -56,7 +75,7 @@ class KucoinAPI(GeneralAPI):
                        f'in `update_pairs` with message: {await response.text()}')
                 return False
 
-            resp_json = await response.json()
+            resp_json = await response.json(loads=fastjson.loads)
 
             pairs = set()
             pairs_specs = dict()
@@ -86,7 +105,7 @@ class KucoinAPI(GeneralAPI):
                 return False
 
             res = dict()
-            resp_json = await response.json()
+            resp_json = await response.json(loads=fastjson.loads)
 
             # TODO keep not only old name
             # careful that `currency` holds the historical token symbol,
@@ -137,15 +156,21 @@ class KucoinAPI(GeneralAPI):
                        f'in `get_price_sell` with message: {await response.text()}')
                 return False
 
-            resp_json = await response.json()
+            resp_json = await response.json(loads=fastjson.loads)
 
             if good_order:  # A/B with token_sell = A, token_buy = B
                 return float(resp_json['data']['bestBid'])
             else:
                 return 1 / float(resp_json['data']['bestAsk'])
 
-    async def order_limit(self, token_sell, token_buy, max_impact,
-                          amount_sell=None, amount_buy=None, time_in_force='GTC'):
+    async def _prepare_order_limit(self, token_sell, token_buy, max_impact,
+                                   amount_sell=None, amount_buy=None,
+                                   time_in_force='GTC'):
+        """
+        Build the body of a limit order, without sending it. Return False if
+        the order is invalid, else the pair name, the order data and the specs
+        used for the logs.
+        """
         pair_name, good_order = self.find_pair_from_tokens(token_sell, token_buy)
 
         if pair_name is None:
@@ -184,9 +209,6 @@ class KucoinAPI(GeneralAPI):
             max_impact=max_impact
         )
 
-        method = 'POST'
-        endpoint = '/api/v1/orders'
-
         data = {'clientOid': uuid.uuid4().hex,  # use random uuid
                 'symbol': pair_name,
                 'type': 'limit',
@@ -194,72 +216,201 @@ class KucoinAPI(GeneralAPI):
 
         data['price'] = execution_price
         if good_order:  # note A = token_sell, B = token_buy, pair A/B
-            if amount_sell is not None:
-                data['side'] = 'sell'
-                data['size'] = base_amount
-            elif amount_buy is not None:
-                data['side'] = 'sell'
-                data['size'] = base_amount
+            data['side'] = 'sell'
         else:
-            if amount_sell is not None:
-                data['side'] = 'buy'
-                data['size'] = base_amount
-            elif amount_buy is not None:
-                data['side'] = 'buy'
-                data['size'] = base_amount
+            data['side'] = 'buy'
+        data['size'] = base_amount
+
+        specs = {'token_sell': token_sell,
+                 'good_order': good_order,
+                 'amount_sell': amount_sell,
+                 'amount_buy': amount_buy,
+                 'base_amount': base_amount,
+                 'execution_price': execution_price,
+                 'ref_price': ref_price,
+                 'printing': printing}
+
+        return pair_name, data, specs
+
+    def _log_order(self, pair_name, data, specs, resp_json):
+        uprint(specs['printing'])
+
+        uprint(f'[{self.exch_name}: {pair_name}] Specs order (after rounding):\n'
+               f'       good_order: {specs["good_order"]}\n'
+               f'       amount_sell: {specs["amount_sell"]}\n'
+               f'       amount_buy: {specs["amount_buy"]}\n'
+               f'       base_amount: {specs["base_amount"]}\n'
+               f'       execution_price: {specs["execution_price"]}\n'
+               f'       ref_price: {specs["ref_price"]}\n)')
+
+        json_pretty = json.dumps(data, separators=(',', ':'), indent=4)
+        uprint(f'[{self.exch_name}: {pair_name}] data \n'
+               f'   {json_pretty}')
+
+        if resp_json['code'] != '200000':
+            uprint(f'[{self.exch_name}: {pair_name}] FAILED '
+                   f'({resp_json["code"]}: {resp_json})')
+        else:
+            uprint(f'[{self.exch_name}: {pair_name}] Maximum price set at '
+                   f'{specs["execution_price"]:.4f} (price per base currency)')
+            uprint(f'[{self.exch_name}: {pair_name}] SUCCESS sell '
+                   f'{specs["token_sell"]}.')
+
+    async def _submit_order(self, pair_name, data, specs):
+        method = 'POST'
+        endpoint = '/api/v1/orders'
 
         data_jsoned = json.dumps(data)
 
         headers = self.get_headers(full_endpoint=method + endpoint,
                                    data_string=data_jsoned)
+        start = time.perf_counter()
         async with self.session.request(method, url=self.api_url + endpoint,
                                         data=data_jsoned, headers=headers) as response:
-            resp_json = await response.json()
+            resp_json = await response.json(loads=fastjson.loads)
+            self.order_rtt_metric.observe(time.perf_counter() - start)
 
-            uprint(printing)
+            if response.status != 200:
+                uprint(f'[{self.exch_name}: {pair_name}] ERROR: failure in request '
+                       f'in `order_limit` with message: {resp_json["msg"]}')
 
-            uprint(f'[{self.exch_name}: {pair_name}] Specs order (after rounding):\n'
-                   f'       good_order: {good_order}\n'
-                   f'       amount_sell: {amount_sell}\n'
-                   f'       amount_buy: {amount_buy}\n'
-                   f'       base_amount: {base_amount}\n'
-                   f'       execution_price: {execution_price}\n'
-                   f'       ref_price: {ref_price}\n)')
+        self._log_order(pair_name, data, specs, resp_json)
+        if resp_json['code'] == '200000':
+            self.fill_tracker.track(resp_json['data']['orderId'])
 
-            json_pretty = json.dumps(data, separators=(',', ':'), indent=4)
-            uprint(f'[{self.exch_name}: {pair_name}] data \n'
-                   f'   {json_pretty}')
+        return resp_json
+
+    async def _submit_orders_multi(self, pair_name, orders):
+        """
+        Send up to `self.max_orders_multi` orders on the same pair in a single
+        request. Return one response per order, shaped like the response of
+        the single order endpoint.
+        """
+        method = 'POST'
+        endpoint = '/api/v1/orders/multi'
+
+        order_list = []
+        for data, specs in orders:
+            order = dict(data)
+            del order['symbol']
+            order_list.append(order)
+
+        data_jsoned = json.dumps({'symbol': pair_name, 'orderList': order_list})
+
+        headers = self.get_headers(full_endpoint=method + endpoint,
+                                   data_string=data_jsoned)
+        start = time.perf_counter()
+        async with self.session.request(method, url=self.api_url + endpoint,
+                                        data=data_jsoned, headers=headers) as response:
+            resp_json = await response.json(loads=fastjson.loads)
+            self.order_rtt_metric.observe(time.perf_counter() - start)
 
             if response.status != 200:
                 uprint(f'[{self.exch_name}: {pair_name}] ERROR: failure in request '
-                       f'in `order_limit` with message: {resp_json["msg"]}')
+                       f'in `order_limit_batch` with message: {resp_json["msg"]}')
 
+        responses = []
+        for i, (data, specs) in enumerate(orders):
             if resp_json['code'] != '200000':
-                uprint(f'[{self.exch_name}: {pair_name}] FAILED '
-                       f'({resp_json["code"]}: {resp_json})')
-            else:
-                uprint(f'[{self.exch_name}: {pair_name}] Maximum price set at '
-                       f'{execution_price:.4f} (price per base currency)')
-                uprint(f'[{self.exch_name}: {pair_name}] SUCCESS sell {token_sell}.')
-            details = await self.get_order_details(resp_json['data']['orderId'])
-            deal_size = float(details['data']['dealSize'])  # base
-            deal_funds = float(details['data']['dealFunds'])  # quote
-            deal_size_asked = float(details['size'])
-
-            if deal_funds == 0 and deal_size == 0:
-                uprint(f'[{self.exch_name}: {pair_name}] Empty fill for the pair'
-                       f' {pair_name}, try to increase `max_impact` (reference '
-                       f' price was {ref_price:.4f} in the base currency).')
-            elif deal_size != deal_size_asked:
-                uprint(f'[{self.exch_name}: {pair_name}] Partial fill of '
-                       f'{deal_size:.4f} - {deal_funds:.4f} for the pair '
-                       f'{pair_name} (asked {deal_size_asked} for the base).')
+                order_resp = resp_json
             else:
-                uprint(f'[{self.exch_name}: {pair_name}] Complete fill of '
-                       f'{deal_size:.4f} - {deal_funds:.4f} '
-                       f'for the pair {pair_name}.')
+                item = resp_json['data']['data'][i]
+                if item['status'] == 'success':
+                    order_resp = {'code': '200000',
+                                  'data': {'orderId': item['id']}}
+                else:
+                    order_resp = {'code': item['status'],
+                                  'msg': item['failMsg']}
 
-            return resp_json
+            self._log_order(pair_name, data, specs, order_resp)
+            if order_resp['code'] == '200000':
+                self.fill_tracker.track(order_resp['data']['orderId'])
+            responses.append(order_resp)
+
+        return responses
+
+    async def order_limit(self, token_sell, token_buy, max_impact,
+                          amount_sell=None, amount_buy=None, time_in_force='GTC'):
+        prepared = await self._prepare_order_limit(token_sell, token_buy, max_impact,
+                                                   amount_sell, amount_buy,
+                                                   time_in_force)
+        if not prepared:
+            return False
+
+        pair_name, data, specs = prepared
+        resp_json = await self._submit_order(pair_name, data, specs)
+
+        # the fill is awaited separately with `get_fill`
+        return resp_json
+
+    async def order_limit_batch(self, orders):
+        """
+        Orders on the same pair go through the multi-order endpoint, the
+        others are sent concurrently. Fills are not awaited. An order which
+        failed gets its exception as response, the others are still returned.
+        """
+        prepared = await asyncio.gather(*[self._prepare_order_limit(**order)
+                                          for order in orders], return_exceptions=True)
+
+        responses = [False] * len(orders)
+        by_pair = dict()
+        for i, order in enumerate(prepared):
+            if isinstance(order, Exception):
+                uprint(f'[{self.exch_name}] ERROR: order {orders[i]} not prepared: {order!r}')
+                responses[i] = order
+            elif order:
+                pair_name, data, specs = order
+                by_pair.setdefault(pair_name, []).append((i, data, specs))
+
+        indices, submissions = [], []
+        for pair_name, pair_orders in by_pair.items():
+            if len(pair_orders) == 1:
+                i, data, specs = pair_orders[0]
+                indices.append([i])
+                submissions.append(self._submit_order(pair_name, data, specs))
+                continue
+
+            for j in range(0, len(pair_orders), self.max_orders_multi):
+                chunk = pair_orders[j:j + self.max_orders_multi]
+                indices.append([i for i, _, _ in chunk])
+                submissions.append(self._submit_orders_multi(
+                    pair_name, [(data, specs) for _, data, specs in chunk]))
+
+        results = await asyncio.gather(*submissions, return_exceptions=True)
+
+        for chunk_indices, result in zip(indices, results):
+            if isinstance(result, Exception):
+                # the orders of the request may or may not be placed
+                uprint(f'[{self.exch_name}] ERROR: orders {chunk_indices} of the batch failed: {result!r}')
+                result = [result] * len(chunk_indices)
+            elif isinstance(result, dict):  # single order endpoint
+                result = [result]
+            for i, resp in zip(chunk_indices, result):
+                responses[i] = resp
+
+        return responses
+
+    def _log_fill(self, pair_name, details):
+        deal_size = float(details['dealSize'])  # base
+        deal_funds = float(details['dealFunds'])  # quote
+        deal_size_asked = float(details['size'])
+
+        if deal_funds == 0 and deal_size == 0:
+            uprint(f'[{self.exch_name}: {pair_name}] Empty fill for the pair'
+                   f' {pair_name}, try to increase `max_impact`.')
+        elif deal_size != deal_size_asked:
+            uprint(f'[{self.exch_name}: {pair_name}] Partial fill of '
+                   f'{deal_size:.4f} - {deal_funds:.4f} for the pair '
+                   f'{pair_name} (asked {deal_size_asked} for the base).')
+        else:
+            uprint(f'[{self.exch_name}: {pair_name}] Complete fill of '
+                   f'{deal_size:.4f} - {deal_funds:.4f} '
+                   f'for the pair {pair_name}.')
+
+    async def get_fill(self, order_response):
+        details = await self.fill_tracker.get_fill(order_response['data']['orderId'])
+        self._log_fill(details['symbol'], details)
+        return details
 
     async def order_limit_max(self, token_sell, token_buy, max_impact,
                               time_in_force='GTC'):
@@ -268,7 +419,7 @@ class KucoinAPI(GeneralAPI):
         amount available.
         """
 
-        balance, available = await self.get_balance(token_sell)
+        balance, available = await self.get_balance_cached(token_sell)
         resp = await self.order_limit(token_sell, token_buy, max_impact=max_impact,
                                       amount_sell=available, time_in_force=time_in_force)
 
@@ -282,7 +433,7 @@ class KucoinAPI(GeneralAPI):
 
         async with self.session.request(method, url=self.api_url + endpoint,
                                         headers=headers) as response:
-            resp_json = await response.json()
+            resp_json = await response.json(loads=fastjson.loads)
 
             if response.status != 200:
                 uprint(f'[{self.exch_name}] ERROR: failure in request in '
@@ -290,12 +441,12 @@ class KucoinAPI(GeneralAPI):
             return resp_json
 
     async def get_execution_price(self, order_response, denomination, second_token):
-        details = await self.get_order_details(order_response['data']['orderId'])
+        details = await self.get_fill(order_response)
 
         pair_name, good_order = self.find_pair_from_tokens(second_token, denomination)
 
-        deal_size = float(details['data']['dealSize'])
-        deal_funds = float(details['data']['dealFunds'])
+        deal_size = float(details['dealSize'])
+        deal_funds = float(details['dealFunds'])
 
         if deal_funds == 0 and deal_size == 0:
             return False
@@ -321,7 +472,7 @@ class KucoinAPI(GeneralAPI):
                                    data_string='')
         async with self.session.request(method, url=self.api_url + endpoint,
                                         headers=headers) as response:
-            resp_json = await response.json()
+            resp_json = await response.json(loads=fastjson.loads)
 
             if response.status != 200:
                 uprint(f'[{self.exch_name}] ERROR: failure in request in '
@@ -339,12 +490,32 @@ class KucoinAPI(GeneralAPI):
 
             return balance, available
 
-    async def create_ws_handle(self):
+    async def get_balance_cached(self, token_symbol):
+        """
+        Same as `get_balance`, but read from the balance cache when possible.
+        """
+        cached = self.balance_cache.get(token_symbol)
+        if cached is not None:
+            return cached
+
+        requested_at = time.time()
+        balance, available = await self.get_balance(token_symbol)
+        self.balance_cache.seed(token_symbol, balance, available, requested_at)
+
+        return balance, available
+
+    async def create_ws_handle(self, private=False):
         method = 'POST'
-        endpoint = '/api/v1/bullet-public'
+        if private:
+            endpoint = '/api/v1/bullet-private'
+            headers = self.get_headers(full_endpoint=method + endpoint)
+        else:
+            endpoint = '/api/v1/bullet-public'
+            headers = None
         async with aiohttp.ClientSession() as session:
-            async with session.request(method, url=self.api_url + endpoint) as res:
-                res_json = await res.json()
+            async with session.request(method, url=self.api_url + endpoint,
+                                       headers=headers) as res:
+                res_json = await res.json(loads=fastjson.loads)
                 token = res_json['data']['token']
                 ws_endpoint = res_json['data']['instanceServers'][0]['endpoint']
                 connect_id = str(int(time.time() * 1000))
@@ -362,79 +533,240 @@ class KucoinAPI(GeneralAPI):
         }
         return json.dumps(data)
 
+    def get_private_subscription_data_ws(self, topic):
+        data = {
+            'id': int(time.time() * 1000),
+            'type': 'subscribe',
+            'topic': topic,
+            'privateChannel': True
+        }
+        return json.dumps(data)
+
+
+class KucoinPriceSellSocket(PriceSellSocket):
+    # the token of the socket is valid only 24 hours, 500 seconds before to be safe
+    reconnect_interval = 60 * 60 * 24 - 500
+
+    async def connect(self):
+        ws_handle = await self.exch_api.create_ws_handle()
+        data_subscription = self.exch_api.get_subscription_data_ws(self.pair)
+        await ws_handle.send(data_subscription)
+        return ws_handle
+
+    def decode_ticker(self, received):
+        return fastjson.decode_ticker(received)
+
 
-class KucoinPriceSellSocket:
-    def __init__(self, exch_api, token_symbol, current_price, event_new_price):
-        self.old_price = -1
-        self.current_price = [current_price]
+class KucoinPrivateSocket:
+    """
+    Connection to the private channels of the account. Each message is passed
+    to the handler registered for its topic, the connection is reopened when
+    it drops.
+    """
+    def __init__(self, exch_api):
         self.exch_api = exch_api
+        self.handlers = dict()
+        self.connected = False
+        # incremented on each connection, data pushed before is not trusted
+        self.epoch = 0
         self.day_duration = 60 * 60 * 24 - 500  # 500 seconds before to be safe
 
-        self.token_symbol = token_symbol
-        self.pair, self.ordered = self.exch_api.find_pair_from_tokens('USDT',
-                                                                      token_symbol)
+    def add_handler(self, topic, handler):
+        self.handlers[topic] = handler
 
-        self.event_new_price = event_new_price
-
-        if self.ordered is None:
-            uprint(f'ERROR: pair of USDT and {token_symbol} do not exist at'
-                   f'this point although it should.')
-            sys.exit(1)
+    async def _connect(self):
+        ws_handle = await self.exch_api.create_ws_handle(private=True)
+        for topic in self.handlers:
+            await ws_handle.send(self.exch_api.get_private_subscription_data_ws(topic))
+        return ws_handle
 
     async def run(self):
-        ws_handle = await self.exch_api.create_ws_handle()
-        data_subscription = self.exch_api.get_subscription_data_ws(self.pair)
-        await ws_handle.send(data_subscription)
+        while True:
+            try:
+                ws_handle = await self._connect()
+            except asyncio.CancelledError:
+                return
+            except Exception as e:
+                uprint(f'[{self.exch_name}] Private socket unavailable ({e}), '
+                       f'retry in 10 seconds.')
+                await asyncio.sleep(10)
+                continue
+
+            self.epoch += 1
+            if self.epoch > 1:
+                metrics.RECONNECTS.labels(f'{self.exch_name} private socket').inc()
+            self.connected = True
+            tps_start = time.time()
+            tps = tps_start
+            try:
+                while True:
+                    try:
+                        received = await asyncio.wait_for(ws_handle.recv(), timeout=1)
+                        received_json = fastjson.loads(received)
+                    except asyncio.TimeoutError:
+                        received_json = None
+                    except websockets.ConnectionClosed:
+                        break
+
+                    if received_json is not None and received_json.get('topic') in self.handlers:
+                        self.handlers[received_json['topic']](received_json['data'])
+
+                    current_tps = time.time()
+                    # we need to ping to not lose connection
+                    if current_tps - tps > 8:
+                        await ws_handle.ping()
+                        tps = current_tps
+
+                    # the token is valid only 24 hours
+                    if current_tps - tps_start > self.day_duration:
+                        break
+            except asyncio.CancelledError:
+                return
+            except Exception as e:
+                uprint(f'[{self.exch_name}] Exception in KucoinPrivateSocket: {e}')
+            finally:
+                self.connected = False
+                await ws_handle.close()
+
+    @property
+    def exch_name(self):
+        return self.exch_api.exch_name
+
+
+class KucoinFillTracker:
+    """
+    Follow the orders on the private order channel and hand out a future for
+    the fill details of each one. The details have the fields of the REST
+    order details used by the bot (`symbol`, `size`, `dealSize`, `dealFunds`).
+    """
+    def __init__(self, exch_api, rest_timeout=2, max_done=1000):
+        self.exch_api = exch_api
+        self.rest_timeout = rest_timeout
+        self.max_done = max_done
 
-        tps_start = time.time()
-        tps = tps_start
-        lock = asyncio.Lock()
-
-        try:
-            while True:
-                try:
-                    received = await asyncio.wait_for(ws_handle.recv(), timeout=1)
-                    received_json = json.loads(received)
-                except asyncio.TimeoutError:
-                    continue
-                except websockets.ConnectionClosed:
-                    break
-                except Exception as e:
-                    uprint(f'Exception in KucoinPriceSellSocket: {e}')
-                    continue
-
-                if 'topic' not in received_json:
-                    uprint(f'WARNING: discard socket data {received_json}')
-                    continue
-
-                # have the denomination in USDT
-                if not self.ordered:
-                    self.current_price[0] = float(received_json['data']['bestBid'])
-                else:
-                    self.current_price[0] = 1 / float(received_json['data']['bestAsk'])
-
-                if self.old_price != self.current_price[0]:
-                    async with lock:
-                        self.event_new_price.set()
-                    self.old_price = self.current_price[0]
-
-                current_tps = time.time()
-                # we need to ping to not lose connection
-                if current_tps - tps > 8:
-                    await ws_handle.ping()
-                    tps = current_tps
-
-                # the token is valid only 24 hours
-                if current_tps - tps_start > self.day_duration:
-                    await ws_handle.close()
-                    ws_handle = await self.exch_api.create_ws_handle()
-                    data_subscription = self.exch_api.get_subscription_data_ws(self.pair)
-                    await ws_handle.send(data_subscription)
-                    tps_start = time.time()
-        except asyncio.CancelledError:
-            pass
-        finally:
-            await ws_handle.close()
+        self.pending = dict()  # order id -> future of the details
+        self.deals = dict()  # order id -> [deal size, deal funds]
+        # orders may be done before being tracked, for IOC orders especially
+        self.done = collections.OrderedDict()
+
+    def on_message(self, data):
+        order_id = data['orderId']
+
+        if data['type'] == 'match':
+            deal = self.deals.setdefault(order_id, [0., 0.])
+            deal[0] += float(data['matchSize'])
+            deal[1] += float(data['matchSize']) * float(data['matchPrice'])
+
+        if data['status'] != 'done':
+            return
+
+        deal_size, deal_funds = self.deals.pop(order_id, [0., 0.])
+        details = {'id': order_id,
+                   'symbol': data['symbol'],
+                   'size': float(data['size']),
+                   'dealSize': float(data['filledSize']),
+                   'dealFunds': deal_funds}
+
+        self.done[order_id] = details
+        if len(self.done) > self.max_done:
+            self.done.popitem(last=False)
+
+        future = self.pending.pop(order_id, None)
+        if future is not None and not future.done():
+            future.set_result(details)
+
+    def track(self, order_id):
+        """
+        Return the future of the fill details of the order.
+        """
+        if order_id in self.pending:
+            return self.pending[order_id]
+
+        future = asyncio.get_event_loop().create_future()
+        if order_id in self.done:
+            future.set_result(self.done[order_id])
+        else:
+            self.pending[order_id] = future
+        return future
+
+    async def get_fill(self, order_id):
+        future = self.track(order_id)
+
+        if self.exch_api.private_socket.connected or future.done():
+            try:
+                return await asyncio.wait_for(asyncio.shield(future),
+                                              timeout=self.rest_timeout)
+            except asyncio.TimeoutError:
+                uprint(f'[{self.exch_api.exch_name}] No fill pushed for order '
+                       f'{order_id}, fallback on REST.')
+
+        self.pending.pop(order_id, None)
+        details = await self.exch_api.get_order_details(order_id)
+        return details['data']
+
+
+class KucoinBalanceCache:
+    """
+    Balances of the trade account, updated from the private balance channel
+    and seeded by REST on a miss. Entries are only valid as long as the
+    private socket connection they were received on is up.
+    """
+    def __init__(self, exch_api):
+        self.exch_api = exch_api
+        # currency -> (balance, available, update time, socket epoch)
+        self.balances = dict()
+
+    def on_message(self, data):
+        if not data['relationEvent'].startswith('trade'):
+            return
+
+        self.balances[data['currency']] = (float(data['total']),
+                                           float(data['available']),
+                                           time.time(),
+                                           self.exch_api.private_socket.epoch)
+
+    def seed(self, token_symbol, balance, available, requested_at):
+        """
+        Store a balance fetched by REST at `requested_at`, unless a more recent
+        update was pushed in the meantime.
+        """
+        private_socket = self.exch_api.private_socket
+        if not private_socket.connected:
+            return
+
+        entry = self.balances.get(token_symbol)
+        if entry is not None and entry[3] == private_socket.epoch and entry[2] > requested_at:
+            return
+
+        self.balances[token_symbol] = (balance, available, time.time(),
+                                       private_socket.epoch)
+
+    def get(self, token_symbol):
+        """
+        Return the balance and available amount, or None if not known.
+        """
+        entry = self.balances.get(token_symbol)
+        private_socket = self.exch_api.private_socket
+        if (entry is None or not private_socket.connected
+                or entry[3] != private_socket.epoch):
+            return None
+        return entry[0], entry[1]
+
+    def staleness(self, token_symbol=None):
+        """
+        Seconds since the last update of the token, or of the oldest valid
+        entry if no token is given. None if nothing valid is cached.
+        """
+        if token_symbol is not None:
+            if self.get(token_symbol) is None:
+                return None
+            return time.time() - self.balances[token_symbol][2]
+
+        valid = [entry[2] for token, entry in self.balances.items()
+                 if self.get(token) is not None]
+        if not valid:
+            return None
+        return time.time() - min(valid)
 
 
 if __name__ == '__main__':
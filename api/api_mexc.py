@@ -7,17 +7,20 @@ import time
 import urllib
 import uuid
 
+import websockets
 from websocket import create_connection
 
+import fastjson
 from keys import personal_keys
 from utils import keysort, round_nearest, uprint
 
-from api.api_general import GeneralAPI
+from api.api_general import GeneralAPI, PriceSellSocket
 
 class MEXC_API(GeneralAPI):
-    def __init__(self):
+    def __init__(self, api_url='https://www.mexc.com', ws_url='wss://wbs.mexc.com/raw/ws'):
         super().__init__()
-        self.api_url = 'https://www.mexc.com'
+        self.api_url = api_url
+        self.ws_url = ws_url
         self.exch_name = 'MEXC'
         self.session = requests.Session()
 
@@ -29,6 +32,8 @@ class MEXC_API(GeneralAPI):
 
         self.pairs_separator = '_'
 
+        # the price socket works, but not along the blocking REST calls of
+        # this api: the reactions poll the REST prices until they are async
         self.support_websocket = False
         self.has_token_fullnames = True
 
@@ -372,6 +377,45 @@ class MEXC_API(GeneralAPI):
 
         return balance, available
 
+    async def create_ws_handle(self):
+        return await websockets.connect(self.ws_url)
+
+    def get_subscription_data_ws(self, pair):
+        data = {
+            'op': 'sub.limit.depth',
+            'symbol': pair,
+            'depth': 5
+        }
+        return json.dumps(data)
+
+
+class MEXCPriceSellSocket(PriceSellSocket):
+    """
+    Top of the book pushed on the limited depth channel.
+    """
+    ping_interval = 10
+    control_prefixes = ('{"channel":"pong"', '{"channel":"rs.')
+
+    async def connect(self):
+        ws_handle = await self.exch_api.create_ws_handle()
+        data_subscription = self.exch_api.get_subscription_data_ws(self.pair)
+        await ws_handle.send(data_subscription)
+        return ws_handle
+
+    def decode_ticker(self, received):
+        received_json = fastjson.loads(received)
+        if received_json.get('channel') != 'push.limit.depth':
+            return None
+
+        data = received_json['data']
+        if not data['bids'] or not data['asks']:
+            return None
+        return (float(data['bids'][0][0]), float(data['asks'][0][0]),
+                received_json.get('ts', 0))
+
+    async def ping(self, ws_handle):
+        await ws_handle.send('{"op":"ping"}')
+
 
 if __name__ == '__main__':
     mexc = MEXC_API()
@@ -0,0 +1,96 @@
+import collections
+import re
+
+import fastjson
+
+# an article of the catalog embedded in the announcement page
+ARTICLE_RE = re.compile(r'"id":(\d+),"code":"[^"]*","title":"((?:[^"\\]|\\.)*)"')
+
+
+def parse_page(text, n=15):
+    """
+    First `n` articles of the announcement page, newest first, as dicts with
+    an `id` and a `title`.
+    """
+    articles = []
+    # str.find skips the markup much faster than the regex would
+    start = text.find('"id":')
+    if start < 0:
+        return articles
+    for match in ARTICLE_RE.finditer(text, start):
+        title = match.group(2)
+        if '\\' in title:
+            title = fastjson.loads(f'"{title}"')
+        articles.append({'id': int(match.group(1)), 'title': title})
+        if len(articles) == n:
+            break
+    return articles
+
+
+def parse_catalog(text, n=15):
+    """
+    First `n` articles of a catalog API response, newest first, as they are
+    (with an `id` and a `title` among other fields).
+    """
+    return fastjson.loads(text)['data']['articles'][:n]
+
+
+class ArticleDiff:
+    """
+    Ids of the articles already seen, the `max_ids` most recent ones. `new`
+    returns the articles of a listing not seen before, all of them when
+    several were published between two polls.
+    """
+    def __init__(self, max_ids=1000):
+        self.max_ids = max_ids
+        self.seen = collections.OrderedDict()
+
+    def new(self, articles):
+        new_articles = []
+        for article in articles:
+            if article['id'] in self.seen:
+                continue
+            self.seen[article['id']] = None
+            if len(self.seen) > self.max_ids:
+                self.seen.popitem(last=False)
+            new_articles.append(article)
+        return new_articles
+
+
+if __name__ == '__main__':
+    import hashlib
+    import json
+    import timeit
+
+    from utils import uprint
+
+    articles = [{'id': 200000 - i, 'code': f'{i:032x}', 'title': f'Binance Will List Token{i} (TOK{i})',
+                 'type': 1, 'releaseDate': 1700000000000 - i} for i in range(15)]
+    catalog = json.dumps({'catalogId': 48, 'articles': articles}, separators=(',', ':'))
+    # the real page is a few hundred kB of markup around the embedded catalog
+    page = ('<html><head>' + '<meta name="x" content="y">' * 8000 + '</head><body>'
+            f'<script id="__APP_DATA">{catalog}</script></body></html>')
+    catalog_body = json.dumps({'code': '000000', 'data': {'articles': articles}},
+                              separators=(',', ':'))
+
+    assert [article['id'] for article in parse_page(page)] == [article['id'] for article in articles]
+    assert [(article['id'], article['title']) for article in parse_catalog(catalog_body)] == \
+        [(article['id'], article['title']) for article in parse_page(page)]
+
+    diff = ArticleDiff()
+    diff.new(parse_page(page))
+    n = 2000
+    benches = [
+        ('page, sha256 of the body',
+         lambda: hashlib.sha256(page.encode('utf-8')).hexdigest()),
+        ('page, top 15 diff',
+         lambda: diff.new(parse_page(page))),
+        ('catalog, loads + sha256 of [0]',
+         lambda: hashlib.sha256(fastjson.loads(catalog_body)['data']['articles'][0]['title']
+                                .encode('utf-8')).hexdigest()),
+        ('catalog, top 15 diff',
+         lambda: diff.new(parse_catalog(catalog_body))),
+    ]
+    uprint(f'page of {len(page) // 1000} kB, catalog of {len(catalog_body) // 1000} kB')
+    for name, bench in benches:
+        uprint(f'{name:>32}: {timeit.timeit(bench, number=n) / n * 1e6:8.1f} µs')
@@ -0,0 +1,233 @@
+import asyncio
+import contextlib
+import io
+import itertools
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+
+from api.api_general import GeneralAPI
+from position_book import DEFAULT_STRATEGY
+from react import react_on_announcement
+
+
+class FakeExchangeAPI(GeneralAPI):
+    """
+    Exchange replaying a stream of highest bids for one token against USDT.
+    Orders are filled at once at the current bid, there is no order book.
+    """
+    def __init__(self, ticks, token_symbol='HEHE', token_name='hehe'):
+        super().__init__()
+        self.exch_name = 'Backtest'
+        self.pairs_separator = '-'
+        self.token_symbol = token_symbol
+
+        pair_name = token_symbol + '-USDT'
+        self.pairs = {pair_name}
+        self.pairs_specs = {pair_name: {'baseIncrement': 1e-8,
+                                        'quoteIncrement': 1e-8,
+                                        'priceIncrement': 1e-8}}
+        self.listed_tokens = {token_symbol: token_name}
+
+        self.support_websocket = True
+        self.has_token_fullnames = True
+        self.valid_code_on_limit_order = '200000'
+
+        self.ticks = ticks
+        self.cursor = 0
+        self.tick_time = time.perf_counter()
+
+        self.balances = {'USDT': 0., token_symbol: 0.}
+        self.fills = []  # (order id, side, size, price, decision latency)
+
+    @property
+    def price(self):
+        return float(self.ticks[self.cursor])
+
+    async def get_price_sell(self, token_sell, token_buy):
+        if token_sell == self.token_symbol:
+            return self.price
+        return 1 / self.price
+
+    async def order_limit(self, token_sell, token_buy, max_impact,
+                          amount_sell=None, amount_buy=None, time_in_force='GTC'):
+        price = self.price
+        if token_sell == 'USDT':
+            side, size = 'buy', amount_sell / price
+            self.balances['USDT'] -= amount_sell
+            self.balances[self.token_symbol] += size
+        else:
+            side, size = 'sell', amount_sell
+            self.balances[self.token_symbol] -= size
+            self.balances['USDT'] += size * price
+
+        order_id = str(len(self.fills))
+        self.fills.append((order_id, side, size, price,
+                           time.perf_counter() - self.tick_time))
+
+        return {'code': '200000', 'data': {'orderId': order_id}}
+
+    async def order_limit_max(self, token_sell, token_buy, max_impact,
+                              time_in_force='GTC'):
+        balance, available = await self.get_balance(token_sell)
+        return await self.order_limit(token_sell, token_buy, max_impact,
+                                      amount_sell=available,
+                                      time_in_force=time_in_force)
+
+    async def get_fill(self, order_response):
+        order_id, side, size, price, _ = self.fills[int(order_response['data']['orderId'])]
+        return {'symbol': self.token_symbol + '-USDT', 'size': size,
+                'dealSize': size, 'dealFunds': size * price}
+
+    async def get_execution_price(self, order_response, denomination, second_token):
+        details = await self.get_fill(order_response)
+        return details['dealFunds'] / details['dealSize']
+
+    async def get_balance(self, token_symbol):
+        return self.balances[token_symbol], self.balances[token_symbol]
+
+
+class FakePriceSellSocket:
+    """
+    Same contract as the exchange price sockets, pushes the ticks of the fake
+    exchange as fast as the strategy consumes them.
+    """
+    def __init__(self, exch_api, token_symbol, current_price, event_new_price,
+                 yields_per_tick=4):
+        self.exch_api = exch_api
+        self.token_symbol = token_symbol
+        self.current_price = [current_price]
+        self.event_new_price = event_new_price
+        self.yields_per_tick = yields_per_tick
+        self.finished = asyncio.Event()
+
+    async def run(self):
+        try:
+            for i in range(self.exch_api.cursor + 1, len(self.exch_api.ticks)):
+                self.exch_api.cursor = i
+                self.exch_api.tick_time = time.perf_counter()
+                self.current_price[0] = self.exch_api.price
+                self.event_new_price.set()
+
+                # let the book evaluate the tick and send the exit order
+                for _ in range(self.yields_per_tick):
+                    await asyncio.sleep(0)
+        finally:
+            self.finished.set()
+
+
+def synthetic_ticks(n_ticks=2000, start=1., pump=2.5, volatility=0.01, seed=None):
+    """
+    Highest bids after a listing: a pump up to `pump` times the start price
+    during the first quarter of the ticks, then a slow bleed, with noise.
+    """
+    rng = np.random.default_rng(seed)
+    n_pump = n_ticks // 4
+    drift = np.concatenate([np.full(n_pump, np.log(pump) / n_pump),
+                            np.full(n_ticks - n_pump, -np.log(pump) / (n_ticks - n_pump))])
+    log_price = np.cumsum(drift + volatility * rng.standard_normal(n_ticks))
+    return start * np.exp(log_price - log_price[0])
+
+
+async def replay_event(ticks, strategy=None, amount_sell=130):
+    """
+    Replay one announcement on the ticks, return the outcome of the trade.
+    """
+    strategy = dict(DEFAULT_STRATEGY, rest_warmup=0, **(strategy or {}))
+    exch_api = FakeExchangeAPI(ticks)
+    exch_api.balances['USDT'] = amount_sell
+
+    sockets = []
+
+    def socket_class(*args):
+        sockets.append(FakePriceSellSocket(*args))
+        return sockets[-1]
+
+    start = time.perf_counter()
+    reaction = asyncio.create_task(react_on_announcement(exch_api, socket_class, exch_api.token_symbol,
+                                                         'hehe', 0.1, amount_sell, strategy=strategy))
+    while not sockets and not reaction.done():
+        await asyncio.sleep(0)
+
+    if sockets:
+        finished = asyncio.create_task(sockets[0].finished.wait())
+        await asyncio.wait([reaction, finished], return_when=asyncio.FIRST_COMPLETED)
+        finished.cancel()
+
+    if reaction.done():
+        exit_reason = reaction.result()
+    else:
+        exit_reason = 'end'  # still holding at the end of the ticks
+        reaction.cancel()
+        await asyncio.gather(reaction, return_exceptions=True)
+
+    buy = exch_api.fills[0]
+    position = exch_api.balances[exch_api.token_symbol] * exch_api.price
+    pnl = exch_api.balances['USDT'] + position - amount_sell
+
+    return {'exit_reason': exit_reason,
+            'pnl': pnl,
+            'return': pnl / amount_sell,
+            'entry_price': buy[3],
+            'exit_price': exch_api.fills[-1][3] if len(exch_api.fills) > 1 else None,
+            'decision_latency': exch_api.fills[-1][4] if len(exch_api.fills) > 1 else None,
+            'ticks': exch_api.cursor + 1,
+            'replay_time': time.perf_counter() - start}
+
+
+def replay(events, strategy=None, quiet=True):
+    """
+    Replay each tick stream of `events` as one announcement.
+    """
+    async def replay_all():
+        return [await replay_event(ticks, strategy) for ticks in events]
+
+    if not quiet:
+        return asyncio.run(replay_all())
+
+    with contextlib.redirect_stdout(io.StringIO()):
+        return asyncio.run(replay_all())
+
+
+def _replay_params(args):
+    events, strategy = args
+    results = replay(events, strategy)
+    reasons = [res['exit_reason'] for res in results]
+    return {'strategy': strategy,
+            'mean_return': float(np.mean([res['return'] for res in results])),
+            'exits': {reason: reasons.count(reason) for reason in set(reasons)}}
+
+
+def sweep(events, grid, processes=None):
+    """
+    Replay the events for each combination of the strategy parameters in
+    `grid` (parameter name -> list of values), over a process pool.
+    """
+    names = list(grid.keys())
+    strategies = [dict(zip(names, values))
+                  for values in itertools.product(*grid.values())]
+
+    with ProcessPoolExecutor(max_workers=processes) as executor:
+        return list(executor.map(_replay_params,
+                                 [(events, strategy) for strategy in strategies]))
+
+
+if __name__ == '__main__':
+    events = [synthetic_ticks(seed=seed) for seed in range(20)]
+
+    start = time.perf_counter()
+    results = replay(events)
+    duration = time.perf_counter() - start
+    n_ticks = sum(res['ticks'] for res in results)
+    print(f'Replayed {len(events)} events ({n_ticks} ticks) in {duration:.2f} s')
+    for res in results:
+        latency = res['decision_latency']
+        print(f"    {res['exit_reason']:>8}  return {res['return']:+.3f}  "
+              f"latency {latency * 1e6 if latency else float('nan'):.0f} us")
+
+    grid = {'floor_factor': [0.9, 0.94, 0.97],
+            'ceil_factor': [1.5, 2., 3.],
+            'trailing_factor': [0.8, 0.9, 0.95]}
+    for res in sorted(sweep(events, grid), key=lambda res: -res['mean_return'])[:5]:
+        print(f"{res['mean_return']:+.3f}  {res['strategy']}  {res['exits']}")
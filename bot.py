@@ -1,106 +1,236 @@
+import argparse
 import asyncio
-import hashlib
-import json
+import time
 
 import aiohttp
-import aiohttp_socks
 
+import metrics
 from api.api_kucoin import KucoinAPI, KucoinPriceSellSocket
+from article_diff import ArticleDiff, parse_catalog, parse_page
+from decision import TradeDecider
+from dedup_store import DedupStore
+from poll_scheduler import PollScheduler
+from price_board import BoardPriceSellSocket, PriceBoard, start_feed
+from position_book import PositionBook
+from profiler import SamplingProfiler
 from react import react_on_announcement
 from regex_title import RegexTitle
+from supervisor import TaskSupervisor, rss_bytes
+from tick_recorder import TickRecorderPool
+from egress import EgressPool
+from event_loop import LOOPS, run
+from ingestion import AnnouncementIngestion, create_source
+from loop_monitor import LoopMonitor
+from offload import MODES, Offloader
 from utils import uprint
 
 
 class RefreshAnnouncements:
-    def __init__(self, exchs_apis, exchs_apis_sockets):
-        self.url = 'https://www.binance.com/en/support/announcement/c-48'
-        self.second_url = 'https://www.binance.com/bapi/composite/v1/public/cms/article/catalog/list/query?catalogId=48&pageNo=1&pageSize=15'
-        proxy_url = 'socks5://host.docker.internal:7897'
-        self.connector = aiohttp_socks.ProxyConnector.from_url(proxy_url)
+    def __init__(self, exchs_apis, exchs_apis_sockets, position_book=None, strategy=None,
+                 url='https://www.binance.com/en/support/announcement/c-48',
+                 second_url='https://www.binance.com/bapi/composite/v1/public/cms/article/catalog/list/query?catalogId=48&pageNo=1&pageSize=15',
+                 egresses=('socks5://host.docker.internal:7897',), egress_selection='round_robin',
+                 n_lanes=None, dedup_path=None, offload=None):
+        self.url = url
+        self.second_url = second_url
         timeout = aiohttp.ClientTimeout(total=10)
-        self.session = aiohttp.ClientSession(connector=self.connector, timeout=timeout)
+        headers = {'Cache-Control': 'no-cache, no-store, public, must-revalidate, proxy-revalidate, max-age=0',
+                   'Pragma': 'no-cache',
+                   'Expires': '0'}
+        # the polls are spread on the egresses, from `n_lanes` concurrent lanes
+        self.egress_pool = EgressPool(egresses, selection=egress_selection, timeout=timeout,
+                                      headers=headers)
+        self.n_lanes = n_lanes or len(self.egress_pool)
         self.regex_title = RegexTitle()
         self.exchs_apis = exchs_apis
         self.exchs_apis_sockets = exchs_apis_sockets
+        self.decider = TradeDecider({exch_name: exchs_apis[exch_name] for exch_name in exchs_apis_sockets})
+        self.position_book = position_book
+        self.strategy = strategy
+        # owner of the reactions and of the tasks of their positions
+        self.supervisor = TaskSupervisor()
+
+        # the page every ~0.04 s and the catalog every 13th poll, at most
+        # 25 polls per second, for each egress
+        self.scheduler = PollScheduler({'page': 0.04 * 13 / 12, 'catalog': 0.04 * 13},
+                                       budget=25)
+        # (polls, round trip time, parse time, empty parses) of each endpoint
+        self.poll_metrics = {endpoint: (metrics.POLLS.labels(endpoint), metrics.POLL_RTT.labels(endpoint),
+                                        metrics.PARSE_TIME.labels(endpoint),
+                                        metrics.EMPTY_PARSES.labels(endpoint))
+                             for endpoint in self.scheduler.endpoints}
+        # endpoints whose responses hold no article, warned once
+        self.blind_endpoints = set()
 
-        self.checksum = ['', '']
+        # the first `n_articles` of the page and of the catalog are compared
+        # with the ids already seen
+        self.n_articles = 15
+        self.article_diff = ArticleDiff()
+        # large bodies may be parsed out of the loop thread
+        self.offload = offload or Offloader()
         self.title = ''
-        self.titles = []
-        self.ind = 0
+        # titles and ids already seen, kept across restarts when a path is
+        # given; an empty store is seeded by the first poll without reacting
+        self.dedup = DedupStore(dedup_path)
+        self.seeded = len(self.dedup) > 0
+        # the detector whose first page seeds an empty store
+        self.seed_source = None
+
+        # pause after a reaction, and time of the last detection
+        self.cooldown = 10
+        self.detected_at = None
 
     def react_announcement(self, symbols, token_names):
-        for i in range(len(symbols)):
-            for exch_name in self.exchs_apis_sockets.keys():
-                task = react_on_announcement(self.exchs_apis[exch_name], self.exchs_apis_sockets[exch_name],
-                                             symbols[i], token_names[i], 0.1, 130)
-                asyncio.create_task(task)
+        # a reaction outliving its position deadline by a minute is stuck
+        max_hold = (self.strategy or {}).get('max_hold')
+        deadline = None if max_hold is None else max_hold + 60
+        for exch_name, symbol, token_name in self.decider.decide(symbols, token_names):
+            task = react_on_announcement(self.exchs_apis[exch_name], self.exchs_apis_sockets[exch_name],
+                                         symbol, token_name, 0.1, 130,
+                                         position_book=self.position_book, strategy=self.strategy,
+                                         checked=True, detected_at=self.detected_at,
+                                         supervisor=self.supervisor)
+            self.supervisor.spawn(task, f'react {exch_name}: {symbol}', 'reaction', deadline)
 
     async def get_announcement(self):
-        headers = {'Cache-Control': 'no-cache, no-store, public, must-revalidate, proxy-revalidate, max-age=0',
-                   'Pragma': 'no-cache',
-                   'Expires': '0'}
-
-        await asyncio.sleep(0.04)
-        self.ind += 1
-        if self.ind == 13:
-            self.ind = 0
+        """
+        Poll the page or the catalog, return the articles not seen before.
+        """
+        self.scheduler.capacity = max(1, len(self.egress_pool.healthy()))
+        endpoint = await self.scheduler.acquire()
+        if endpoint == 'catalog':
             current_url = self.second_url
-            from_title = True
-            index = 1
+            parse = parse_catalog
         else:
             current_url = self.url
-            from_title = False
-            index = 0
+            parse = parse_page
+        polls_metric, rtt_metric, parse_metric, empty_metric = self.poll_metrics[endpoint]
+        polls_metric.inc()
 
+        egress = self.egress_pool.select()
+        generation = egress.supervisor.generation
+        start = time.perf_counter()
         try:
-            async with self.session.get(current_url, headers=headers) as r:
+            async with egress.session.get(current_url) as r:
                 r_text = await r.text()
-        except aiohttp.ClientError as e:
-            uprint(e)
-            self.session = aiohttp.ClientSession(connector=self.connector)
-            uprint(f'可能连接中断，重新启动会话。')
+        except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+            uprint(f'[{egress.name}] {e!r}')
+            delay = egress.report(None)
+            if not self.egress_pool.healthy():
+                self.scheduler.report(endpoint, None)
+            uprint(f'可能连接中断，重建该出口的会话，退避 {delay:.1f} 秒。')
+            await egress.supervisor.rebuild(generation)
+            return []
 
+        delay = egress.report(r.status, time.perf_counter() - start, r.headers)
         if r.status != 200:
             uprint(current_url)
             uprint(r_text)
-            await asyncio.sleep(5 * 60)
-            uprint(f'返回码错误，休眠5分钟后继续。')
-
-        if from_title:
-            try:
-                r_text = json.loads(r_text)['data']['articles'][0]['title']
-            except Exception as e:
-                uprint(f'{e}, 响应文本: {r_text}')
+            # other egresses take the traffic, the endpoint only backs off
+            # when none is left
+            if delay == 0 or not self.egress_pool.healthy():
+                delay = self.scheduler.report(endpoint, r.status, r.headers)
+            uprint(f'[{egress.name}] 返回码错误（{r.status}），退避 {delay:.1f} 秒，其余出口或端点继续。')
+            return []
+        self.scheduler.report(endpoint, r.status)
+        parse_start = time.perf_counter()
+        rtt_metric.observe(parse_start - start)
 
-        newchecksum = hashlib.sha256(r_text.encode('utf-8')).hexdigest()
+        try:
+            articles = await self.offload.run(parse, r_text, self.n_articles)
+        except Exception as e:
+            uprint(f'{e!r}, 响应文本: {r_text}')
+            return []
 
-        if newchecksum != self.checksum[index]:
-            self.checksum[index] = newchecksum
-            return True, r_text, from_title
+        # the page parser expects a given markup, a change leaves it blind
+        if not articles and r_text:
+            empty_metric.inc()
+            if endpoint not in self.blind_endpoints:
+                self.blind_endpoints.add(endpoint)
+                uprint(f'警告：{endpoint} 的响应中找不到任何公告，可能格式已变化：{r_text[:200]}')
+        elif endpoint in self.blind_endpoints:
+            self.blind_endpoints.discard(endpoint)
+            uprint(f'{endpoint} 的响应中重新找到公告。')
 
-        return False, r_text, from_title
+        # a late response of an older listing only has ids already seen
+        new_articles = self.article_diff.new(articles)
+        parse_metric.observe(time.perf_counter() - parse_start)
+        return new_articles
 
     async def run(self):
-        uprint(f'开始循环刷新公告。')
-        while True:
-            is_new, r_text, from_title = await self.get_announcement()
-            if is_new:
-                new_title, symbols, token_names = self.regex_title.find_token(r_text, from_title=from_title)
-                if self.title == '':
-                    self.title = new_title
-                    self.titles.append(self.title)
+        uprint(f'开始循环刷新公告（{len(self.egress_pool)} 个出口，{self.n_lanes} 条轮询通道）。')
+        await asyncio.gather(*[self.poll_lane() for _ in range(self.n_lanes)])
+
+    def on_title(self, new_title, symbols, token_names, detected_at, article_id=None):
+        """
+        React to a title if it is new, return True if it was.
+        """
+        self.title = new_title
+
+        # the same title may come again from another endpoint or source
+        if not self.dedup.check_and_add(new_title, article_id):
+            return False
+
+        self.detected_at = detected_at
+        uprint(f'[**** 警报 ****] Binance 公告中检测到新新闻：\n        {self.title}')
+        uprint(f'检测到的符号：\n        {symbols}')
+        uprint(f'检测到的代币名称：\n        {token_names}')
+
+        self.react_announcement(symbols, token_names)
+        return True
 
-                self.title = new_title
+    def on_articles(self, articles, detected_at):
+        """
+        React to the new articles of a poll, oldest first. The articles of the
+        first poll seed an empty store without any reaction.
+        """
+        if not self.seeded:
+            for article in articles:
+                self.dedup.check_and_add(article['title'], article['id'])
+            self.seeded = True
+            return False
 
-                if self.title in self.titles:
-                    continue
+        reacted = False
+        for article in reversed(articles):
+            new_title, symbols, token_names = self.regex_title.find_token(article['title'], from_title=True)
+            reacted |= self.on_title(new_title, symbols, token_names, detected_at, article['id'])
+        return reacted
 
-                uprint(f'[**** 警报 ****] Binance 公告中检测到新新闻：\n        {self.title}')
-                uprint(f'检测到的符号：\n        {symbols}')
-                uprint(f'检测到的代币名称：\n        {token_names}')
+    async def poll_lane(self):
+        while True:
+            articles = await self.get_announcement()
+            if articles:
+                detected_at = time.perf_counter()
+                if self.on_articles(articles, detected_at):
+                    await asyncio.sleep(self.cooldown)
+
+    async def consume(self, ingestion):
+        """
+        React to the announcements of the other sources, or of the detector
+        processes which parse them already.
+        """
+        async for event in ingestion.events():
+            if event.get('seed'):
+                # an article already out when a detector started; only the
+                # first detector seeds, the page of a later one may hold a
+                # listing another one already sent as new
+                if not self.seeded:
+                    self.seed_source = event['source']
+                    self.seeded = True
+                if event['source'] == self.seed_source:
+                    self.dedup.check_and_add(event['title'], event['id'])
+                continue
+            if 'symbols' in event:
+                new_title, symbols, token_names = event['title'], event['symbols'], event['token_names']
+            else:
+                new_title, symbols, token_names = self.regex_title.find_token(event['title'], from_title=True)
+            self.on_title(new_title, symbols, token_names, event['received'], event['id'])
 
-                self.react_announcement(symbols, token_names)
-                await asyncio.sleep(10)
+    async def close(self):
+        await self.supervisor.close()
+        await self.egress_pool.close()
+        self.dedup.close()
+        self.offload.close()
 
 
 class ExchangeRefresh:
@@ -115,31 +245,188 @@ class ExchangeRefresh:
             uprint(f'更新交易所 {self.exch_api.exch_name}')
 
 
-async def main():
-    uprint('启动程序。')
+def register_gauges(refresh_announcements, exchanges_apis, ingestion=None):
+    """
+    Gauges read from the state of the bot when the metrics are scraped.
+    """
+    scheduler = refresh_announcements.scheduler
+    egress_pool = refresh_announcements.egress_pool
+    metrics.Gauge('bot_poll_rate', 'Announcement polls per second over the last minute.',
+                  callback=scheduler.achieved_rate)
+    metrics.Gauge('bot_poll_budget', 'Announcement polls per second allowed.',
+                  callback=lambda: scheduler.budget * scheduler.capacity)
+    metrics.Gauge('bot_session_blind_seconds', 'Time since the session of the egress started failing.',
+                  ('egress',), callback=lambda: {(egress.name,): egress.supervisor.blind_time()
+                                                 for egress in egress_pool.egresses})
+    metrics.Gauge('bot_balance_staleness_seconds', 'Age of the oldest cached balance.', ('venue',),
+                  callback=lambda: {(exch_name,): exch_api.balance_cache.staleness()
+                                    for exch_name, exch_api in exchanges_apis.items()
+                                    if hasattr(exch_api, 'balance_cache')})
+    supervisor = refresh_announcements.supervisor
+    metrics.Gauge('bot_tasks', 'Running tasks of the reactions, by group.', ('group',),
+                  callback=lambda: {(group,): n for group, n in supervisor.counts().items()})
+    metrics.Gauge('bot_task_failures', 'Tasks of the reactions which raised, by group.', ('group',),
+                  callback=lambda: {(group,): n for group, n in supervisor.failed.items()})
+    metrics.Gauge('bot_rss_bytes', 'Resident memory of the process.', callback=rss_bytes)
+    if ingestion is not None:
+        metrics.Gauge('bot_source_wins', 'Announcements brought first by the source.', ('source',),
+                      callback=lambda: {(name,): stats['wins']
+                                        for name, stats in ingestion.lead_times().items()})
+        metrics.Gauge('bot_source_mean_lag_seconds', 'Mean lag of the source behind the first one.',
+                      ('source',), callback=lambda: {(name,): stats['mean_lag']
+                                                     for name, stats in ingestion.lead_times().items()})
+
 
+def create_exchanges():
+    """
+    APIs of the exchanges traded, and the classes of their price sockets.
+    """
     exchanges_apis = {
         'Kucoin': KucoinAPI(),
         # 'MEXC': MEXC_API(),
         # 'BKEX': BKEX_API()
     }
 
+    # the MEXC and BKEX REST calls block the loop, their sockets stay unused
+    # (`support_websocket` is off) until they are async
     exchanges_apis_sockets = {
         'Kucoin': KucoinPriceSellSocket,
-        # 'MEXC': None,
-        # 'BKEX': None
+        # 'MEXC': MEXCPriceSellSocket,
+        # 'BKEX': BKEXPriceSellSocket
     }
+    return exchanges_apis, exchanges_apis_sockets
+
+
+async def main(record_ticks=None, egresses=None, egress_selection='round_robin', sources=None,
+               dedup_path='seen_announcements.txt', metrics_port=None, slow_callback_ms=None,
+               n_detectors=None, loop='asyncio', price_board=None, read_price_board=False,
+               offload='inline', offload_workers=1):
+    uprint('启动程序。')
+
+    exchanges_apis, exchanges_apis_sockets = create_exchanges()
 
     refresh_tasks = []
+    if record_ticks is not None:
+        tick_recorders = TickRecorderPool(record_ticks)
+        for exch_api in exchanges_apis.values():
+            exch_api.tick_recorders = tick_recorders
+        refresh_tasks.append(tick_recorders.run())
+
+    if price_board is not None:
+        # publish the ticks to the board, or read them there instead of
+        # opening the price sockets, from a feed process serving the pairs
+        # the readers ask for
+        board = PriceBoard(price_board)
+        for exch_name, exch_api in exchanges_apis.items():
+            exch_api.price_board = board
+            if read_price_board:
+                exchanges_apis_sockets[exch_name] = BoardPriceSellSocket
+        if read_price_board:
+            start_feed(price_board, loop)
+
     for exch_name, exch_api in exchanges_apis.items():
         refresh_task = ExchangeRefresh(exch_api).refresh_exchange()
         refresh_tasks.append(refresh_task)
 
-    refresh_announcements = RefreshAnnouncements(exchanges_apis, exchanges_apis_sockets).run()
-    refresh_tasks.append(refresh_announcements)
+    # all the open positions are evaluated together
+    position_book = PositionBook()
+    refresh_tasks.append(position_book.run())
+
+    egresses = egresses or ('socks5://host.docker.internal:7897',)
+    offloader = await Offloader(offload, offload_workers).start()
+    refresh_announcements = RefreshAnnouncements(exchanges_apis, exchanges_apis_sockets, position_book,
+                                                 egresses=egresses,
+                                                 egress_selection=egress_selection,
+                                                 dedup_path=dedup_path, offload=offloader)
+    if n_detectors:
+        # the polls run in detector processes, this one only trades
+        from detector import AnnouncementChannel, start_detectors
+        channel = await AnnouncementChannel().start()
+        start_detectors(channel.path, n_detectors, egresses, loop=loop, seed_path=dedup_path)
+        refresh_tasks.append(refresh_announcements.consume(channel))
+    else:
+        refresh_tasks.append(refresh_announcements.run())
+
+    # other sources, merged with the first arrival winning
+    ingestion = None
+    if sources:
+        ingestion = AnnouncementIngestion([create_source(spec) for spec in sources],
+                                          refresh_announcements.egress_pool,
+                                          offload=offloader)
+        refresh_tasks.append(ingestion.run())
+        refresh_tasks.append(refresh_announcements.consume(ingestion))
+
+    # the lag is always measured, the slow callbacks on demand
+    loop_monitor = LoopMonitor()
+    if slow_callback_ms is not None:
+        loop_monitor.enable(slow_callback_ms / 1e3)
+    refresh_tasks.append(loop_monitor.run())
+    # the task counts and the memory, every minute
+    refresh_tasks.append(refresh_announcements.supervisor.run())
+
+    # `kill -USR2 <pid>` profiles the process for 10 seconds into profiles/
+    profiler = SamplingProfiler()
+    profiler.install_signal()
+
+    if metrics_port is not None:
+        register_gauges(refresh_announcements, exchanges_apis, ingestion)
+        metrics_server = metrics.MetricsServer(port=metrics_port)
+        metrics_server.app.router.add_get('/monitor', loop_monitor.control)
+        metrics_server.app.router.add_get('/profile', profiler.control)
+        await metrics_server.start()
 
     await asyncio.gather(*refresh_tasks)
 
 
 if __name__ == '__main__':
-    asyncio.run(main())
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--record-ticks', metavar='DIR', default=None,
+                        help='record the ticks of the price sockets in DIR')
+    parser.add_argument('--egress', action='append', default=None,
+                        help='egress of the announcement polls, repeatable: direct, '
+                             'bind://ADDRESS or a socks5:// or http:// proxy url')
+    parser.add_argument('--egress-selection', choices=['round_robin', 'latency'],
+                        default='round_robin')
+    parser.add_argument('--source', action='append', default=None,
+                        help='other announcement source, repeatable: '
+                             'catalog:ID:PAGE_SIZE[:INTERVAL], rss:URL or feed:URL')
+    parser.add_argument('--dedup-file', metavar='PATH', default='seen_announcements.txt',
+                        help='file keeping the announcements already seen across restarts')
+    parser.add_argument('--metrics-port', metavar='PORT', type=int, default=None,
+                        help='serve the metrics on http://127.0.0.1:PORT/metrics, and a '
+                             'profile of N seconds on /profile?seconds=N')
+    parser.add_argument('--slow-callback-ms', metavar='MS', type=float, default=None,
+                        help='log the loop callbacks longer than MS milliseconds, can also be '
+                             'set at runtime on /monitor?enable=1&threshold_ms=MS')
+    parser.add_argument('--detectors', metavar='N', type=int, default=None,
+                        help='poll the announcements from N processes sharing the egresses, '
+                             'this process only trades')
+    parser.add_argument('--price-board', metavar='PATH', default=None,
+                        help='publish the ticks of the price sockets on the shared memory '
+                             'price board PATH, e.g. /dev/shm/price_board')
+    parser.add_argument('--read-price-board', action='store_true',
+                        help='read the prices from the --price-board instead of opening price '
+                             'sockets, a feed process publishing the pairs asked for')
+    parser.add_argument('--offload', choices=MODES, default='inline',
+                        help='parse the large response bodies on the loop, in a thread pool '
+                             'or in a process pool')
+    parser.add_argument('--offload-workers', metavar='N', type=int, default=1,
+                        help='workers of the --offload pool')
+    parser.add_argument('--loop', choices=LOOPS, default='asyncio',
+                        help='event loop implementation, falls back on asyncio')
+    parser.add_argument('--bench-loops', metavar='N', type=int, default=None,
+                        help='compare the detection to order latency of the event '
+                             'loops on N mock announcements, then exit')
+    args = parser.parse_args()
+
+    if args.bench_loops is not None:
+        from scenario import bench_event_loops
+        bench_event_loops(args.bench_loops)
+    else:
+        run(main(record_ticks=args.record_ticks, egresses=args.egress,
+                 egress_selection=args.egress_selection, sources=args.source,
+                 dedup_path=args.dedup_file, metrics_port=args.metrics_port,
+                 slow_callback_ms=args.slow_callback_ms, n_detectors=args.detectors,
+                 loop=args.loop, price_board=args.price_board,
+                 read_price_board=args.read_price_board, offload=args.offload,
+                 offload_workers=args.offload_workers), loop=args.loop)
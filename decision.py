@@ -0,0 +1,74 @@
+from utils import uprint
+
+
+def name_matches(exch_token_name, token_name):
+    """
+    Names match when one holds the other, `exch_token_name` is lower case.
+    """
+    token_name = token_name.lower()
+    return exch_token_name in token_name or token_name in exch_token_name
+
+
+class VenueIndex:
+    """
+    Lower case names of the tokens listed on a venue, rebuilt when the venue
+    refreshes its `listed_tokens`. The refusals are cached until then.
+    """
+    def __init__(self, exch_api):
+        self.exch_api = exch_api
+        self.listed_tokens = None
+        self.names = dict()
+        self.refused = dict()  # (symbol, token name) -> reason
+
+    def update(self):
+        listed_tokens = self.exch_api.listed_tokens
+        if listed_tokens is self.listed_tokens:
+            return
+        self.listed_tokens = listed_tokens
+        self.names = {symbol: name.lower() for symbol, name in listed_tokens.items()} \
+            if listed_tokens else dict()
+        self.refused.clear()
+
+    def refusal(self, symbol, token_name):
+        """
+        Reason not to trade the token on the venue, None if it can be traded.
+        """
+        key = (symbol, token_name)
+        if key in self.refused:
+            return self.refused[key]
+
+        reason = None
+        exch_token_name = self.names.get(symbol)
+        if exch_token_name is None:
+            reason = '未列出'
+        elif self.exch_api.has_token_fullnames and not name_matches(exch_token_name, token_name):
+            reason = '代币名称不匹配'
+
+        if reason is not None:
+            self.refused[key] = reason
+        return reason
+
+
+class TradeDecider:
+    """
+    Tradeable (venue, symbol, name) of an announcement, all the venues in one
+    pass. A refusal is only logged the first time it is met.
+    """
+    def __init__(self, exchs_apis):
+        self.indexes = {exch_name: VenueIndex(exch_api)
+                        for exch_name, exch_api in exchs_apis.items()}
+
+    def decide(self, symbols, token_names):
+        for index in self.indexes.values():
+            index.update()
+
+        tradeable = []
+        for symbol, token_name in zip(symbols, token_names):
+            for exch_name, index in self.indexes.items():
+                known = (symbol, token_name) in index.refused
+                reason = index.refusal(symbol, token_name)
+                if reason is None:
+                    tradeable.append((exch_name, symbol, token_name))
+                elif not known:
+                    uprint(f'[{exch_name}: {symbol}] 购买失败（{reason}）')
+        return tradeable
@@ -0,0 +1,103 @@
+import collections
+import hashlib
+import os
+import re
+
+
+def normalise_title(title):
+    """
+    Key of a title shared by all the sources: lower case, alphanumeric
+    words only.
+    """
+    return ' '.join(re.findall(r'[a-z0-9]+', title.lower()))
+
+
+def title_key(title):
+    return 't:' + hashlib.sha1(normalise_title(title).encode('utf-8')).hexdigest()[:16]
+
+
+def id_key(article_id):
+    return f'i:{article_id}'
+
+
+class DedupStore:
+    """
+    Set of the announcements already seen, as title hashes and article ids,
+    with O(1) lookups. Only the `capacity` most recently seen keys are kept.
+    Keys are appended to `path` (if given) when added and loaded back at
+    start, the file is rewritten when it holds twice the capacity. A
+    `read_only` store is loaded from `path` but never writes to it.
+    """
+    def __init__(self, path=None, capacity=10000, read_only=False):
+        self.path = path
+        self.capacity = capacity
+        self.keys = collections.OrderedDict()
+        self.n_lines = 0
+
+        if path is not None and os.path.exists(path):
+            with open(path) as f:
+                for line in f:
+                    key = line.strip()
+                    if key:
+                        self._insert(key)
+                        self.n_lines += 1
+            if self.n_lines > len(self.keys) and not read_only:
+                self._compact()
+
+        self.file = open(path, 'a') if path is not None and not read_only else None
+
+    def __len__(self):
+        return len(self.keys)
+
+    def __contains__(self, key):
+        if key in self.keys:
+            self.keys.move_to_end(key)
+            return True
+        return False
+
+    def _insert(self, key):
+        self.keys[key] = None
+        self.keys.move_to_end(key)
+        if len(self.keys) > self.capacity:
+            self.keys.popitem(last=False)
+
+    def _compact(self):
+        tmp_path = self.path + '.tmp'
+        with open(tmp_path, 'w') as f:
+            f.writelines(key + '\n' for key in self.keys)
+        os.replace(tmp_path, self.path)
+        self.n_lines = len(self.keys)
+
+    def add(self, key):
+        if key in self.keys:
+            self.keys.move_to_end(key)
+            return
+
+        self._insert(key)
+        if self.file is not None:
+            self.file.write(key + '\n')
+            self.file.flush()
+            self.n_lines += 1
+            if self.n_lines > 2 * self.capacity:
+                self.file.close()
+                self._compact()
+                self.file = open(self.path, 'a')
+
+    def seen(self, title=None, article_id=None):
+        return ((title is not None and title_key(title) in self)
+                or (article_id is not None and id_key(article_id) in self))
+
+    def check_and_add(self, title=None, article_id=None):
+        """
+        Record the announcement, return True if it was not seen before.
+        """
+        new = not self.seen(title, article_id)
+        if title is not None:
+            self.add(title_key(title))
+        if article_id is not None:
+            self.add(id_key(article_id))
+        return new
+
+    def close(self):
+        if self.file is not None:
+            self.file.close()
@@ -0,0 +1,217 @@
+import asyncio
+import collections
+import json
+import multiprocessing
+import os
+import tempfile
+import time
+
+import fastjson
+import metrics
+from bot import RefreshAnnouncements
+from dedup_store import DedupStore
+from event_loop import run
+from utils import uprint
+
+HANDOFF = metrics.Histogram('bot_handoff_seconds',
+                            'Time from a detector sending an announcement to the trader reading it.')
+
+
+def default_socket_path():
+    return os.path.join(tempfile.gettempdir(), f'announcements-{os.getpid()}.sock')
+
+
+class AnnouncementChannel:
+    """
+    Trader side of the channel: a Unix socket the detector processes connect
+    to, each announcement being a line of JSON. `events` yields them in the
+    shape of the ingestion events, with the symbols and token names already
+    parsed, and `received` on the local perf_counter clock set back to the
+    detection time.
+    """
+    def __init__(self, path=None):
+        self.path = path or default_socket_path()
+        self.queue = asyncio.Queue()
+        self.n_detectors = 0
+        self.handoffs = collections.deque(maxlen=10000)
+
+    async def start(self):
+        if os.path.exists(self.path):
+            os.unlink(self.path)
+        self.server = await asyncio.start_unix_server(self.handle, self.path)
+        return self
+
+    async def handle(self, reader, writer):
+        self.n_detectors += 1
+        try:
+            while line := await reader.readline():
+                received_ns = time.time_ns()
+                event = fastjson.loads(line)
+                handoff = (received_ns - event['sent_ns']) / 1e9
+                HANDOFF.observe(handoff)
+                self.handoffs.append(handoff)
+                # the detection time, on the clock of this process
+                event['received'] = time.perf_counter() - (received_ns - event['detected_ns']) / 1e9
+                self.queue.put_nowait(event)
+        except (asyncio.CancelledError, ConnectionError):
+            pass
+        finally:
+            self.n_detectors -= 1
+            writer.close()
+
+    async def events(self):
+        while True:
+            yield await self.queue.get()
+
+    async def close(self):
+        self.server.close()
+        await self.server.wait_closed()
+        if os.path.exists(self.path):
+            os.unlink(self.path)
+
+
+class ChannelClient:
+    """
+    Detector side of the channel.
+    """
+    def __init__(self, path):
+        self.path = path
+        self.writer = None
+
+    async def connect(self, timeout=10):
+        deadline = time.monotonic() + timeout
+        while True:
+            try:
+                _, self.writer = await asyncio.open_unix_connection(self.path)
+                return self
+            except (FileNotFoundError, ConnectionRefusedError):
+                if time.monotonic() > deadline:
+                    raise
+                await asyncio.sleep(0.05)
+
+    def send(self, event):
+        event['sent_ns'] = time.time_ns()
+        self.writer.write(json.dumps(event, separators=(',', ':')).encode('utf-8') + b'\n')
+
+    async def close(self):
+        self.writer.close()
+        await self.writer.wait_closed()
+
+
+class Detector(RefreshAnnouncements):
+    """
+    Announcement poller without exchanges: the new titles are parsed here and
+    sent to the trader instead of being reacted to.
+
+    The store is seeded from the file of the trader (`seed_path`), read
+    only, so that the announcements published while the bot was down are
+    still sent. Without it, the articles of the first poll are sent as
+    seeds, which the trader records without reacting when they come from
+    the first detector seeding it.
+    """
+    def __init__(self, client, seed_path=None, **kwargs):
+        super().__init__({}, {}, **kwargs)
+        self.client = client
+        if seed_path is not None:
+            self.dedup = DedupStore(seed_path, read_only=True)
+            self.seeded = len(self.dedup) > 0
+
+    def on_articles(self, articles, detected_at):
+        if self.seeded:
+            return super().on_articles(articles, detected_at)
+
+        for article in articles:
+            self.dedup.check_and_add(article['title'], article['id'])
+            self.client.send({'title': article['title'], 'id': article['id'], 'seed': True,
+                              'detected_ns': time.time_ns(), 'source': f'detector-{os.getpid()}'})
+        self.seeded = True
+        return False
+
+    def on_title(self, new_title, symbols, token_names, detected_at, article_id=None):
+        if not self.dedup.check_and_add(new_title, article_id):
+            return False
+
+        detected_ns = time.time_ns() - int((time.perf_counter() - detected_at) * 1e9)
+        self.client.send({'title': new_title, 'id': article_id, 'symbols': symbols,
+                          'token_names': token_names, 'detected_ns': detected_ns,
+                          'source': f'detector-{os.getpid()}'})
+        # the trader handles the cooldown
+        return False
+
+
+async def detect(path, egresses, url=None, second_url=None, seed_path=None):
+    client = await ChannelClient(path).connect()
+    urls = {key: value for key, value in (('url', url), ('second_url', second_url)) if value}
+    detector = Detector(client, seed_path=seed_path, egresses=egresses, **urls)
+    uprint(f'[detector-{os.getpid()}] 已连接到 {path}。')
+    try:
+        await detector.run()
+    finally:
+        await detector.close()
+        await client.close()
+
+
+def run_detector(path, egresses, loop='asyncio', url=None, second_url=None, seed_path=None):
+    """
+    Entry point of a detector process.
+    """
+    try:
+        run(detect(path, egresses, url, second_url, seed_path), loop=loop)
+    except KeyboardInterrupt:
+        pass
+
+
+def start_detectors(path, n_detectors, egresses, loop='asyncio', url=None, second_url=None, seed_path=None):
+    """
+    Spawn the detector processes, the egresses being shared out between them,
+    their stores seeded from the dedup file `seed_path` of the trader.
+    """
+    context = multiprocessing.get_context('spawn')
+    processes = []
+    for i in range(n_detectors):
+        own_egresses = list(egresses[i::n_detectors]) or list(egresses)
+        process = context.Process(target=run_detector, name=f'detector-{i}', daemon=True,
+                                  args=(path, own_egresses, loop, url, second_url, seed_path))
+        process.start()
+        processes.append(process)
+    return processes
+
+
+def _send_probes(path, n_messages, interval):
+    async def send():
+        client = await ChannelClient(path).connect()
+        for i in range(n_messages):
+            client.send({'title': f'probe {i}', 'id': i, 'symbols': [], 'token_names': [],
+                         'detected_ns': time.time_ns()})
+            await client.writer.drain()
+            await asyncio.sleep(interval)
+        await client.close()
+    asyncio.run(send())
+
+
+if __name__ == '__main__':
+    import statistics
+
+    async def bench(n_messages=2000, interval=0.001):
+        """
+        Hand-off latency from another process over the channel.
+        """
+        channel = await AnnouncementChannel().start()
+        process = multiprocessing.get_context('spawn').Process(
+            target=_send_probes, args=(channel.path, n_messages, interval))
+        process.start()
+
+        received = 0
+        async for _ in channel.events():
+            received += 1
+            if received == n_messages:
+                break
+        process.join()
+        await channel.close()
+
+        handoffs = sorted(channel.handoffs)
+        print(f'{n_messages} announcements handed off, median '
+              f'{statistics.median(handoffs) * 1e6:.0f} us, '
+              f'p99 {handoffs[int(0.99 * len(handoffs))] * 1e6:.0f} us')
+
+    asyncio.run(bench())
@@ -0,0 +1,193 @@
+import itertools
+import random
+import time
+
+import aiohttp
+import aiohttp_socks
+
+from poll_scheduler import RATE_LIMIT_STATUSES, parse_retry_after
+from session_supervisor import SessionSupervisor
+from utils import uprint
+
+
+def redact_spec(spec):
+    """
+    The spec without the credentials of a proxy url, to be logged or used as
+    a metric label.
+    """
+    scheme, separator, rest = spec.partition('://')
+    netloc, slash, path = rest.partition('/')
+    return scheme + separator + netloc.rpartition('@')[2] + slash + path
+
+
+class Egress:
+    """
+    One way out to the internet: 'direct', a local address to bind to
+    ('bind://192.168.1.2'), or a SOCKS/HTTP proxy url ('socks5://host:port',
+    'http://host:port'). Its connector and session are owned by a
+    `SessionSupervisor`.
+    """
+    def __init__(self, spec, timeout=None, headers=None, base_backoff=1., max_backoff=300.):
+        self.spec = spec
+        # the spec as logged and labelled, without credentials
+        self.name = redact_spec(spec)
+        self.base_backoff = base_backoff
+        self.max_backoff = max_backoff
+
+        self.latency = None  # moving average of the round trip time
+        self.failures = 0
+        self.blocked_until = 0.
+        self.n_requests = 0
+
+        self.supervisor = SessionSupervisor(self.create_connector, timeout=timeout,
+                                            headers=headers, name=self.name)
+
+    @property
+    def session(self):
+        return self.supervisor.session
+
+    def create_connector(self):
+        if self.spec == 'direct':
+            return aiohttp.TCPConnector()
+        if self.spec.startswith('bind://'):
+            return aiohttp.TCPConnector(local_addr=(self.spec[len('bind://'):], 0))
+        return aiohttp_socks.ProxyConnector.from_url(self.spec)
+
+    def is_healthy(self, now=None):
+        return self.blocked_until <= (now or time.monotonic())
+
+    def report(self, status, rtt=None, headers=None):
+        """
+        Update the health of the egress after a request, `status` is None for
+        a network error. Return the delay the egress is put aside for.
+        """
+        self.n_requests += 1
+
+        # the bot only sees again on a page; rate limits and server errors
+        # keep it blind, the other statuses leave the blind period as is
+        if status == 200:
+            self.supervisor.success()
+        elif status is None or status in RATE_LIMIT_STATUSES or status >= 500:
+            self.supervisor.failure()
+
+        if status == 200:
+            self.failures = 0
+            if rtt is not None:
+                self.latency = rtt if self.latency is None else 0.8 * self.latency + 0.2 * rtt
+            return 0.
+
+        if status is not None and status not in RATE_LIMIT_STATUSES and status < 500:
+            return 0.
+
+        self.failures += 1
+        delay = parse_retry_after(headers)
+        if delay is None:
+            backoff = min(self.max_backoff, self.base_backoff * 2 ** (self.failures - 1))
+            delay = random.uniform(backoff / 2, backoff)
+
+        self.blocked_until = time.monotonic() + delay
+        return delay
+
+    async def close(self):
+        await self.supervisor.close()
+
+
+class EgressPool:
+    """
+    Egresses to spread the polls on, picked in turn ('round_robin') or at
+    random with a weight inverse to their latency ('latency'). Egresses put
+    aside after a failure or a rate limit are skipped until they recover.
+    """
+    def __init__(self, specs, selection='round_robin', timeout=None, headers=None):
+        if selection not in ('round_robin', 'latency'):
+            raise ValueError(f'{selection} as egress selection is invalid.')
+
+        self.egresses = [Egress(spec, timeout=timeout, headers=headers) for spec in specs]
+        self.selection = selection
+        self._cycle = itertools.cycle(self.egresses)
+
+    def __len__(self):
+        return len(self.egresses)
+
+    def healthy(self):
+        now = time.monotonic()
+        return [egress for egress in self.egresses if egress.is_healthy(now)]
+
+    def select(self):
+        """
+        Return the egress for the next request, the one recovering first if
+        none is healthy.
+        """
+        healthy = self.healthy()
+        if not healthy:
+            return min(self.egresses, key=lambda egress: egress.blocked_until)
+
+        if self.selection == 'round_robin':
+            for egress in self._cycle:
+                if egress in healthy:
+                    return egress
+
+        # egresses never measured get the best known latency, to be tried
+        known = [egress.latency for egress in healthy if egress.latency is not None]
+        best = min(known) if known else 1.
+        weights = [1 / (egress.latency or best) for egress in healthy]
+        return random.choices(healthy, weights=weights)[0]
+
+    def stats(self):
+        now = time.monotonic()
+        return [{'egress': egress.name,
+                 'healthy': egress.is_healthy(now),
+                 'latency': egress.latency,
+                 'requests': egress.n_requests,
+                 **egress.supervisor.stats()}
+                for egress in self.egresses]
+
+    async def close(self):
+        for egress in self.egresses:
+            await egress.close()
+
+
+if __name__ == '__main__':
+    import asyncio
+    import collections
+
+    from mock_servers import MockBinance, MockProxy
+
+    async def demo():
+        binance = await MockBinance().start()
+        proxies = [await MockProxy().start() for _ in range(3)]
+        pool = EgressPool([proxy.url for proxy in proxies], selection='latency',
+                          timeout=aiohttp.ClientTimeout(total=2))
+
+        used = collections.Counter()
+        for i in range(300):
+            if i == 100:
+                proxies[0].fail()
+                uprint(f'{proxies[0].url} down')
+            if i == 200:
+                proxies[0].down = False
+                uprint(f'{proxies[0].url} up')
+            egress = pool.select()
+            generation = egress.supervisor.generation
+            start = time.perf_counter()
+            try:
+                async with egress.session.get(binance.page_url) as r:
+                    await r.text()
+                    status = r.status
+            except (aiohttp.ClientError, asyncio.TimeoutError):
+                status = None
+                await egress.supervisor.rebuild(generation)
+            egress.report(status, time.perf_counter() - start)
+            await asyncio.sleep(0.005)
+            used[egress.name] += 1
+
+        uprint(dict(used))
+        for stats in pool.stats():
+            uprint(stats)
+
+        await pool.close()
+        for proxy in proxies:
+            await proxy.close()
+        await binance.close()
+
+    asyncio.run(demo())
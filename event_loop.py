@@ -0,0 +1,30 @@
+import asyncio
+
+from utils import uprint
+
+LOOPS = ['asyncio', 'uvloop']
+
+
+def loop_factory(loop='asyncio'):
+    """
+    Return the factory of the requested event loop, the default asyncio loop
+    if it is not installed.
+    """
+    if loop == 'uvloop':
+        try:
+            import uvloop
+            return uvloop.new_event_loop
+        except ImportError:
+            uprint('uvloop 未安装，使用默认事件循环。')
+    elif loop != 'asyncio':
+        raise ValueError(f'{loop} as event loop is invalid.')
+
+    return asyncio.new_event_loop
+
+
+def run(main, loop='asyncio'):
+    """
+    Same as `asyncio.run`, on the requested event loop.
+    """
+    with asyncio.Runner(loop_factory=loop_factory(loop)) as runner:
+        return runner.run(main)
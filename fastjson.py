@@ -0,0 +1,86 @@
+import json
+import time
+
+# fastest JSON decoder installed, the standard library otherwise
+try:
+    import orjson as _backend
+    BACKEND = 'orjson'
+except ImportError:
+    try:
+        import ujson as _backend
+        BACKEND = 'ujson'
+    except ImportError:
+        _backend = json
+        BACKEND = 'json'
+
+loads = _backend.loads
+
+_BID_KEY = '"bestBid":"'
+_ASK_KEY = '"bestAsk":"'
+_TIME_KEY = '"time":'
+
+
+def extract_ticker(frame):
+    """
+    Return the highest bid, lowest ask and exchange time (ms) of a Kucoin
+    ticker frame by scanning for these fields only, or None if the frame is
+    not a ticker message.
+    """
+    start = frame.find(_BID_KEY)
+    if start < 0:
+        return None
+    start += len(_BID_KEY)
+    bid = float(frame[start:frame.find('"', start)])
+
+    start = frame.find(_ASK_KEY) + len(_ASK_KEY)
+    ask = float(frame[start:frame.find('"', start)])
+
+    start = frame.find(_TIME_KEY) + len(_TIME_KEY)
+    end = frame.find('}', start)
+    comma = frame.find(',', start)
+    if 0 <= comma < end:
+        end = comma
+
+    return bid, ask, int(frame[start:end])
+
+
+def _decode_ticker_backend(frame):
+    received_json = loads(frame)
+    if 'topic' not in received_json:
+        return None
+
+    data = received_json['data']
+    return float(data['bestBid']), float(data['bestAsk']), data['time']
+
+
+# a full decode by orjson beats scanning the frame in Python
+if BACKEND == 'orjson':
+    decode_ticker = _decode_ticker_backend
+else:
+    decode_ticker = extract_ticker
+
+
+if __name__ == '__main__':
+    frame = json.dumps({'type': 'message',
+                        'topic': '/market/ticker:HEHE-USDT',
+                        'subject': 'trade.ticker',
+                        'data': {'sequence': '1545896668986',
+                                 'price': '0.08',
+                                 'size': '0.011',
+                                 'bestAsk': '0.08',
+                                 'bestAskSize': '0.18',
+                                 'bestBid': '0.049',
+                                 'bestBidSize': '0.036',
+                                 'time': 1704067200000}}, separators=(',', ':'))
+
+    n_frames = 200000
+    decoders = [('json.loads', json.loads),
+                (f'{BACKEND}.loads', loads),
+                ('extract_ticker', extract_ticker),
+                ('decode_ticker', decode_ticker)]
+    for name, decode in decoders:
+        start = time.perf_counter()
+        for _ in range(n_frames):
+            decode(frame)
+        duration = time.perf_counter() - start
+        print(f'{name:>15}: {n_frames / duration:,.0f} frames/s per core')
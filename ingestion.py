@@ -0,0 +1,208 @@
+import asyncio
+import collections
+import time
+import xml.etree.ElementTree as ET
+
+import aiohttp
+
+import fastjson
+from dedup_store import normalise_title
+from utils import uprint
+
+
+class SourceAdapter:
+    """
+    A source of announcements polled every `interval` seconds. `parse` turns
+    a response body into a list of articles, newest first, as dicts with an
+    `id` and a `title`.
+    """
+    def __init__(self, name, url, interval):
+        self.name = name
+        self.url = url
+        self.interval = interval
+
+    def parse(self, text):
+        raise NotImplementedError
+
+    async def fetch(self, egress_pool, offload=None):
+        egress = egress_pool.select()
+        generation = egress.supervisor.generation
+        start = time.perf_counter()
+        try:
+            async with egress.session.get(self.url) as r:
+                text = await r.text()
+        except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+            egress.report(None)
+            await egress.supervisor.rebuild(generation)
+            uprint(f'[{self.name}] {e!r}')
+            return None
+
+        egress.report(r.status, time.perf_counter() - start, r.headers)
+        if r.status != 200:
+            uprint(f'[{self.name}] 返回码错误（{r.status}）。')
+            return None
+
+        try:
+            if offload is None:
+                return self.parse(text)
+            return await offload.run(self.parse, text)
+        except Exception as e:
+            uprint(f'[{self.name}] 解析失败：{e!r}')
+            return None
+
+
+class CatalogSource(SourceAdapter):
+    """
+    Binance article catalog API, any catalog and page size.
+    """
+    def __init__(self, catalog_id=48, page_size=15, interval=0.5,
+                 base_url='https://www.binance.com'):
+        url = (f'{base_url}/bapi/composite/v1/public/cms/article/catalog/list/query'
+               f'?catalogId={catalog_id}&pageNo=1&pageSize={page_size}')
+        super().__init__(f'catalog-{catalog_id}-{page_size}', url, interval)
+
+    def parse(self, text):
+        return [{'id': article['id'], 'title': article['title']}
+                for article in fastjson.loads(text)['data']['articles']]
+
+
+class RssSource(SourceAdapter):
+    def __init__(self, url, interval=1., name='rss'):
+        super().__init__(name, url, interval)
+
+    def parse(self, text):
+        articles = []
+        for item in ET.fromstring(text).iter('item'):
+            title = item.findtext('title')
+            articles.append({'id': item.findtext('guid') or title, 'title': title})
+        return articles
+
+
+class FeedSource(SourceAdapter):
+    """
+    Twitter-style JSON feed: a list of posts with an `id` and a `text`.
+    """
+    def __init__(self, url, interval=0.5, name='feed'):
+        super().__init__(name, url, interval)
+
+    def parse(self, text):
+        return [{'id': post['id'], 'title': post['text']}
+                for post in fastjson.loads(text)]
+
+
+class AnnouncementIngestion:
+    """
+    Poll all the sources concurrently and merge their articles in a single
+    stream of new announcements. The first source to bring an announcement
+    wins, later arrivals are only counted for the lead time statistics. The
+    articles present on the first poll of a source are not new. Large
+    bodies are parsed by the `Offloader` `offload`, if any.
+    """
+    def __init__(self, sources, egress_pool, max_keys=10000, offload=None):
+        self.sources = sources
+        self.egress_pool = egress_pool
+        self.offload = offload
+        self.max_keys = max_keys
+
+        self.queue = asyncio.Queue()
+        # title key -> (first source, first arrival time, sources seen)
+        self.first_seen = collections.OrderedDict()
+        self.stats = {source.name: {'wins': 0, 'late': 0, 'lag': 0.}
+                      for source in sources}
+
+    def _arrival(self, source, article, now, seeding):
+        key = normalise_title(article['title'])
+        if key not in self.first_seen:
+            self.first_seen[key] = (source.name, now, {source.name})
+            if len(self.first_seen) > self.max_keys:
+                self.first_seen.popitem(last=False)
+            if seeding:
+                return
+            self.stats[source.name]['wins'] += 1
+            self.queue.put_nowait({'title': article['title'], 'id': article['id'],
+                                   'source': source.name, 'received': now})
+            return
+
+        first_source, first_time, seen_by = self.first_seen[key]
+        if source.name in seen_by:
+            return
+        seen_by.add(source.name)
+        if not seeding:
+            self.stats[source.name]['late'] += 1
+            self.stats[source.name]['lag'] += now - first_time
+
+    async def _poll_source(self, source):
+        seeding = True
+        while True:
+            articles = await source.fetch(self.egress_pool, self.offload)
+            if articles is not None:
+                now = time.perf_counter()
+                for article in articles:
+                    self._arrival(source, article, now, seeding)
+                seeding = False
+            await asyncio.sleep(source.interval)
+
+    async def run(self):
+        await asyncio.gather(*[self._poll_source(source) for source in self.sources])
+
+    async def events(self):
+        while True:
+            yield await self.queue.get()
+
+    def lead_times(self):
+        """
+        For each source, the announcements it brought first and the mean lag
+        behind the first source for the others.
+        """
+        return {name: {'wins': stats['wins'], 'late': stats['late'],
+                       'mean_lag': stats['lag'] / stats['late'] if stats['late'] else None}
+                for name, stats in self.stats.items()}
+
+
+def create_source(spec, base_url='https://www.binance.com'):
+    """
+    Source from a spec: 'catalog:ID:PAGE_SIZE[:INTERVAL]', 'rss:URL' or
+    'feed:URL'.
+    """
+    kind, _, rest = spec.partition(':')
+    if kind == 'catalog':
+        params = rest.split(':')
+        interval = float(params[2]) if len(params) > 2 else 0.5
+        return CatalogSource(int(params[0]), int(params[1]), interval, base_url)
+    if kind == 'rss':
+        return RssSource(rest)
+    if kind == 'feed':
+        return FeedSource(rest)
+    raise ValueError(f'{spec} as source is invalid.')
+
+
+if __name__ == '__main__':
+    from egress import EgressPool
+    from mock_servers import MockBinance, listing_title
+
+    async def demo():
+        binance = await MockBinance().start()
+        pool = EgressPool(['direct'], timeout=aiohttp.ClientTimeout(total=2))
+        sources = [CatalogSource(48, 5, 0.05, binance.url),
+                   CatalogSource(48, 50, 0.2, binance.url),
+                   RssSource(binance.url + '/rss', 0.1),
+                   FeedSource(binance.url + '/feed', 0.03)]
+        ingestion = AnnouncementIngestion(sources, pool)
+        task = asyncio.create_task(ingestion.run())
+        await asyncio.sleep(0.5)
+
+        for i in range(20):
+            binance.publish(listing_title(f'Token{i}', f'TOK{i}'))
+            await asyncio.sleep(0.3)
+
+        n_events = ingestion.queue.qsize()
+        uprint(f'{n_events} new announcements')
+        for name, stats in ingestion.lead_times().items():
+            uprint(f'{name:>18}: {stats}')
+
+        task.cancel()
+        await asyncio.gather(task, return_exceptions=True)
+        await pool.close()
+        await binance.close()
+
+    asyncio.run(demo())
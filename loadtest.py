@@ -0,0 +1,239 @@
+"""
+Load suite of the bot against the local mock servers: bursts of multi-token
+listings traded on several venues with fast tickers, many positions open at
+once. Reports the throughput, the decision latency (detection to buy order
+at the venue), the event loop lag, the open sockets and the memory growth,
+and exits with status 1 when a threshold is exceeded:
+
+    python loadtest.py [--json results.json]
+
+The mocks share the loop of the bot, so the figures are pessimistic; they
+are meant to be compared from one run to the next.
+"""
+import argparse
+import asyncio
+import bisect
+import contextlib
+import json
+import statistics
+import sys
+import time
+
+import metrics
+from api.api_kucoin import KucoinAPI, KucoinPriceSellSocket
+from bot import RefreshAnnouncements
+from loop_monitor import LoopMonitor
+from mock_servers import MockBinance, MockKucoin
+from position_book import PositionBook
+from supervisor import rss_bytes
+
+# about twice the figures of the default load on one CPU; the loop lag
+# quantile is the upper bound of its histogram bucket
+THRESHOLDS = {'decision_p99_ms': 400.,
+              'loop_lag_p99_ms': 250.,
+              'rss_growth_mb': 64.,
+              'missed_orders': 0,
+              'leaked_sockets': 0}
+
+
+class TimedRefresh(RefreshAnnouncements):
+    """
+    Poller keeping the detection times of each symbol, to match the orders.
+    """
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.detections = dict()  # symbol -> perf_counter times
+
+    def on_title(self, new_title, symbols, token_names, detected_at, article_id=None):
+        reacted = super().on_title(new_title, symbols, token_names, detected_at, article_id)
+        if reacted:
+            for symbol in symbols:
+                self.detections.setdefault(symbol, []).append(detected_at)
+        return reacted
+
+
+def decision_latencies(venues, detections, since):
+    """
+    Time from the detection of each symbol to its buy orders.
+    """
+    latencies = []
+    for venue in venues:
+        for order_time, side, pair in venue.order_times:
+            if side != 'buy' or order_time < since:
+                continue
+            times = detections.get(pair.split('-')[0], [])
+            i = bisect.bisect_right(times, order_time)
+            if i:
+                latencies.append(order_time - times[i - 1])
+    return sorted(latencies)
+
+
+class LoadTest:
+    def __init__(self, n_venues=3, n_tokens=60, n_bursts=5, burst_size=8, tokens_per_announcement=3,
+                 tick_interval=0.005, burst_interval=2., hold=1.5):
+        self.n_venues = n_venues
+        self.n_tokens = n_tokens
+        self.n_bursts = n_bursts
+        self.burst_size = burst_size
+        self.tokens_per_announcement = tokens_per_announcement
+        self.burst_interval = burst_interval
+        self.hold = hold
+
+        self.binance = MockBinance()
+        self.venues = [MockKucoin(n_tokens=n_tokens, tick_interval=tick_interval)
+                       for _ in range(n_venues)]
+        self.next_token = 0
+        self.n_announced = 0
+        self.peak_sockets = 0
+
+    async def start(self):
+        await self.binance.start()
+        self.exchs_apis = dict()
+        for i, venue in enumerate(self.venues):
+            await venue.start()
+            exch_api = KucoinAPI(api_url=venue.url)
+            exch_api.exch_name = f'Kucoin{i}'
+            self.exchs_apis[exch_api.exch_name] = exch_api
+        for exch_api in self.exchs_apis.values():
+            while not exch_api.listed_tokens or not exch_api.pairs or not exch_api.private_socket.connected:
+                await asyncio.sleep(0.01)
+
+        self.position_book = PositionBook()
+        self.refresh = TimedRefresh(self.exchs_apis, {name: KucoinPriceSellSocket for name in self.exchs_apis},
+                                    self.position_book, strategy={'max_hold': self.hold},
+                                    url=self.binance.page_url, second_url=self.binance.catalog_url,
+                                    egresses=['direct'])
+        self.refresh.cooldown = 0
+        self.loop_monitor = LoopMonitor(lag_interval=0.01)
+        self.tasks = [asyncio.create_task(self.position_book.run()),
+                      asyncio.create_task(self.refresh.run()),
+                      asyncio.create_task(self.watch_sockets())]
+        while self.binance.n_requests < 2:
+            await asyncio.sleep(0.01)
+        return self
+
+    def open_sockets(self):
+        return sum(venue.n_sockets for venue in self.venues)
+
+    async def watch_sockets(self):
+        while True:
+            self.peak_sockets = max(self.peak_sockets, self.open_sockets())
+            await asyncio.sleep(0.05)
+
+    async def burst(self):
+        for _ in range(self.burst_size):
+            tokens = [(self.next_token + i) % self.n_tokens for i in range(self.tokens_per_announcement)]
+            self.next_token += self.tokens_per_announcement
+            names = ' and '.join(f'Token{i} (TOK{i})' for i in tokens)
+            # a new title each time, the same tokens come back
+            self.binance.publish(f'Binance Will List {names} in the Innovation Zone #{self.n_announced}')
+            self.n_announced += 1
+            await asyncio.sleep(0.005)
+
+    async def settle(self, timeout=30.):
+        deadline = time.perf_counter() + timeout
+        while self.refresh.supervisor.counts() and time.perf_counter() < deadline:
+            await asyncio.sleep(0.05)
+
+    async def run(self):
+        # a first burst warms up the connections and the allocator
+        await self.burst()
+        await self.settle()
+        base_sockets = self.open_sockets()
+        base_rss = rss_bytes()
+        n_orders = sum(len(venue.order_times) for venue in self.venues)
+        self.peak_sockets = 0
+        # the lag is only sampled from now on
+        self.tasks.append(asyncio.create_task(self.loop_monitor.run()))
+
+        start = time.perf_counter()
+        for _ in range(self.n_bursts):
+            await self.burst()
+            await asyncio.sleep(self.burst_interval)
+        await self.settle()
+        duration = time.perf_counter() - start
+
+        orders = sum(len(venue.order_times) for venue in self.venues) - n_orders
+        latencies = decision_latencies(self.venues, self.refresh.detections, start)
+        expected = self.n_bursts * self.burst_size * self.tokens_per_announcement * self.n_venues
+        lag_p99 = metrics.LOOP_LAG.quantile(0.99)
+        return {'announcements': self.n_bursts * self.burst_size,
+                'buy_orders': len(latencies),
+                'missed_orders': expected - len(latencies),
+                'orders_per_second': orders / duration,
+                'decision_p50_ms': statistics.median(latencies) * 1e3 if latencies else None,
+                'decision_p99_ms': latencies[int(0.99 * len(latencies))] * 1e3 if latencies else None,
+                'loop_lag_p99_ms': lag_p99 * 1e3 if lag_p99 is not None else None,
+                'loop_lag_max_ms': self.loop_monitor.max_lag * 1e3,
+                'peak_sockets': self.peak_sockets,
+                'leaked_sockets': self.open_sockets() - base_sockets,
+                'rss_growth_mb': (rss_bytes() - base_rss) / 2 ** 20,
+                'task_failures': sum(self.refresh.supervisor.failed.values())}
+
+    async def close(self):
+        for task in self.tasks:
+            task.cancel()
+        await asyncio.gather(*self.tasks, return_exceptions=True)
+        await self.refresh.close()
+        for exch_api in self.exchs_apis.values():
+            await exch_api.close()
+        await self.binance.close()
+        for venue in self.venues:
+            await venue.close()
+
+
+def regressions(results, thresholds):
+    """
+    The thresholds exceeded, as messages.
+    """
+    failures = []
+    for name, limit in thresholds.items():
+        value = results.get(name)
+        if value is None or value > limit:
+            failures.append(f'{name} = {value} (limit {limit})')
+    return failures
+
+
+async def load_test(**kwargs):
+    test = await LoadTest(**kwargs).start()
+    try:
+        return await test.run()
+    finally:
+        await test.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--venues', type=int, default=3)
+    parser.add_argument('--tokens', type=int, default=60, help='tokens listed on each venue')
+    parser.add_argument('--bursts', type=int, default=5)
+    parser.add_argument('--burst-size', type=int, default=8, help='announcements of a burst')
+    parser.add_argument('--tokens-per-announcement', type=int, default=3)
+    parser.add_argument('--tick-ms', type=float, default=5., help='ticker interval of the venues')
+    parser.add_argument('--hold', type=float, default=1.5, help='seconds a position is held')
+    parser.add_argument('--log', default='/dev/null', help='file receiving the log of the bot')
+    parser.add_argument('--json', metavar='PATH', default=None, help='also write the results to PATH')
+    for name, limit in THRESHOLDS.items():
+        parser.add_argument(f'--max-{name.replace("_", "-")}', dest=name, type=float, default=limit)
+    args = parser.parse_args()
+
+    with open(args.log, 'w') as log, contextlib.redirect_stdout(log):
+        results = asyncio.run(load_test(n_venues=args.venues, n_tokens=args.tokens,
+                                        n_bursts=args.bursts, burst_size=args.burst_size,
+                                        tokens_per_announcement=args.tokens_per_announcement,
+                                        tick_interval=args.tick_ms / 1e3, hold=args.hold))
+
+    for name, value in results.items():
+        print(f'{name:>20}: {value:.2f}' if isinstance(value, float) else f'{name:>20}: {value}')
+    if args.json is not None:
+        with open(args.json, 'w') as f:
+            json.dump(results, f, indent=2)
+
+    failures = regressions(results, {name: getattr(args, name) for name in THRESHOLDS})
+    for failure in failures:
+        print(f'REGRESSION: {failure}')
+    sys.exit(1 if failures else 0)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,156 @@
+import asyncio
+import collections
+import time
+
+from aiohttp import web
+
+import metrics
+from utils import uprint
+
+
+def _innermost(coro):
+    """
+    Innermost coroutine awaited by `coro`, where the task is suspended.
+    """
+    while True:
+        awaited = getattr(coro, 'cr_await', None)
+        if awaited is None or not hasattr(awaited, 'cr_frame'):
+            return coro
+        coro = awaited
+
+
+def describe_callback(callback):
+    """
+    Name of a loop callback: the task and its coroutine for a task step,
+    with the line it suspended at, else the qualified name of the function.
+    """
+    owner = getattr(callback, '__self__', None)
+    if isinstance(owner, asyncio.Task):
+        coro = owner.get_coro()
+        name = f'{owner.get_name()} {getattr(coro, "__qualname__", coro)}'
+        inner = _innermost(coro)
+        frame = getattr(inner, 'cr_frame', None)
+        if frame is not None:
+            name += f' (at {inner.__qualname__} {frame.f_code.co_filename}:{frame.f_lineno})'
+        return name
+    return getattr(callback, '__qualname__', repr(callback))
+
+
+class LoopMonitor:
+    """
+    Measure the scheduling lag of the loop continuously, and when enabled
+    log the callbacks running longer than `threshold` seconds with the task
+    they belong to. The slow callbacks are timed by wrapping
+    `asyncio.events.Handle._run`, so only the asyncio loop reports them
+    (uvloop has its own handles); the lag is measured on any loop.
+
+    `control` is an aiohttp handler to change the settings at runtime:
+    /monitor?enable=1&threshold_ms=20.
+    """
+    def __init__(self, threshold=0.05, lag_interval=0.1, n_slow=100):
+        self.threshold = threshold
+        self.lag_interval = lag_interval
+        self.enabled = False
+        self._original_run = None
+
+        self.last_lag = 0.
+        self.max_lag = 0.
+        self.slow = collections.deque(maxlen=n_slow)  # (time, duration, callback)
+
+    def enable(self, threshold=None):
+        if threshold is not None:
+            self.threshold = threshold
+        if self.enabled:
+            return
+
+        original_run = asyncio.events.Handle._run
+        monitor = self
+
+        def _run(handle):
+            start = time.perf_counter()
+            try:
+                return original_run(handle)
+            finally:
+                duration = time.perf_counter() - start
+                if duration > monitor.threshold:
+                    monitor.on_slow(handle, duration)
+
+        self._original_run = original_run
+        asyncio.events.Handle._run = _run
+        self.enabled = True
+        uprint(f'[loop] 慢回调监控已开启，阈值 {self.threshold * 1e3:.0f} ms。')
+
+    def disable(self):
+        if not self.enabled:
+            return
+        asyncio.events.Handle._run = self._original_run
+        self.enabled = False
+        uprint('[loop] 慢回调监控已关闭。')
+
+    def on_slow(self, handle, duration):
+        name = describe_callback(handle._callback)
+        self.slow.append((time.time(), duration, name))
+        metrics.SLOW_CALLBACKS.inc()
+        uprint(f'[loop] 慢回调 {duration * 1e3:.1f} ms：{name}')
+
+    async def run(self):
+        """
+        Sample the lag: how late the loop wakes up a task sleeping
+        `lag_interval` seconds.
+        """
+        while True:
+            start = time.perf_counter()
+            await asyncio.sleep(self.lag_interval)
+            lag = max(0., time.perf_counter() - start - self.lag_interval)
+            metrics.LOOP_LAG.observe(lag)
+            self.last_lag = lag
+            self.max_lag = max(self.max_lag, lag)
+
+    def state(self):
+        return {'enabled': self.enabled,
+                'threshold_ms': self.threshold * 1e3,
+                'last_lag_ms': self.last_lag * 1e3,
+                'max_lag_ms': self.max_lag * 1e3,
+                'slow': [{'time': t, 'duration_ms': duration * 1e3, 'callback': name}
+                         for t, duration, name in list(self.slow)[-20:]]}
+
+    async def control(self, request):
+        query = request.query
+        threshold = float(query['threshold_ms']) / 1e3 if 'threshold_ms' in query else None
+        if query.get('enable') in ('0', 'false'):
+            self.disable()
+            if threshold is not None:
+                self.threshold = threshold
+        elif query.get('enable') in ('1', 'true') or (self.enabled and threshold is not None):
+            self.enable(threshold)
+        elif threshold is not None:
+            self.threshold = threshold
+        return web.json_response(self.state())
+
+
+if __name__ == '__main__':
+    import hashlib
+    import json
+
+    async def demo():
+        monitor = LoopMonitor(threshold=0.005, lag_interval=0.01)
+        monitor.enable()
+        lag_task = asyncio.create_task(monitor.run())
+
+        async def hash_page():
+            page = b'x' * 50_000_000
+            await asyncio.sleep(0.05)
+            hashlib.sha256(page).hexdigest()
+            await asyncio.sleep(0.05)
+
+        async def dump_order():
+            await asyncio.sleep(0.1)
+            json.dumps([{'price': i, 'size': i} for i in range(200000)], indent=4)
+
+        await asyncio.gather(hash_page(), dump_order(), asyncio.sleep(0.3))
+        lag_task.cancel()
+        monitor.disable()
+        uprint(f'max lag {monitor.max_lag * 1e3:.1f} ms, '
+               f'lag p99 <= {metrics.LOOP_LAG.quantile(0.99) * 1e3:.1f} ms')
+
+    asyncio.run(demo())
@@ -0,0 +1,268 @@
+import bisect
+import math
+
+from aiohttp import web
+
+from utils import uprint
+
+# seconds, from a fast loop iteration to a slow order
+LATENCY_BUCKETS = (0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025,
+                   0.05, 0.1, 0.25, 0.5, 1., 2.5, 5., 10.)
+
+
+def _format_value(value):
+    if value == math.inf:
+        return '+Inf'
+    return repr(float(value))
+
+
+def _escape_label(value):
+    # the escapes of the text exposition format
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _format_labels(names, values, extra=''):
+    pairs = [f'{name}="{_escape_label(value)}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return '{' + ','.join(pairs) + '}' if pairs else ''
+
+
+class Metric:
+    """
+    A metric, with one child per combination of label values. Callers on a
+    hot path keep the child returned by `labels` rather than looking it up
+    on each update.
+    """
+    kind = None
+
+    def __init__(self, name, help, labels=(), registry=None):
+        self.name = name
+        self.help = help
+        self.label_names = tuple(labels)
+        self.children = dict()
+        (registry if registry is not None else REGISTRY).register(self)
+
+    def labels(self, *values):
+        child = self.children.get(values)
+        if child is None:
+            child = self.children[values] = self._new_child()
+        return child
+
+    def _new_child(self):
+        raise NotImplementedError
+
+    def _samples(self):
+        """
+        Lines of the metric, without the header.
+        """
+        if not self.label_names:
+            return self._child_samples((), self)
+        lines = []
+        for values, child in list(self.children.items()):
+            lines.extend(self._child_samples(values, child))
+        return lines
+
+    def _child_samples(self, values, child):
+        return [f'{self.name}{_format_labels(self.label_names, values)} {_format_value(child.value)}']
+
+    def exposition(self):
+        return '\n'.join([f'# HELP {self.name} {self.help}', f'# TYPE {self.name} {self.kind}']
+                         + self._samples())
+
+
+class _Value:
+    __slots__ = ('value',)
+
+    def __init__(self):
+        self.value = 0.
+
+    def inc(self, amount=1.):
+        self.value += amount
+
+    def set(self, value):
+        self.value = value
+
+
+class Counter(Metric):
+    kind = 'counter'
+
+    def __init__(self, name, help, labels=(), registry=None):
+        self.value = 0.
+        super().__init__(name, help, labels, registry)
+
+    def inc(self, amount=1.):
+        self.value += amount
+
+    def _new_child(self):
+        return _Value()
+
+
+class Gauge(Metric):
+    """
+    A value set by the code, or read from `callback` when scraped. With
+    labels, the callback returns a dict of label values (tuples) to values.
+    """
+    kind = 'gauge'
+
+    def __init__(self, name, help, labels=(), callback=None, registry=None):
+        self.value = 0.
+        self.callback = callback
+        super().__init__(name, help, labels, registry)
+
+    def set(self, value):
+        self.value = value
+
+    def inc(self, amount=1.):
+        self.value += amount
+
+    def _new_child(self):
+        return _Value()
+
+    def _samples(self):
+        if self.callback is None:
+            return super()._samples()
+
+        try:
+            result = self.callback()
+        except Exception as e:
+            uprint(f'[metrics] {self.name} unavailable: {e!r}')
+            return []
+        if not self.label_names:
+            return [] if result is None else [f'{self.name} {_format_value(result)}']
+        return [f'{self.name}{_format_labels(self.label_names, values)} {_format_value(value)}'
+                for values, value in result.items() if value is not None]
+
+
+class _Buckets:
+    __slots__ = ('bounds', 'counts', 'sum', 'count')
+
+    def __init__(self, bounds):
+        self.bounds = bounds
+        self.counts = [0] * (len(bounds) + 1)
+        self.sum = 0.
+        self.count = 0
+
+    def observe(self, value):
+        # the bucket count is only made cumulative when scraped
+        self.counts[bisect.bisect_left(self.bounds, value)] += 1
+        self.sum += value
+        self.count += 1
+
+
+class Histogram(Metric):
+    kind = 'histogram'
+
+    def __init__(self, name, help, labels=(), buckets=LATENCY_BUCKETS, registry=None):
+        self.bounds = tuple(sorted(buckets))
+        self.buckets = _Buckets(self.bounds)
+        super().__init__(name, help, labels, registry)
+
+    def observe(self, value):
+        self.buckets.observe(value)
+
+    def _new_child(self):
+        return _Buckets(self.bounds)
+
+    def _child_samples(self, values, child):
+        buckets = child if isinstance(child, _Buckets) else child.buckets
+        lines = []
+        cumulative = 0
+        for bound, count in zip(self.bounds + (math.inf,), buckets.counts):
+            cumulative += count
+            le = f'le="{_format_value(bound)}"'
+            lines.append(f'{self.name}_bucket{_format_labels(self.label_names, values, le)} {cumulative}')
+        labels = _format_labels(self.label_names, values)
+        lines.append(f'{self.name}_sum{labels} {_format_value(buckets.sum)}')
+        lines.append(f'{self.name}_count{labels} {buckets.count}')
+        return lines
+
+    def quantile(self, q, *values):
+        """
+        Upper bound of the bucket holding the `q` quantile, None if empty.
+        """
+        buckets = self.labels(*values) if values else self.buckets
+        if buckets.count == 0:
+            return None
+        target = q * buckets.count
+        cumulative = 0
+        for bound, count in zip(self.bounds + (math.inf,), buckets.counts):
+            cumulative += count
+            if cumulative >= target:
+                return bound
+
+
+class Registry:
+    def __init__(self):
+        self.metrics = dict()
+
+    def register(self, metric):
+        # a metric defined again (e.g. a gauge on a new object) replaces the old one
+        self.metrics[metric.name] = metric
+
+    def exposition(self):
+        return '\n'.join(metric.exposition() for metric in self.metrics.values()) + '\n'
+
+
+REGISTRY = Registry()
+
+POLLS = Counter('bot_polls_total', 'Announcement polls sent.', ('endpoint',))
+POLL_RTT = Histogram('bot_poll_rtt_seconds', 'Round trip time of the successful announcement polls.',
+                     ('endpoint',))
+PARSE_TIME = Histogram('bot_parse_seconds', 'Time to parse and diff an announcement response.',
+                       ('endpoint',))
+EMPTY_PARSES = Counter('bot_empty_parses_total', 'Successful announcement responses without any '
+                       'article found, e.g. after a change of markup.', ('endpoint',))
+DETECTION_TO_ORDER = Histogram('bot_detection_to_order_seconds',
+                               'Time from the detection of an announcement to the buy order '
+                               'acknowledged.', ('venue',))
+ORDER_RTT = Histogram('bot_order_rtt_seconds', 'Round trip time of the order requests.', ('venue',))
+WS_TICKS = Counter('bot_ws_ticks_total', 'Ticks received on the price sockets.', ('venue',))
+RECONNECTS = Counter('bot_reconnects_total', 'Sockets reopened and sessions rebuilt.', ('connection',))
+LOOP_LAG = Histogram('bot_loop_lag_seconds', 'Delay of the event loop on a periodic wake up.')
+SLOW_CALLBACKS = Counter('bot_slow_callbacks_total', 'Loop callbacks longer than the monitor threshold.')
+
+
+class MetricsServer:
+    """
+    Local HTTP server of the metrics, in the Prometheus text format on
+    /metrics. Other routes can be added to `app` before `start`.
+    """
+    def __init__(self, registry=REGISTRY, host='127.0.0.1', port=9108):
+        self.registry = registry
+        self.host = host
+        self.port = port
+        self.app = web.Application()
+        self.app.router.add_get('/metrics', self.metrics)
+
+    async def metrics(self, request):
+        return web.Response(text=self.registry.exposition(),
+                            content_type='text/plain', charset='utf-8',
+                            headers={'X-Content-Type-Options': 'nosniff'})
+
+    async def start(self):
+        self.runner = web.AppRunner(self.app)
+        await self.runner.setup()
+        site = web.TCPSite(self.runner, self.host, self.port)
+        await site.start()
+        self.port = site._server.sockets[0].getsockname()[1]
+        uprint(f'指标服务：http://{self.host}:{self.port}/metrics')
+        return self
+
+    async def close(self):
+        await self.runner.cleanup()
+
+
+if __name__ == '__main__':
+    import timeit
+
+    n = 1000000
+    counter = WS_TICKS.labels('bench')
+    histogram = ORDER_RTT.labels('bench')
+    updates = [('counter.inc()', lambda: counter.inc()),
+               ('histogram.observe(0.003)', lambda: histogram.observe(0.003)),
+               ('WS_TICKS.labels(...).inc()', lambda: WS_TICKS.labels('bench').inc())]
+    for name, update in updates:
+        print(f'{name:>28}: {timeit.timeit(update, number=n) / n * 1e9:.0f} ns per update')
+
+    print(REGISTRY.metrics['bot_order_rtt_seconds'].exposition())
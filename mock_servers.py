@@ -0,0 +1,454 @@
+import asyncio
+import html
+import json
+import time
+import uuid
+
+from aiohttp import web
+
+
+async def start_app(app, host='127.0.0.1', port=0):
+    """
+    Serve the app on a free port, return the runner and the base url.
+    """
+    runner = web.AppRunner(app)
+    await runner.setup()
+    site = web.TCPSite(runner, host, port)
+    await site.start()
+    port = site._server.sockets[0].getsockname()[1]
+    return runner, f'http://{host}:{port}'
+
+
+def listing_title(token_name, token_symbol):
+    return f'Binance Will List {token_name} ({token_symbol}) in the Innovation Zone'
+
+
+class MockBinance:
+    """
+    Stand-in for the announcement page and the catalog API. `publish` puts a
+    new article on top of both.
+    """
+    def __init__(self, first_title='Binance Completes the Integration of Nothing'):
+        self.articles = [{'id': 0, 'code': uuid.uuid4().hex, 'title': first_title,
+                          'type': 1, 'releaseDate': int(time.time() * 1000)}]
+        self.published_at = dict()  # title -> perf_counter time
+        self.n_requests = 0
+
+        self.app = web.Application()
+        self.app.router.add_get('/en/support/announcement/c-48', self.page)
+        self.app.router.add_get('/bapi/composite/v1/public/cms/article/catalog/list/query',
+                                self.catalog)
+        self.app.router.add_get('/rss', self.rss)
+        self.app.router.add_get('/feed', self.feed)
+
+    def publish(self, title):
+        self.articles.insert(0, {'id': len(self.articles), 'code': uuid.uuid4().hex,
+                                 'title': title, 'type': 1,
+                                 'releaseDate': int(time.time() * 1000)})
+        self.published_at[title] = time.perf_counter()
+
+    async def page(self, request):
+        self.n_requests += 1
+        catalog = json.dumps({'catalogId': 48, 'articles': self.articles[:15]},
+                             separators=(',', ':'))
+        return web.Response(text=f'<html><head></head><body><script id="__APP_DATA">'
+                                 f'{catalog}</script></body></html>',
+                            content_type='text/html')
+
+    async def catalog(self, request):
+        self.n_requests += 1
+        page_size = int(request.query.get('pageSize', 15))
+        return web.json_response({'code': '000000',
+                                  'data': {'articles': self.articles[:page_size]}})
+
+    async def rss(self, request):
+        self.n_requests += 1
+        items = ''.join(f'<item><title>{html.escape(article["title"])}</title>'
+                        f'<guid>{article["code"]}</guid></item>'
+                        for article in self.articles[:20])
+        return web.Response(text=f'<?xml version="1.0"?><rss version="2.0"><channel>'
+                                 f'<title>Binance</title>{items}</channel></rss>',
+                            content_type='application/rss+xml')
+
+    async def feed(self, request):
+        self.n_requests += 1
+        return web.json_response([{'id': str(article['id']), 'text': article['title']}
+                                  for article in self.articles[:20]])
+
+    async def start(self):
+        self.runner, self.url = await start_app(self.app)
+        return self
+
+    @property
+    def page_url(self):
+        return self.url + '/en/support/announcement/c-48'
+
+    @property
+    def catalog_url(self):
+        return (self.url + '/bapi/composite/v1/public/cms/article/catalog/list/query'
+                           '?catalogId=48&pageNo=1&pageSize=15')
+
+    async def close(self):
+        await self.runner.cleanup()
+
+
+class MockKucoin:
+    """
+    Stand-in for the Kucoin REST API and sockets, with `n_tokens` tokens
+    TOK0, TOK1... listed against USDT. Orders are filled at once, and pushed
+    on the private order channel. Ticker frames are sent every
+    `tick_interval` seconds to each subscribed socket.
+    """
+    def __init__(self, n_tokens=10, price=1., tick_interval=0.01, balance=1000.):
+        self.tokens = {f'TOK{i}': f'Token{i}' for i in range(n_tokens)}
+        self.prices = {token: price for token in self.tokens}
+        self.tick_interval = tick_interval
+        self.balance = balance
+
+        self.orders = dict()  # order id -> order details
+        self.order_times = []  # (perf_counter time, side, symbol)
+        self.private_sockets = set()
+        self.n_sockets = 0
+
+        self.app = web.Application()
+        self.app.router.add_get('/api/v1/symbols', self.symbols)
+        self.app.router.add_get('/api/v1/currencies', self.currencies)
+        self.app.router.add_get('/api/v1/market/orderbook/level1', self.level1)
+        self.app.router.add_post('/api/v1/orders', self.order)
+        self.app.router.add_post('/api/v1/orders/multi', self.orders_multi)
+        self.app.router.add_get('/api/v1/orders/{order_id}', self.order_details)
+        self.app.router.add_get('/api/v1/accounts', self.accounts)
+        self.app.router.add_post('/api/v1/bullet-public', self.bullet)
+        self.app.router.add_post('/api/v1/bullet-private', self.bullet)
+        self.app.router.add_get('/ws', self.websocket)
+
+    async def start(self):
+        self.runner, self.url = await start_app(self.app)
+        return self
+
+    async def close(self):
+        await self.runner.cleanup()
+
+    async def symbols(self, request):
+        return web.json_response({'code': '200000', 'data': [
+            {'symbol': f'{token}-USDT', 'baseIncrement': '0.0001',
+             'quoteIncrement': '0.0001', 'priceIncrement': '0.0001'}
+            for token in self.tokens]})
+
+    async def currencies(self, request):
+        return web.json_response({'code': '200000', 'data': [
+            {'currency': token, 'fullName': name} for token, name in self.tokens.items()]})
+
+    async def level1(self, request):
+        token = request.query['symbol'].split('-')[0]
+        price = self.prices[token]
+        return web.json_response({'code': '200000',
+                                  'data': {'bestBid': str(price), 'bestAsk': str(price * 1.001),
+                                           'time': int(time.time() * 1000)}})
+
+    def _place(self, data):
+        self.order_times.append((time.perf_counter(), data['side'], data['symbol']))
+
+        order_id = uuid.uuid4().hex
+        price = self.prices[data['symbol'].split('-')[0]]
+        size = float(data['size'])
+        self.orders[order_id] = {'id': order_id, 'symbol': data['symbol'],
+                                 'size': str(size), 'dealSize': str(size),
+                                 'dealFunds': str(size * price), 'isActive': False}
+
+        for message in [{'type': 'match', 'status': 'match', 'matchSize': str(size),
+                         'matchPrice': str(price)},
+                        {'type': 'filled', 'status': 'done'}]:
+            message.update({'symbol': data['symbol'], 'orderId': order_id,
+                            'size': str(size), 'filledSize': str(size)})
+            frame = json.dumps({'type': 'message', 'topic': '/spotMarket/tradeOrders',
+                                'subject': 'orderChange', 'data': message})
+            for ws in list(self.private_sockets):
+                asyncio.create_task(ws.send_str(frame))
+
+        return order_id
+
+    async def order(self, request):
+        order_id = self._place(await request.json())
+        return web.json_response({'code': '200000', 'data': {'orderId': order_id}})
+
+    async def orders_multi(self, request):
+        data = await request.json()
+        results = []
+        for order in data['orderList']:
+            order_id = self._place(dict(order, symbol=data['symbol']))
+            results.append({'id': order_id, 'status': 'success', 'failMsg': ''})
+        return web.json_response({'code': '200000', 'data': {'data': results}})
+
+    async def order_details(self, request):
+        return web.json_response({'code': '200000',
+                                  'data': self.orders[request.match_info['order_id']]})
+
+    async def accounts(self, request):
+        currency = request.query['currency']
+        return web.json_response({'code': '200000', 'data': [
+            {'currency': currency, 'balance': str(self.balance),
+             'available': str(self.balance)}]})
+
+    async def bullet(self, request):
+        ws_endpoint = self.url.replace('http', 'ws', 1) + '/ws'
+        return web.json_response({'code': '200000',
+                                  'data': {'token': uuid.uuid4().hex,
+                                           'instanceServers': [{'endpoint': ws_endpoint}]}})
+
+    async def _send_ticks(self, ws, pair):
+        token = pair.split('-')[0]
+        sequence = 0
+        while not ws.closed:
+            sequence += 1
+            price = self.prices[token]
+            await ws.send_str(json.dumps({
+                'type': 'message', 'topic': f'/market/ticker:{pair}',
+                'subject': 'trade.ticker',
+                'data': {'sequence': str(sequence), 'price': str(price), 'size': '1',
+                         'bestAsk': str(price * 1.001), 'bestAskSize': '1',
+                         'bestBid': str(price), 'bestBidSize': '1',
+                         'time': int(time.time() * 1000)}}, separators=(',', ':')))
+            await asyncio.sleep(self.tick_interval)
+
+    async def websocket(self, request):
+        ws = web.WebSocketResponse()
+        await ws.prepare(request)
+        self.n_sockets += 1
+
+        await ws.send_str(json.dumps({'id': uuid.uuid4().hex, 'type': 'welcome'}))
+        tick_tasks = []
+        try:
+            async for msg in ws:
+                data = json.loads(msg.data)
+                if data.get('type') != 'subscribe':
+                    continue
+                await ws.send_str(json.dumps({'id': data['id'], 'type': 'ack'}))
+                if data.get('privateChannel'):
+                    self.private_sockets.add(ws)
+                elif data['topic'].startswith('/market/ticker:'):
+                    pair = data['topic'].split(':')[1]
+                    tick_tasks.append(asyncio.create_task(self._send_ticks(ws, pair)))
+        finally:
+            for task in tick_tasks:
+                task.cancel()
+            self.private_sockets.discard(ws)
+            self.n_sockets -= 1
+
+        return ws
+
+
+class MockTickerVenue:
+    """
+    Stand-in for the market data of a venue: `n_tokens` tokens TOK0, TOK1...
+    listed against USDT on REST, and a socket pushing the top of the book of
+    each subscribed pair every `tick_interval` seconds. Subclasses give the
+    routes and the frames of the venue.
+    """
+    ws_path = '/ws'
+
+    def __init__(self, n_tokens=10, price=1., tick_interval=0.01):
+        self.tokens = {f'TOK{i}': f'Token{i}' for i in range(n_tokens)}
+        self.prices = {token: price for token in self.tokens}
+        self.tick_interval = tick_interval
+        self.n_sockets = 0
+
+        self.app = web.Application()
+        self.app.router.add_get(self.ws_path, self.websocket)
+
+    async def start(self):
+        self.runner, self.url = await start_app(self.app)
+        return self
+
+    @property
+    def ws_url(self):
+        return self.url.replace('http', 'ws', 1) + self.ws_path
+
+    async def close(self):
+        await self.runner.cleanup()
+
+    def tick_frame(self, pair, bid, ask):
+        raise NotImplementedError
+
+    async def on_message(self, ws, text):
+        """
+        Answer a client frame, return the pair it subscribes to if any.
+        """
+        raise NotImplementedError
+
+    async def on_open(self, ws):
+        pass
+
+    async def _send_ticks(self, ws, pair):
+        token = pair.split('_')[0]
+        while not ws.closed:
+            price = self.prices[token]
+            await ws.send_str(self.tick_frame(pair, price, price * 1.001))
+            await asyncio.sleep(self.tick_interval)
+
+    async def websocket(self, request):
+        ws = web.WebSocketResponse()
+        await ws.prepare(request)
+        self.n_sockets += 1
+
+        await self.on_open(ws)
+        tick_tasks = []
+        try:
+            async for msg in ws:
+                pair = await self.on_message(ws, msg.data)
+                if pair is not None:
+                    tick_tasks.append(asyncio.create_task(self._send_ticks(ws, pair)))
+        finally:
+            for task in tick_tasks:
+                task.cancel()
+            self.n_sockets -= 1
+
+        return ws
+
+
+class MockMexc(MockTickerVenue):
+    """
+    MEXC: pairs like TOK0_USDT, top of the book on the limited depth channel.
+    """
+    ws_path = '/raw/ws'
+
+    def __init__(self, n_tokens=10, price=1., tick_interval=0.01):
+        super().__init__(n_tokens, price, tick_interval)
+        self.app.router.add_get('/open/api/v2/market/symbols', self.symbols)
+        self.app.router.add_get('/open/api/v2/market/coin/list', self.coins)
+
+    async def symbols(self, request):
+        return web.json_response({'code': 200, 'data': [
+            {'symbol': f'{token}_USDT', 'quantity_scale': 4, 'price_scale': 4}
+            for token in self.tokens]})
+
+    async def coins(self, request):
+        return web.json_response({'code': 200, 'data': [
+            {'currency': token, 'full_name': name} for token, name in self.tokens.items()]})
+
+    def tick_frame(self, pair, bid, ask):
+        return json.dumps({'channel': 'push.limit.depth', 'symbol': pair,
+                           'data': {'asks': [[str(ask), '1']], 'bids': [[str(bid), '1']]},
+                           'ts': int(time.time() * 1000)}, separators=(',', ':'))
+
+    async def on_message(self, ws, text):
+        data = json.loads(text)
+        if data['op'] == 'ping':
+            await ws.send_str(json.dumps({'channel': 'pong', 'data': int(time.time() * 1000)},
+                                         separators=(',', ':')))
+        elif data['op'] == 'sub.limit.depth':
+            await ws.send_str(json.dumps({'channel': 'rs.sub.limit.depth', 'data': 'success'},
+                                         separators=(',', ':')))
+            return data['symbol']
+        return None
+
+
+class MockBkex(MockTickerVenue):
+    """
+    BKEX: pairs like TOK0_USDT, top of the book as socket.io events on the
+    quotation namespace (engine.io protocol 3).
+    """
+    ws_path = '/socket.io/'
+
+    def __init__(self, n_tokens=10, price=1., tick_interval=0.01):
+        super().__init__(n_tokens, price, tick_interval)
+        self.app.router.add_get('/v2/common/symbols', self.symbols)
+        self.app.router.add_get('/v2/common/currencys', self.currencies)
+
+    @property
+    def ws_url(self):
+        return super().ws_url + '?EIO=3&transport=websocket'
+
+    async def symbols(self, request):
+        return web.json_response({'code': 0, 'data': [
+            {'symbol': f'{token}_USDT', 'volumePrecision': 4, 'pricePrecision': 4}
+            for token in self.tokens]})
+
+    async def currencies(self, request):
+        return web.json_response({'code': 0, 'data': [
+            {'currency': token} for token in self.tokens]})
+
+    def tick_frame(self, pair, bid, ask):
+        data = ['quotationDepth', {'symbol': pair, 'bid': [[str(bid), '1']],
+                                   'ask': [[str(ask), '1']], 'ts': int(time.time() * 1000)}]
+        return '42/quotation,' + json.dumps(data, separators=(',', ':'))
+
+    async def on_open(self, ws):
+        await ws.send_str('0' + json.dumps({'sid': uuid.uuid4().hex, 'upgrades': [],
+                                            'pingInterval': 25000, 'pingTimeout': 60000}))
+
+    async def on_message(self, ws, text):
+        if text == '2':
+            await ws.send_str('3')
+        elif text.startswith('40/quotation'):
+            await ws.send_str('40/quotation,')
+        elif text.startswith('42/quotation,'):
+            event, data = json.loads(text[len('42/quotation,'):])
+            if event == 'quotationDepth':
+                return data['symbol']
+        return None
+
+
+class MockProxy:
+    """
+    Stand-in for an HTTP proxy, tunnels CONNECT requests. After `fail`, all
+    connections are dropped.
+    """
+    def __init__(self):
+        self.down = False
+        self.n_connections = 0
+        self.writers = set()
+
+    def fail(self):
+        self.down = True
+        for writer in self.writers:
+            writer.close()
+
+    async def start(self, host='127.0.0.1'):
+        self.server = await asyncio.start_server(self.handle, host, 0)
+        port = self.server.sockets[0].getsockname()[1]
+        self.url = f'http://{host}:{port}'
+        return self
+
+    async def close(self):
+        self.server.close()
+        await self.server.wait_closed()
+
+    @staticmethod
+    async def _pipe(reader, writer):
+        try:
+            while data := await reader.read(65536):
+                writer.write(data)
+                await writer.drain()
+        except (ConnectionError, asyncio.CancelledError):
+            pass
+        finally:
+            writer.close()
+
+    async def handle(self, reader, writer):
+        self.n_connections += 1
+        if self.down:
+            writer.close()
+            return
+        self.writers.add(writer)
+
+        request_line = await reader.readline()
+        while (await reader.readline()) not in (b'\r\n', b''):
+            pass
+
+        method, target, _ = request_line.decode().split(' ', 2)
+        if method != 'CONNECT':
+            writer.write(b'HTTP/1.1 405 Method Not Allowed\r\n\r\n')
+            writer.close()
+            return
+
+        host, port = target.rsplit(':', 1)
+        remote_reader, remote_writer = await asyncio.open_connection(host, int(port))
+        writer.write(b'HTTP/1.1 200 Connection established\r\n\r\n')
+        await writer.drain()
+
+        try:
+            await asyncio.gather(self._pipe(reader, remote_writer),
+                                 self._pipe(remote_reader, writer))
+        finally:
+            self.writers.discard(writer)
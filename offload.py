@@ -0,0 +1,127 @@
+import asyncio
+import concurrent.futures
+import hashlib
+import multiprocessing
+
+from utils import uprint
+
+MODES = ('inline', 'thread', 'process')
+
+
+class Offloader:
+    """
+    Run the CPU bound work on response bodies (parsing, hashing) out of the
+    loop thread, so that the price sockets and the order responses are still
+    served during a burst of large bodies.
+
+    'inline' runs the work on the loop, 'thread' in a thread pool, which only
+    helps when the work releases the GIL (hashing, decompression), and
+    'process' in a pool of spawned processes, the function and its arguments
+    being pickled. Bodies shorter than `min_size` are always handled inline,
+    the hop costing more than the work.
+    """
+    def __init__(self, mode='inline', workers=1, min_size=64 * 1024):
+        if mode not in MODES:
+            raise ValueError(f'unknown offload mode {mode!r}, expected one of {MODES}')
+        self.mode = mode
+        self.workers = workers
+        self.min_size = min_size
+        self.n_inline = 0
+        self.n_offloaded = 0
+
+        if mode == 'thread':
+            self.executor = concurrent.futures.ThreadPoolExecutor(workers, thread_name_prefix='offload')
+        elif mode == 'process':
+            self.executor = concurrent.futures.ProcessPoolExecutor(
+                workers, mp_context=multiprocessing.get_context('spawn'))
+        else:
+            self.executor = None
+
+    async def start(self):
+        """
+        Start the workers now rather than on the first large body.
+        """
+        if self.executor is not None:
+            loop = asyncio.get_running_loop()
+            await asyncio.gather(*[loop.run_in_executor(self.executor, len, b'')
+                                   for _ in range(self.workers)])
+            uprint(f'[offload] 已启动 {self.workers} 个工作者（{self.mode}）。')
+        return self
+
+    async def run(self, func, body, *args):
+        """
+        `func(body, *args)`, out of the loop thread if the body is large.
+        """
+        if self.executor is None or len(body) < self.min_size:
+            self.n_inline += 1
+            return func(body, *args)
+
+        self.n_offloaded += 1
+        return await asyncio.get_running_loop().run_in_executor(self.executor, func, body, *args)
+
+    def close(self):
+        if self.executor is not None:
+            self.executor.shutdown(wait=False, cancel_futures=True)
+
+
+def _parse_and_hash(body, source):
+    # what a poller does with a large feed: parse it, and hash it to detect
+    # a change
+    hashlib.sha256(body.encode()).hexdigest()
+    return source.parse(body)
+
+
+def _rss_body(n_items):
+    items = ''.join(f'<item><title>Binance Will List Token {i} (TOK{i})</title>'
+                    f'<guid>{i}</guid><description>{"x" * 200}</description></item>'
+                    for i in range(n_items))
+    return f'<?xml version="1.0"?><rss><channel>{items}</channel></rss>'
+
+
+if __name__ == '__main__':
+    import statistics
+    import time
+
+    from ingestion import RssSource
+
+    async def tick_jitter(offloader, body, source, seconds=3., tick_interval=0.001, burst_interval=0.05):
+        """
+        Lateness of a task handling a tick every `tick_interval` seconds,
+        while a poller parses `body` every `burst_interval` seconds.
+        """
+        lateness = []
+        parse_times = []
+
+        async def ticker():
+            next_tick = time.perf_counter()
+            end = next_tick + seconds
+            while next_tick < end:
+                next_tick += tick_interval
+                await asyncio.sleep(max(0., next_tick - time.perf_counter()))
+                lateness.append(max(0., time.perf_counter() - next_tick))
+
+        async def poller():
+            end = time.perf_counter() + seconds
+            while time.perf_counter() < end:
+                start = time.perf_counter()
+                await offloader.run(_parse_and_hash, body, source)
+                parse_times.append(time.perf_counter() - start)
+                await asyncio.sleep(burst_interval)
+
+        await asyncio.gather(ticker(), poller())
+        lateness.sort()
+        return (statistics.median(lateness), lateness[int(0.99 * len(lateness))], lateness[-1],
+                statistics.median(parse_times))
+
+    async def bench():
+        body = _rss_body(10000)
+        source = RssSource('http://127.0.0.1/rss')
+        print(f'body of {len(body) / 1e6:.1f} MB, ticks every 1 ms, a parse every 50 ms')
+        for mode in MODES:
+            offloader = await Offloader(mode).start()
+            p50, p99, worst, parse_time = await tick_jitter(offloader, body, source)
+            offloader.close()
+            print(f'{mode:>8}: tick lateness p50 {p50 * 1e3:.2f} ms, p99 {p99 * 1e3:.2f} ms, '
+                  f'max {worst * 1e3:.1f} ms; parse {parse_time * 1e3:.1f} ms')
+
+    asyncio.run(bench())
@@ -0,0 +1,158 @@
+import asyncio
+import collections
+import random
+import time
+from email.utils import parsedate_to_datetime
+
+from utils import uprint
+
+RATE_LIMIT_STATUSES = {403, 418, 429}
+
+
+def parse_retry_after(headers):
+    """
+    Return the delay in seconds asked by the `Retry-After` header (seconds or
+    HTTP date) or by exhausted rate limit headers, None if there is none.
+    """
+    if not headers:
+        return None
+
+    retry_after = headers.get('Retry-After')
+    if retry_after is not None:
+        try:
+            return max(0., float(retry_after))
+        except ValueError:
+            try:
+                return max(0., parsedate_to_datetime(retry_after).timestamp() - time.time())
+            except (TypeError, ValueError):
+                pass
+
+    remaining = headers.get('X-RateLimit-Remaining')
+    reset = headers.get('X-RateLimit-Reset')
+    if remaining is not None and reset is not None:
+        try:
+            if int(remaining) <= 0:
+                reset = float(reset)
+                # either a delay or an epoch time
+                return max(0., reset - time.time()) if reset > 1e9 else reset
+        except ValueError:
+            pass
+
+    return None
+
+
+class Endpoint:
+    def __init__(self, name, interval):
+        self.name = name
+        self.interval = interval  # seconds between polls when all are healthy
+        self.last_poll = 0.
+        self.blocked_until = 0.
+        self.failures = 0
+
+
+class PollScheduler:
+    """
+    Decide which endpoint to poll next and when. Each endpoint keeps its own
+    interval while all are healthy, polls never exceed `budget` per second.
+    An endpoint failing or rate limited is backed off (honouring
+    `Retry-After`, else exponentially with jitter) and its share of the
+    budget goes to the healthy ones. `capacity` scales the intervals and the
+    budget, e.g. with the number of egresses the polls are spread on.
+    """
+    def __init__(self, endpoints, budget, base_backoff=1., max_backoff=300.,
+                 stats_window=60., log_interval=600.):
+        self.endpoints = {name: Endpoint(name, interval)
+                          for name, interval in endpoints.items()}
+        self.budget = budget
+        self.capacity = 1
+        self.base_backoff = base_backoff
+        self.max_backoff = max_backoff
+
+        self.last_poll = 0.
+        self.stats_window = stats_window
+        self.poll_times = collections.deque()
+        self.log_interval = log_interval
+        self.last_log = time.monotonic()
+
+    def _next(self, now):
+        healthy = [endpoint for endpoint in self.endpoints.values()
+                   if endpoint.blocked_until <= now]
+        if not healthy:
+            return None, min(endpoint.blocked_until
+                             for endpoint in self.endpoints.values()) - now
+
+        min_interval = 1 / (self.budget * self.capacity)
+        all_healthy = len(healthy) == len(self.endpoints)
+
+        best, best_time = None, None
+        for endpoint in healthy:
+            interval = endpoint.interval / self.capacity if all_healthy else min_interval
+            due = max(endpoint.last_poll + interval, self.last_poll + min_interval)
+            if best_time is None or due < best_time:
+                best, best_time = endpoint, due
+
+        return best, best_time - now
+
+    async def acquire(self):
+        """
+        Wait until an endpoint can be polled, return its name.
+        """
+        while True:
+            endpoint, wait = self._next(time.monotonic())
+            if wait > 0:
+                await asyncio.sleep(wait)
+                continue
+            if endpoint is not None:
+                break
+
+        now = time.monotonic()
+        endpoint.last_poll = now
+        self.last_poll = now
+
+        self.poll_times.append(now)
+        while self.poll_times[0] < now - self.stats_window:
+            self.poll_times.popleft()
+
+        if now - self.last_log > self.log_interval:
+            self.last_log = now
+            stats = self.stats()
+            uprint(f'轮询速率：{stats["rate"]:.1f}/s（预算 {stats["budget"]:.1f}/s，'
+                   f'退避中端点：{stats["blocked"]}）')
+
+        return endpoint.name
+
+    def report(self, name, status, headers=None):
+        """
+        Give the outcome of a poll, `status` is None for a network error.
+        """
+        endpoint = self.endpoints[name]
+
+        if status == 200:
+            endpoint.failures = 0
+            return 0.
+
+        endpoint.failures += 1
+        delay = parse_retry_after(headers)
+        if delay is None:
+            if status in RATE_LIMIT_STATUSES or status is None or status >= 500:
+                backoff = min(self.max_backoff,
+                              self.base_backoff * 2 ** (endpoint.failures - 1))
+            else:
+                backoff = self.base_backoff
+            delay = random.uniform(backoff / 2, backoff)
+
+        endpoint.blocked_until = time.monotonic() + delay
+        return delay
+
+    def achieved_rate(self):
+        if len(self.poll_times) < 2:
+            return 0.
+        window = min(self.stats_window, time.monotonic() - self.poll_times[0])
+        return len(self.poll_times) / window if window > 0 else 0.
+
+    def stats(self):
+        now = time.monotonic()
+        return {'rate': self.achieved_rate(),
+                'budget': self.budget * self.capacity,
+                'blocked': [endpoint.name for endpoint in self.endpoints.values()
+                            if endpoint.blocked_until > now]}
@@ -0,0 +1,220 @@
+import asyncio
+
+import numpy as np
+
+from utils import uprint
+
+# exit rules of a position, relative to the reference and execution prices
+DEFAULT_STRATEGY = {'floor_factor': 0.94,  # of the reference price
+                    'ceil_factor': 2.,  # of the execution price
+                    'trailing_factor': 0.9,  # of the maximum reached price
+                    'exit_max_impact': 0.2,
+                    'rest_warmup': 2,  # seconds of REST prices before the socket
+                    'max_hold': None}  # seconds before selling whatever the price
+
+EXIT_NONE, EXIT_CEIL, EXIT_FLOOR, EXIT_TRAILING, EXIT_DEADLINE = 0, 1, 2, 3, 4
+EXIT_REASONS = {EXIT_CEIL: 'ceil', EXIT_FLOOR: 'floor', EXIT_TRAILING: 'trailing',
+                EXIT_DEADLINE: 'deadline'}
+
+
+def evaluate_exits(prices, ref_price, floor_sell, ceil_sell, trailing_sell,
+                   max_reached, trailing_factor, active):
+    """
+    Apply the exit rules to all positions at once. Positions without a valid
+    price (NaN or not positive) are left untouched. `trailing_sell` and
+    `max_reached` are updated in place for the positions which do not exit.
+
+    Return the exit code of each position and the mask of the positions with
+    a new trailing sell price.
+    """
+    valid = active & (prices > 0)
+
+    # same priority as the checks of a single position: ceil, floor, trailing
+    exits = np.zeros(len(prices), dtype=np.int8)
+    exits[valid & (prices < trailing_sell) & (trailing_sell > ref_price)] = EXIT_TRAILING
+    exits[valid & (prices < floor_sell)] = EXIT_FLOOR
+    exits[valid & (prices > ceil_sell)] = EXIT_CEIL
+
+    new_max = valid & (exits == EXIT_NONE) & (prices > max_reached)
+    max_reached[new_max] = prices[new_max]
+    trailing_sell[new_max] = prices[new_max] * trailing_factor[new_max]
+
+    return exits, new_max
+
+
+class PositionBook:
+    """
+    Open positions of all the venues, with their exit thresholds held in
+    arrays. Price feeds write in the price cell of their position and set
+    `event`, then all the positions are evaluated in one pass and the exit
+    orders are sent together.
+    """
+    def __init__(self, capacity=64):
+        self.event = asyncio.Event()
+
+        self.ref_price = np.zeros(capacity)
+        self.floor_sell = np.zeros(capacity)
+        self.ceil_sell = np.zeros(capacity)
+        self.trailing_sell = np.zeros(capacity)
+        self.max_reached = np.zeros(capacity)
+        self.trailing_factor = np.zeros(capacity)
+        self.active = np.zeros(capacity, dtype=bool)
+
+        # slot -> position (exchange api, token, price cell, strategy, future)
+        self.positions = [None] * capacity
+        self.free_slots = list(range(capacity - 1, -1, -1))
+
+        self.exit_tasks = set()
+
+    def __len__(self):
+        return int(self.active.sum())
+
+    def _grow(self):
+        capacity = len(self.positions)
+        for name in ['ref_price', 'floor_sell', 'ceil_sell', 'trailing_sell',
+                     'max_reached', 'trailing_factor', 'active']:
+            array = getattr(self, name)
+            setattr(self, name, np.concatenate([array, np.zeros_like(array)]))
+
+        self.positions.extend([None] * capacity)
+        self.free_slots.extend(range(2 * capacity - 1, capacity - 1, -1))
+
+    def open(self, exch_api, token_symbol, price_cell, ref_price,
+             execution_price, strategy):
+        """
+        Add a position, return its slot and the future of its exit reason.
+        """
+        if not self.free_slots:
+            self._grow()
+        slot = self.free_slots.pop()
+
+        self.ref_price[slot] = ref_price
+        self.floor_sell[slot] = strategy['floor_factor'] * ref_price
+        self.ceil_sell[slot] = strategy['ceil_factor'] * execution_price
+        self.trailing_sell[slot] = self.floor_sell[slot]
+        self.max_reached[slot] = ref_price
+        self.trailing_factor[slot] = strategy['trailing_factor']
+        self.active[slot] = True
+
+        future = asyncio.get_event_loop().create_future()
+        self.positions[slot] = (exch_api, token_symbol, price_cell, strategy, future)
+
+        return slot, future
+
+    def close(self, slot):
+        self.active[slot] = False
+        self.positions[slot] = None
+        self.free_slots.append(slot)
+
+    async def hold(self, exch_api, token_symbol, price_cell, ref_price,
+                   execution_price, strategy):
+        """
+        Keep the position in the book until it exits, return the exit reason.
+        """
+        slot, future = self.open(exch_api, token_symbol, price_cell, ref_price,
+                                 execution_price, strategy)
+        deadline = None
+        if strategy.get('max_hold') is not None:
+            deadline = asyncio.get_running_loop().call_later(strategy['max_hold'], self.expire,
+                                                             slot, future)
+        self.event.set()
+        try:
+            return await future
+        finally:
+            if deadline is not None:
+                deadline.cancel()
+            if self.positions[slot] is not None and self.positions[slot][4] is future:
+                self.close(slot)
+
+    def current_prices(self):
+        prices = np.full(len(self.positions), np.nan)
+        for slot in np.flatnonzero(self.active):
+            prices[slot] = self.positions[slot][2][0] or np.nan
+        return prices
+
+    def evaluate(self):
+        """
+        Evaluate all the positions on their current prices and dispatch the
+        exit orders.
+        """
+        prices = self.current_prices()
+        exits, new_max = evaluate_exits(prices, self.ref_price, self.floor_sell,
+                                        self.ceil_sell, self.trailing_sell,
+                                        self.max_reached, self.trailing_factor,
+                                        self.active)
+
+        for slot in np.flatnonzero(new_max):
+            exch_api, token_symbol = self.positions[slot][:2]
+            uprint(f'[{exch_api.exch_name}: {token_symbol}] 新的追踪卖价：'
+                   f'{self.trailing_sell[slot]:.4f} （当前价格 {prices[slot]:.4f}）')
+
+        exit_slots = np.flatnonzero(exits)
+        if len(exit_slots) == 0:
+            return
+
+        exiting = []
+        for slot in exit_slots:
+            exiting.append((self.positions[slot], exits[slot], prices[slot],
+                            self._threshold(slot, exits[slot])))
+            self.close(slot)
+        self._dispatch(exiting)
+
+    def expire(self, slot, future):
+        """
+        Sell a position held for longer than its `max_hold`, whatever its
+        price.
+        """
+        position = self.positions[slot]
+        if position is None or position[4] is not future:
+            return
+        self.close(slot)
+        self._dispatch([(position, EXIT_DEADLINE, position[2][0], position[3]['max_hold'])])
+
+    def _dispatch(self, exiting):
+        task = asyncio.create_task(self._exit(exiting))
+        self.exit_tasks.add(task)
+        task.add_done_callback(self.exit_tasks.discard)
+
+    def _threshold(self, slot, exit_code):
+        if exit_code == EXIT_CEIL:
+            return self.ceil_sell[slot]
+        if exit_code == EXIT_FLOOR:
+            return self.floor_sell[slot]
+        return self.trailing_sell[slot]
+
+    async def _exit(self, exiting):
+        orders = []
+        for (exch_api, token_symbol, _, strategy, _), exit_code, price, threshold in exiting:
+            if exit_code == EXIT_CEIL:
+                uprint(f'[{exch_api.exch_name}: {token_symbol}] 当前价格 {price:.4f} '
+                       f'超过最高卖价 {threshold:.4f}，以约{strategy["ceil_factor"]:g}倍利润出售。')
+            elif exit_code == EXIT_FLOOR:
+                uprint(f'[{exch_api.exch_name}: {token_symbol}] 当前价格 {price:.4f} '
+                       f'低于最低卖价 {threshold:.4f}，亏损出售。')
+            elif exit_code == EXIT_DEADLINE:
+                uprint(f'[{exch_api.exch_name}: {token_symbol}] 持仓超过 {threshold:g} 秒'
+                       f'（当前价格 {price:.4f}），出售。')
+            else:
+                uprint(f'[{exch_api.exch_name}: {token_symbol}] 当前价格 {price:.4f} '
+                       f'低于追踪卖价 {threshold:.4f}，出售。')
+
+            orders.append(exch_api.order_limit_max(token_sell=token_symbol, token_buy='USDT',
+                                                   max_impact=strategy['exit_max_impact'],
+                                                   time_in_force='IOC'))
+
+        responses = await asyncio.gather(*orders, return_exceptions=True)
+
+        for (position, exit_code, _, _), response in zip(exiting, responses):
+            future = position[4]
+            if future.done():
+                continue
+            if isinstance(response, BaseException):
+                future.set_exception(response)
+            else:
+                future.set_result(EXIT_REASONS[exit_code])
+
+    async def run(self):
+        while True:
+            await self.event.wait()
+            self.event.clear()
+            self.evaluate()
@@ -0,0 +1,442 @@
+import asyncio
+import fcntl
+import mmap
+import multiprocessing
+import os
+import struct
+import sys
+import time
+
+import numpy as np
+
+from event_loop import run
+from supervisor import TaskSupervisor
+from utils import uprint
+
+MAGIC = b'PRCBRD02'
+HEADER = struct.Struct('<8sII')  # magic, number of slots, slot size
+# sequence, 'exchange:pair', receive time (ns since epoch), exchange time
+# (ms), highest bid, lowest ask: 64 bytes, a cache line
+SLOT_DTYPE = np.dtype([('seq', '<u8'), ('key', 'S24'), ('recv_ns', '<i8'),
+                       ('exch_ms', '<i8'), ('bid', '<f8'), ('ask', '<f8')])
+# after the slots, the last time (ns since epoch) a writer held each slot
+# and a reader wanted it
+HOLDERS_DTYPE = np.dtype([('held_ns', '<i8'), ('wanted_ns', '<i8')])
+SEQ = struct.Struct('<Q')
+KEY = struct.Struct('24s')
+TICK = struct.Struct('<qqdd')
+KEY_OFFSET = 8
+TICK_OFFSET = 32
+
+
+class PriceBoard:
+    """
+    Memory-mapped board of the last tick of each pair, one slot per
+    'exchange:pair', shared by any number of processes. A slot has a single
+    writer (the feed of the pair) and is read without locks: the writer
+    makes the sequence odd, writes the tick, then makes it even again, and a
+    reader retries when the sequence was odd or changed during its read.
+
+    Slots are only allocated under a file lock. The writers `hold` their
+    slots and the readers `want` them; a slot nobody wrote, held or wanted
+    for `max_age` seconds is taken back when the board is full.
+
+    `slots` is a structured numpy view of the whole board, without copy.
+    """
+    def __init__(self, path, n_slots=256, max_age=60.):
+        self.path = path
+        self.max_age = max_age
+        size = HEADER.size + n_slots * (SLOT_DTYPE.itemsize + HOLDERS_DTYPE.itemsize)
+        self.fd = os.open(path, os.O_RDWR | os.O_CREAT, 0o644)
+
+        fcntl.flock(self.fd, fcntl.LOCK_EX)
+        try:
+            if os.fstat(self.fd).st_size == 0:
+                os.ftruncate(self.fd, size)
+                os.pwrite(self.fd, HEADER.pack(MAGIC, n_slots, SLOT_DTYPE.itemsize), 0)
+            magic, n_slots, slot_size = HEADER.unpack(os.pread(self.fd, HEADER.size, 0))
+        finally:
+            fcntl.flock(self.fd, fcntl.LOCK_UN)
+
+        if magic != MAGIC or slot_size != SLOT_DTYPE.itemsize:
+            raise ValueError(f'{path} is not a price board.')
+
+        self.n_slots = n_slots
+        self.mm = mmap.mmap(self.fd, HEADER.size + n_slots * (slot_size + HOLDERS_DTYPE.itemsize))
+        self.slots = np.frombuffer(self.mm, dtype=SLOT_DTYPE, count=n_slots, offset=HEADER.size)
+        self.holders = np.frombuffer(self.mm, dtype=HOLDERS_DTYPE, count=n_slots,
+                                     offset=HEADER.size + n_slots * slot_size)
+        self.index = dict()  # key -> slot
+
+    def _offset(self, slot):
+        return HEADER.size + slot * SLOT_DTYPE.itemsize
+
+    def slot(self, exch_name, pair, create=False):
+        """
+        Slot of the pair, allocated if `create`. None if there is none.
+        """
+        key = f'{exch_name}:{pair}'.encode()
+        if len(key) > 24:
+            raise ValueError(f'{key} is too long for a price board key.')
+        # the slot may have been taken back for another pair
+        if key in self.index and self.slots['key'][self.index[key]] == key:
+            return self.index[key]
+
+        found = np.flatnonzero(self.slots['key'] == key)
+        if len(found) == 0 and create:
+            fcntl.flock(self.fd, fcntl.LOCK_EX)
+            try:
+                found = np.flatnonzero(self.slots['key'] == key)
+                if len(found) == 0:
+                    found = [self._allocate(key)]
+            finally:
+                fcntl.flock(self.fd, fcntl.LOCK_UN)
+        if len(found) == 0:
+            return None
+
+        self.index[key] = int(found[0])
+        return self.index[key]
+
+    def _allocate(self, key):
+        free = np.flatnonzero(self.slots['key'] == b'')
+        if len(free):
+            slot = int(free[0])
+        else:
+            last_use = np.maximum(self.slots['recv_ns'],
+                                  np.maximum(self.holders['held_ns'], self.holders['wanted_ns']))
+            slot = int(np.argmin(last_use))
+            if time.time_ns() - last_use[slot] < self.max_age * 1e9:
+                raise RuntimeError(f'{self.path} has no free slot left.')
+
+        # the sequence goes on, the readers of the former pair see a change
+        offset = self._offset(slot)
+        seq = SEQ.unpack_from(self.mm, offset)[0] | 1
+        SEQ.pack_into(self.mm, offset, seq)
+        KEY.pack_into(self.mm, offset + KEY_OFFSET, key)
+        TICK.pack_into(self.mm, offset + TICK_OFFSET, 0, 0, 0., 0.)
+        self.holders[slot] = (0, 0)
+        SEQ.pack_into(self.mm, offset, seq + 1)
+        return slot
+
+    def hold(self, slot):
+        """
+        Mark the slot as written to, even without a tick.
+        """
+        self.holders['held_ns'][slot] = time.time_ns()
+
+    def want(self, slot):
+        """
+        Mark the slot as read, the feed serves the slots wanted.
+        """
+        self.holders['wanted_ns'][slot] = time.time_ns()
+
+    def held(self, slot, within):
+        """
+        True if a writer held or wrote the slot in the last `within` seconds.
+        """
+        last_use = max(self.holders['held_ns'][slot], self.slots['recv_ns'][slot])
+        return time.time_ns() - last_use < within * 1e9
+
+    def wanted(self, exch_name, within):
+        """
+        Pairs of the exchange wanted by a reader in the last `within`
+        seconds, and their slots.
+        """
+        prefix = f'{exch_name}:'.encode()
+        recent = np.flatnonzero(self.holders['wanted_ns'] > time.time_ns() - within * 1e9)
+        keys = self.slots['key']
+        return {keys[slot][len(prefix):].decode(): int(slot)
+                for slot in recent if keys[slot].startswith(prefix)}
+
+    def write(self, slot, recv_ns, exch_ms, bid, ask):
+        offset = self._offset(slot)
+        seq = SEQ.unpack_from(self.mm, offset)[0]
+        SEQ.pack_into(self.mm, offset, seq + 1)
+        TICK.pack_into(self.mm, offset + TICK_OFFSET, recv_ns, exch_ms, bid, ask)
+        SEQ.pack_into(self.mm, offset, seq + 2)
+
+    def sequence(self, slot):
+        return SEQ.unpack_from(self.mm, self._offset(slot))[0]
+
+    def read(self, slot, retries=1000):
+        """
+        Consistent (sequence, recv_ns, exch_ms, bid, ask) of the slot, the
+        sequence being 0 if nothing was written yet. None if no consistent
+        read was made in `retries` attempts, which happens when a writer died
+        in the middle of a write.
+        """
+        offset = self._offset(slot)
+        for _ in range(retries):
+            seq = SEQ.unpack_from(self.mm, offset)[0]
+            if seq & 1:
+                continue
+            tick = TICK.unpack_from(self.mm, offset + TICK_OFFSET)
+            if SEQ.unpack_from(self.mm, offset)[0] == seq:
+                return (seq,) + tick
+        return None
+
+    def close(self):
+        del self.slots
+        del self.holders
+        self.mm.close()
+        os.close(self.fd)
+
+
+class BoardPoller:
+    """
+    Reads of a board by a single task of the process, for all its board
+    sockets: the sequences of their slots are checked every `interval`
+    seconds, and the slots marked as wanted every `want_interval` seconds.
+    The task ends with the last socket.
+    """
+    def __init__(self, board, interval=0.001, want_interval=1.):
+        self.board = board
+        self.interval = interval
+        self.want_interval = want_interval
+        self.sockets = set()
+        self.task = None
+
+    def watch(self, price_socket):
+        self.sockets.add(price_socket)
+        if self.task is None or self.task.done():
+            self.task = asyncio.create_task(self.run(), name='price board poller')
+
+    def unwatch(self, price_socket):
+        self.sockets.discard(price_socket)
+
+    async def run(self):
+        next_want = 0.
+        while self.sockets:
+            await asyncio.sleep(self.interval)
+            now = time.monotonic()
+            want = now >= next_want
+            if want:
+                next_want = now + self.want_interval
+            for price_socket in list(self.sockets):
+                try:
+                    price_socket.poll(want)
+                except Exception as e:
+                    uprint(f'Exception in {type(price_socket).__name__}: {e}')
+
+
+_pollers = dict()  # board -> poller of this process
+
+
+def board_poller(board):
+    if board not in _pollers:
+        _pollers[board] = BoardPoller(board)
+    return _pollers[board]
+
+
+class BoardPriceSellSocket:
+    """
+    Same contract as the exchange price sockets, reading the price board
+    written by the feed of another process instead of a connection. Its slot
+    is allocated if missing, which is the request to the feed, and read by
+    the poller of the board.
+
+    The REST price is polled every `rest_interval` seconds while the board
+    has no tick of the pair newer than `stale_after` seconds.
+    """
+    def __init__(self, exch_api, token_symbol, current_price, event_new_price,
+                 stale_after=5., rest_interval=0.5):
+        self.exch_api = exch_api
+        self.token_symbol = token_symbol
+        self.current_price = [current_price]
+        self.event_new_price = event_new_price
+        self.stale_after = stale_after
+        self.rest_interval = rest_interval
+
+        self.pair, self.ordered = self.exch_api.find_pair_from_tokens('USDT', token_symbol)
+        if self.ordered is None:
+            uprint(f'ERROR: pair of USDT and {token_symbol} do not exist at'
+                   f'this point although it should.')
+            sys.exit(1)
+
+        self.slot = None
+        self.last_seq = 0
+        self.recv_ns = 0
+
+    def fresh(self):
+        return time.time_ns() - self.recv_ns < self.stale_after * 1e9
+
+    def poll(self, want):
+        board = self.exch_api.price_board
+        if self.slot is None:
+            if not want:
+                return
+            try:
+                self.slot = board.slot(self.exch_api.exch_name, self.pair, create=True)
+            except (RuntimeError, ValueError):
+                # no feed for the pair, the REST price is used
+                return
+        if want:
+            board.want(self.slot)
+
+        if board.sequence(self.slot) == self.last_seq:
+            return
+        tick = board.read(self.slot)
+        if tick is None:
+            return
+        self.last_seq, recv_ns, exch_ms, best_bid, best_ask = tick
+        # nothing written yet, or a tick left by a former feed
+        if time.time_ns() - recv_ns >= self.stale_after * 1e9:
+            return
+        self.recv_ns = recv_ns
+
+        # have the denomination in USDT
+        price = best_bid if not self.ordered else 1 / best_ask
+        if price != self.current_price[0]:
+            self.current_price[0] = price
+            self.event_new_price.set()
+
+    async def run(self):
+        prefix = f'[{self.exch_api.exch_name}: {self.token_symbol}]'
+        poller = board_poller(self.exch_api.price_board)
+        # the feed is given `stale_after` seconds to start
+        self.recv_ns = time.time_ns()
+        poller.watch(self)
+        stale = False
+        try:
+            while True:
+                await asyncio.sleep(self.rest_interval)
+                if self.fresh():
+                    if stale:
+                        uprint(f'{prefix} 价格板恢复报价。')
+                        stale = False
+                    continue
+
+                if not stale:
+                    uprint(f'{prefix} 警告：价格板上超过 {self.stale_after:g} 秒没有报价，改用 REST 价格。')
+                    stale = True
+                price = await self.exch_api.get_price_sell(self.token_symbol, 'USDT')
+                # a tick may have come during the request
+                if price and not self.fresh() and price != self.current_price[0]:
+                    self.current_price[0] = price
+                    self.event_new_price.set()
+        except asyncio.CancelledError:
+            pass
+        finally:
+            poller.unwatch(self)
+
+
+async def feed(exch_api, socket_class, interval=0.5, max_idle=10., held_for=5.):
+    """
+    Serve the requests of the readers of the price board of `exch_api`: a
+    price socket publishing to the board runs for each pair of the exchange
+    wanted in the last `max_idle` seconds, unless another writer held it in
+    the last `held_for` seconds.
+    """
+    board = exch_api.price_board
+    event = asyncio.Event()
+    supervisor = TaskSupervisor(f'feed {exch_api.exch_name}')
+    tasks = dict()  # pair -> socket task
+    try:
+        while True:
+            wanted = board.wanted(exch_api.exch_name, max_idle)
+            for pair in [pair for pair, task in tasks.items() if pair not in wanted or task.done()]:
+                await supervisor.cancel([tasks.pop(pair)])
+
+            for pair, slot in wanted.items():
+                if pair in tasks or pair not in exch_api.pairs or board.held(slot, held_for):
+                    continue
+                token_symbol = next(token for token in pair.split(exch_api.pairs_separator) if token != 'USDT')
+                price_socket = socket_class(exch_api, token_symbol, 0., event)
+                tasks[pair] = supervisor.spawn(price_socket.run(), f'feed {exch_api.exch_name}: {pair}', 'socket')
+                uprint(f'[feed {exch_api.exch_name}] 开始发布 {pair} 的报价。')
+
+            event.clear()
+            await asyncio.sleep(interval)
+    finally:
+        await supervisor.close()
+
+
+async def serve_board(path):
+    """
+    Feed of the board, with exchange APIs of its own.
+    """
+    from bot import ExchangeRefresh, create_exchanges
+
+    board = PriceBoard(path)
+    exchanges_apis, exchanges_apis_sockets = create_exchanges()
+    tasks = []
+    for exch_name, exch_api in exchanges_apis.items():
+        exch_api.price_board = board
+        tasks.append(ExchangeRefresh(exch_api).refresh_exchange())
+        if exch_api.support_websocket:
+            tasks.append(feed(exch_api, exchanges_apis_sockets[exch_name]))
+    uprint(f'[feed-{os.getpid()}] 开始为 {path} 发布报价。')
+    try:
+        await asyncio.gather(*tasks)
+    finally:
+        board.close()
+
+
+def run_feed(path, loop='asyncio'):
+    """
+    Entry point of the feed process.
+    """
+    try:
+        run(serve_board(path), loop=loop)
+    except KeyboardInterrupt:
+        pass
+
+
+def start_feed(path, loop='asyncio'):
+    process = multiprocessing.get_context('spawn').Process(target=run_feed, name='price-board-feed',
+                                                           daemon=True, args=(path, loop))
+    process.start()
+    return process
+
+
+def _write_ticks(path, n_ticks, interval):
+    board = PriceBoard(path)
+    slot = board.slot('Bench', 'TOK-USDT', create=True)
+    start = time.perf_counter()
+    for i in range(n_ticks):
+        board.write(slot, time.time_ns(), i, 1. + i, 1.001 + i)
+        time.sleep(max(0., start + (i + 1) * interval - time.perf_counter()))
+    board.close()
+
+
+if __name__ == '__main__':
+    import statistics
+    import tempfile
+    import timeit
+
+    directory = '/dev/shm' if os.path.isdir('/dev/shm') else tempfile.gettempdir()
+    path = os.path.join(directory, f'price_board_bench_{os.getpid()}')
+    board = PriceBoard(path)
+    slot = board.slot('Bench', 'TOK-USDT', create=True)
+
+    n = 200000
+    write_ns = timeit.timeit(lambda: board.write(slot, 0, 0, 1., 1.), number=n) / n * 1e9
+    read_ns = timeit.timeit(lambda: board.read(slot), number=n) / n * 1e9
+    print(f'write {write_ns:.0f} ns, read {read_ns:.0f} ns')
+
+    # a writer process at 2 kHz, this one polling the sequence every 100 us
+    n_ticks = 4000
+    writer = multiprocessing.get_context('spawn').Process(target=_write_ticks,
+                                                          args=(path, n_ticks, 0.0005))
+    writer.start()
+    latencies = []
+    torn = 0
+    last_seq = board.sequence(slot)
+    while len(latencies) < n_ticks and writer.is_alive() or board.sequence(slot) != last_seq:
+        seq = board.sequence(slot)
+        if seq == last_seq or seq & 1:
+            time.sleep(0.0001)
+            continue
+        tick = board.read(slot)
+        if tick is None:
+            continue
+        last_seq, recv_ns, exch_ms, bid, ask = tick
+        latencies.append(time.time_ns() - recv_ns)
+        if bid != 1. + exch_ms or ask != 1.001 + exch_ms:
+            torn += 1
+    writer.join()
+
+    print(f'{len(latencies)} of {n_ticks} ticks seen from another process, median '
+          f'{statistics.median(latencies) / 1e3:.1f} us, torn reads: {torn}')
+    board.close()
+    os.unlink(path)
@@ -0,0 +1,199 @@
+import asyncio
+import collections
+import io
+import os
+import signal
+import sys
+import threading
+import time
+
+from aiohttp import web
+
+from utils import uprint
+
+# (file, functions or None for all) -> stage, the innermost match wins
+STAGE_RULES = [
+    ('article_diff.py', None, 'parser'),
+    ('regex_title.py', None, 'parser'),
+    ('fastjson.py', None, 'parser'),
+    ('dedup_store.py', None, 'parser'),
+    ('ingestion.py', {'parse', '_arrival'}, 'parser'),
+    ('api_general.py', {'run', 'decode_ticker'}, 'socket loop'),
+    ('api_kucoin.py', {'decode_ticker', 'connect'}, 'socket loop'),
+    ('api_mexc.py', {'decode_ticker', 'connect'}, 'socket loop'),
+    ('api_bkex.py', {'decode_ticker', 'connect'}, 'socket loop'),
+    ('tick_recorder.py', None, 'socket loop'),
+    ('price_board.py', None, 'socket loop'),
+    ('api_kucoin.py', None, 'order path'),
+    ('api_mexc.py', None, 'order path'),
+    ('api_bkex.py', None, 'order path'),
+    ('react.py', None, 'order path'),
+    ('decision.py', None, 'order path'),
+    ('position_book.py', None, 'order path'),
+    ('bot.py', None, 'poller'),
+    ('poll_scheduler.py', None, 'poller'),
+    ('egress.py', None, 'poller'),
+    ('session_supervisor.py', None, 'poller'),
+    ('ingestion.py', None, 'poller'),
+    ('selectors.py', {'select'}, 'idle'),
+]
+
+
+def frame_stage(frame):
+    """
+    Stage of the code running in `frame`, from the innermost frame matching
+    a rule, 'other' if none does.
+    """
+    while frame is not None:
+        code = frame.f_code
+        file_name = os.path.basename(code.co_filename)
+        for rule_file, functions, stage in STAGE_RULES:
+            if file_name == rule_file and (functions is None or code.co_name in functions):
+                return stage
+        frame = frame.f_back
+    return 'other'
+
+
+def collapse(frame):
+    """
+    Stack of the frame, outermost first, as 'file:function;...'.
+    """
+    names = []
+    while frame is not None:
+        code = frame.f_code
+        names.append(f'{os.path.basename(code.co_filename)}:{code.co_name}')
+        frame = frame.f_back
+    return ';'.join(reversed(names))
+
+
+def dump_tasks():
+    """
+    Every task of the running loop with its stack.
+    """
+    out = io.StringIO()
+    tasks = asyncio.all_tasks()
+    out.write(f'{len(tasks)} tasks\n\n')
+    for task in sorted(tasks, key=lambda task: task.get_name()):
+        task.print_stack(limit=20, file=out)
+        out.write('\n')
+    return out.getvalue()
+
+
+class SamplingProfiler:
+    """
+    Sample the stack of the loop thread every `interval` seconds from another
+    thread, for a given duration. Samples are tagged by stage (poller,
+    parser, order path, socket loop, idle) and written to `directory` as
+    collapsed stacks (one 'stage;frames count' per line, for flame graph
+    tools) with a per stage summary, along with a dump of the asyncio tasks.
+
+    Triggered by SIGUSR2 (for `default_seconds`) or by the aiohttp handler
+    `control` on /profile?seconds=N.
+    """
+    def __init__(self, directory='profiles', interval=0.001, default_seconds=10):
+        self.directory = directory
+        self.interval = interval
+        self.default_seconds = default_seconds
+        self.running = False
+
+    def _sample(self, thread_id, seconds, samples):
+        end = time.perf_counter() + seconds
+        while time.perf_counter() < end:
+            frame = sys._current_frames().get(thread_id)
+            if frame is not None:
+                samples[(frame_stage(frame), collapse(frame))] += 1
+            del frame
+            time.sleep(self.interval)
+
+    def summary(self, samples):
+        stages = collections.Counter()
+        for (stage, _), count in samples.items():
+            stages[stage] += count
+        total = sum(stages.values()) or 1
+        return {stage: count / total for stage, count in stages.most_common()}
+
+    async def profile(self, seconds=None):
+        """
+        Profile the loop thread for `seconds`, return the paths written and
+        the share of the samples of each stage. None if already running.
+        """
+        if self.running:
+            return None
+        self.running = True
+        seconds = seconds or self.default_seconds
+
+        try:
+            uprint(f'[profiler] 采样 {seconds} 秒。')
+            samples = collections.Counter()
+            thread = threading.Thread(target=self._sample,
+                                      args=(threading.get_ident(), seconds, samples),
+                                      name='profiler', daemon=True)
+            thread.start()
+            await asyncio.sleep(seconds)
+            tasks = dump_tasks()
+            await asyncio.to_thread(thread.join)
+
+            summary = self.summary(samples)
+            os.makedirs(self.directory, exist_ok=True)
+            prefix = os.path.join(self.directory, time.strftime('%Y%m%d-%H%M%S'))
+            paths = {'profile': prefix + '-profile.txt', 'tasks': prefix + '-tasks.txt'}
+            with open(paths['profile'], 'w') as f:
+                f.write(''.join(f'# {stage}: {share:.1%}\n' for stage, share in summary.items()))
+                for (stage, stack), count in samples.most_common():
+                    f.write(f'{stage};{stack} {count}\n')
+            with open(paths['tasks'], 'w') as f:
+                f.write(tasks)
+        finally:
+            self.running = False
+
+        uprint(f'[profiler] {paths["profile"]}：'
+               + '，'.join(f'{stage} {share:.0%}' for stage, share in summary.items()))
+        return {'paths': paths, 'stages': summary}
+
+    def install_signal(self, sig=signal.SIGUSR2):
+        loop = asyncio.get_running_loop()
+        self.tasks = set()
+
+        def start():
+            task = loop.create_task(self.profile())
+            self.tasks.add(task)
+            task.add_done_callback(self.tasks.discard)
+
+        loop.add_signal_handler(sig, start)
+
+    async def control(self, request):
+        seconds = float(request.query.get('seconds', self.default_seconds))
+        result = await self.profile(seconds)
+        if result is None:
+            return web.json_response({'error': 'a profile is already running'}, status=409)
+        return web.json_response(result)
+
+
+if __name__ == '__main__':
+    import tempfile
+
+    from scenario import MockBotScenario
+
+    async def demo():
+        directory = tempfile.mkdtemp()
+        scenario = await MockBotScenario(n_tokens=20).start()
+        profiler = SamplingProfiler(directory, default_seconds=2)
+        profiler.install_signal()
+
+        async def announce():
+            for i in range(10):
+                await scenario.announce([i])
+                await asyncio.sleep(0.1)
+
+        announce_task = asyncio.create_task(announce())
+        os.kill(os.getpid(), signal.SIGUSR2)
+        await asyncio.sleep(0)
+        await asyncio.gather(*profiler.tasks)
+        await announce_task
+        await scenario.close()
+
+        for name in sorted(os.listdir(directory)):
+            with open(os.path.join(directory, name)) as f:
+                print(f'== {name}\n' + ''.join(f.readlines()[:8]))
+
+    asyncio.run(demo())
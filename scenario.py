@@ -0,0 +1,218 @@
+import asyncio
+import contextlib
+import io
+import statistics
+import time
+
+from api.api_bkex import BKEX_API, BKEXPriceSellSocket
+from api.api_kucoin import KucoinAPI, KucoinPriceSellSocket
+from api.api_mexc import MEXC_API, MEXCPriceSellSocket
+from bot import RefreshAnnouncements
+from event_loop import LOOPS, loop_factory, run
+from mock_servers import MockBinance, MockBkex, MockKucoin, MockMexc, listing_title
+from position_book import PositionBook
+
+
+class MockBotScenario:
+    """
+    The announcement poller, the position book and a Kucoin api wired to the
+    local mock servers.
+    """
+    def __init__(self, n_tokens=50, tick_interval=0.01):
+        self.binance = MockBinance()
+        self.kucoin = MockKucoin(n_tokens=n_tokens, tick_interval=tick_interval)
+        self.n_announced = 0
+
+    async def start(self):
+        await self.binance.start()
+        await self.kucoin.start()
+
+        self.exch_api = KucoinAPI(api_url=self.kucoin.url)
+        self.position_book = PositionBook()
+        self.refresh = RefreshAnnouncements({'Kucoin': self.exch_api},
+                                            {'Kucoin': KucoinPriceSellSocket},
+                                            self.position_book,
+                                            url=self.binance.page_url,
+                                            second_url=self.binance.catalog_url,
+                                            egresses=['direct'])
+        self.refresh.cooldown = 0
+
+        # wait for the exchange data, and for the first title to be seen
+        while not self.exch_api.listed_tokens or not self.exch_api.pairs:
+            await asyncio.sleep(0.01)
+        self.tasks = [asyncio.create_task(self.position_book.run()),
+                      asyncio.create_task(self.refresh.run())]
+        while self.binance.n_requests < 2:
+            await asyncio.sleep(0.01)
+
+        return self
+
+    async def announce(self, token_indices, timeout=5):
+        """
+        Publish a listing of the given tokens, return the latency between the
+        detection and each buy order reaching the exchange.
+        """
+        names = [f'Token{i} (TOK{i})' for i in token_indices]
+        title = 'Binance Will List ' + ' and '.join(names) + ' in the Innovation Zone'
+        if len(token_indices) == 1:
+            title = listing_title(f'Token{token_indices[0]}', f'TOK{token_indices[0]}')
+
+        n_orders = len(self.kucoin.order_times)
+        self.n_announced += 1
+        self.binance.publish(title)
+
+        deadline = time.perf_counter() + timeout
+        while (len([order for order in self.kucoin.order_times[n_orders:] if order[1] == 'buy'])
+               < len(token_indices) and time.perf_counter() < deadline):
+            await asyncio.sleep(0.001)
+
+        return [order_time - self.refresh.detected_at
+                for order_time, side, _ in self.kucoin.order_times[n_orders:] if side == 'buy']
+
+    async def close(self):
+        for task in self.tasks:
+            task.cancel()
+        await asyncio.gather(*self.tasks, return_exceptions=True)
+        await self.refresh.close()
+        await self.exch_api.close()
+        await self.binance.close()
+        await self.kucoin.close()
+
+
+async def detection_to_post(n_announcements):
+    scenario = await MockBotScenario(n_tokens=n_announcements).start()
+    latencies = []
+    try:
+        for i in range(n_announcements):
+            latencies.extend(await scenario.announce([i]))
+    finally:
+        await scenario.close()
+    return latencies
+
+
+def bench_event_loops(n_announcements=20):
+    """
+    Run the mock scenario on each event loop, print the detection to order
+    POST latencies.
+    """
+    results = dict()
+    for loop in LOOPS:
+        if loop != 'asyncio' and loop_factory(loop) is loop_factory('asyncio'):
+            continue
+        with contextlib.redirect_stdout(io.StringIO()):
+            latencies = run(detection_to_post(n_announcements), loop=loop)
+        results[loop] = latencies
+
+        quantiles = statistics.quantiles(latencies, n=10)
+        print(f'{loop:>8}: {len(latencies)} orders, detection to POST median '
+              f'{statistics.median(latencies) * 1e3:.2f} ms, p90 {quantiles[-1] * 1e3:.2f} ms')
+
+    if len(results) == 2:
+        difference = statistics.median(results['asyncio']) - statistics.median(results['uvloop'])
+        print(f'uvloop is {difference * 1e3:+.2f} ms faster on the median')
+
+    return results
+
+
+async def price_socket_reaction(exch_api, socket_class, venue, token_symbol='TOK1',
+                                new_price=0.5, timeout=2):
+    """
+    Follow the price of a token on the socket of a venue, move the price on
+    the mock venue, return the time until the price cell has it (None if
+    it never does).
+    """
+    event = asyncio.Event()
+    price_socket = socket_class(exch_api, token_symbol, 1., event)
+    task = asyncio.create_task(price_socket.run())
+    try:
+        await asyncio.sleep(0.2)
+        venue.prices[token_symbol] = new_price
+        start = time.perf_counter()
+        while price_socket.current_price[0] != new_price:
+            if time.perf_counter() - start > timeout:
+                return None
+            event.clear()
+            with contextlib.suppress(asyncio.TimeoutError):
+                await asyncio.wait_for(event.wait(), timeout)
+        return time.perf_counter() - start
+    finally:
+        task.cancel()
+        await asyncio.gather(task, return_exceptions=True)
+
+
+async def check_price_sockets(tick_interval=0.01):
+    """
+    Run the price socket of each venue against its mock, print how long a
+    price move takes to reach the price cell.
+    """
+    kucoin = await MockKucoin(tick_interval=tick_interval).start()
+    mexc = await MockMexc(tick_interval=tick_interval).start()
+    bkex = await MockBkex(tick_interval=tick_interval).start()
+
+    kucoin_api = KucoinAPI(api_url=kucoin.url)
+    while not kucoin_api.listed_tokens or not kucoin_api.pairs:
+        await asyncio.sleep(0.01)
+    # the MEXC and BKEX apis are blocking, they are built out of the loop
+    mexc_api = await asyncio.to_thread(MEXC_API, mexc.url, mexc.ws_url)
+    bkex_api = await asyncio.to_thread(BKEX_API, bkex.url, bkex.ws_url)
+
+    results = dict()
+    try:
+        for exch_api, socket_class, venue in [(kucoin_api, KucoinPriceSellSocket, kucoin),
+                                              (mexc_api, MEXCPriceSellSocket, mexc),
+                                              (bkex_api, BKEXPriceSellSocket, bkex)]:
+            delay = await price_socket_reaction(exch_api, socket_class, venue)
+            results[exch_api.exch_name] = delay
+            outcome = 'never seen' if delay is None else f'seen after {delay * 1e3:.1f} ms'
+            print(f'{exch_api.exch_name:>8}: price move {outcome} '
+                  f'(ticks every {tick_interval * 1e3:.0f} ms)')
+    finally:
+        await kucoin_api.close()
+        for venue in (kucoin, mexc, bkex):
+            await venue.close()
+
+    return results
+
+
+class FailingKucoinAPI(KucoinAPI):
+    """
+    Kucoin api whose orders buying `failing_token` raise, as on a network
+    error.
+    """
+    failing_token = 'TOK2'
+
+    async def _prepare_order_limit(self, token_sell, token_buy, *args, **kwargs):
+        if token_buy == self.failing_token:
+            raise RuntimeError(f'{token_buy} order failed')
+        return await super()._prepare_order_limit(token_sell, token_buy, *args, **kwargs)
+
+
+async def check_order_batch():
+    """
+    Place a batch of a good order and a raising one on the mock venue, check
+    that the good one is still filled and the raising one is `False`.
+    """
+    kucoin = await MockKucoin().start()
+    exch_api = FailingKucoinAPI(api_url=kucoin.url)
+    while not exch_api.listed_tokens or not exch_api.pairs:
+        await asyncio.sleep(0.01)
+
+    try:
+        orders = [{'token_sell': 'USDT', 'token_buy': token, 'max_impact': 0.1, 'amount_sell': 10,
+                   'time_in_force': 'IOC'} for token in ('TOK1', FailingKucoinAPI.failing_token)]
+        responses = await exch_api.order_limit_batch(orders)
+        fills = await exch_api.get_fills(responses)
+    finally:
+        await exch_api.close()
+        await kucoin.close()
+
+    assert isinstance(responses[1], RuntimeError), responses
+    assert fills[0] and fills[1] is False, fills
+    print(f'order batch: good order filled, raising order kept as {fills[1]}')
+    return fills
+
+
+if __name__ == '__main__':
+    asyncio.run(check_order_batch())
+    asyncio.run(check_price_sockets())
+    bench_event_loops()
@@ -0,0 +1,98 @@
+import asyncio
+import collections
+import time
+
+import aiohttp
+
+import metrics
+from utils import uprint
+
+
+class SessionSupervisor:
+    """
+    Owner of a connector and of the session on it, built with the prepared
+    timeout and headers. `rebuild` replaces both at once and closes the old
+    ones once the requests in flight on them are over (at most the timeout).
+
+    The time between the first failure and the next success is recorded as
+    a recovery time, i.e. how long the session was blind.
+    """
+    def __init__(self, connector_factory, timeout=None, headers=None, name='',
+                 n_recoveries=100):
+        self.connector_factory = connector_factory
+        self.timeout = timeout or aiohttp.ClientTimeout(total=10)
+        self.headers = headers
+        self.name = name
+
+        self.lock = asyncio.Lock()
+        self.generation = 0
+        self.session = self._build()
+        self.closing_tasks = set()
+
+        self.failing_since = None
+        self.recoveries = collections.deque(maxlen=n_recoveries)
+        self.n_rebuilds = 0
+
+    def _build(self):
+        return aiohttp.ClientSession(connector=self.connector_factory(),
+                                     timeout=self.timeout, headers=self.headers)
+
+    async def _close_later(self, session):
+        try:
+            await asyncio.sleep(self.timeout.total or 0)
+        finally:
+            await session.close()
+
+    async def rebuild(self, generation):
+        """
+        Replace the session of the given generation, nothing is done if it was
+        already replaced by another caller.
+        """
+        async with self.lock:
+            if generation != self.generation:
+                return
+
+            old_session = self.session
+            self.session = self._build()
+            self.generation += 1
+            self.n_rebuilds += 1
+            metrics.RECONNECTS.labels(f'{self.name} session').inc()
+
+            task = asyncio.create_task(self._close_later(old_session))
+            self.closing_tasks.add(task)
+            task.add_done_callback(self.closing_tasks.discard)
+
+        uprint(f'[{self.name}] 会话已重建（第 {self.n_rebuilds} 次）。')
+
+    def failure(self):
+        if self.failing_since is None:
+            self.failing_since = time.monotonic()
+
+    def success(self):
+        if self.failing_since is None:
+            return
+
+        recovery = time.monotonic() - self.failing_since
+        self.recoveries.append(recovery)
+        self.failing_since = None
+        uprint(f'[{self.name}] 会话恢复，盲区 {recovery:.2f} 秒。')
+
+    def blind_time(self):
+        """
+        Seconds since the current failure started, 0 if the session works.
+        """
+        if self.failing_since is None:
+            return 0.
+        return time.monotonic() - self.failing_since
+
+    def stats(self):
+        return {'rebuilds': self.n_rebuilds,
+                'blind_time': self.blind_time(),
+                'last_recovery': self.recoveries[-1] if self.recoveries else None,
+                'max_recovery': max(self.recoveries) if self.recoveries else None}
+
+    async def close(self):
+        for task in list(self.closing_tasks):
+            task.cancel()
+        await asyncio.gather(*self.closing_tasks, return_exceptions=True)
+        await self.session.close()
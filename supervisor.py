@@ -0,0 +1,158 @@
+import asyncio
+import collections
+import os
+import resource
+import time
+
+from utils import uprint
+
+
+def rss_bytes():
+    """
+    Resident memory of the process, the peak one where /proc is missing.
+    """
+    try:
+        with open('/proc/self/statm') as f:
+            return int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+    except OSError:
+        # kilobytes on Linux, bytes on macOS
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+
+class TaskSupervisor:
+    """
+    Owner of the reaction tasks and of the tasks they start (price sockets,
+    REST polls), by group. A reference is kept until a task is over, the
+    exceptions are logged as soon as they happen, and a task still running
+    at its deadline is cancelled.
+
+    `cancel` waits for the cancelled tasks to be over, so that their sockets
+    are closed when it returns.
+    """
+    def __init__(self, name='reactions', n_failures=100):
+        self.name = name
+        # task -> (group, deadline handle or None)
+        self.tasks = dict()
+        self.started = collections.Counter()
+        self.failed = collections.Counter()
+        self.timed_out = collections.Counter()
+        self.failures = collections.deque(maxlen=n_failures)  # (time, task name, exception)
+
+    def spawn(self, coro, name=None, group='task', deadline=None):
+        """
+        Run `coro` in a task of the group, cancelled after `deadline` seconds.
+        """
+        task = asyncio.create_task(coro, name=name)
+        handle = None
+        if deadline is not None:
+            handle = asyncio.get_running_loop().call_later(deadline, self._expire, task, deadline)
+        self.tasks[task] = (group, handle)
+        self.started[group] += 1
+        task.add_done_callback(self._done)
+        return task
+
+    def _expire(self, task, deadline):
+        if task.done():
+            return
+        group, _ = self.tasks.get(task, ('task', None))
+        self.timed_out[group] += 1
+        uprint(f'[{self.name}] {task.get_name()} 超过期限 {deadline:g} 秒，取消。')
+        task.cancel()
+
+    def _done(self, task):
+        group, handle = self.tasks.pop(task, ('task', None))
+        if handle is not None:
+            handle.cancel()
+        if task.cancelled():
+            return
+
+        exception = task.exception()
+        if exception is not None:
+            self.failed[group] += 1
+            self.failures.append((time.time(), task.get_name(), exception))
+            uprint(f'[{self.name}] {task.get_name()} 异常退出：{exception!r}')
+
+    async def cancel(self, tasks, timeout=5.):
+        """
+        Cancel the tasks and wait `timeout` seconds at most for them to be over.
+        """
+        tasks = [task for task in tasks if not task.done()]
+        for task in tasks:
+            task.cancel()
+        if tasks:
+            _, pending = await asyncio.wait(tasks, timeout=timeout)
+            for task in pending:
+                uprint(f'[{self.name}] {task.get_name()} 取消后 {timeout:g} 秒仍未结束。')
+
+    async def close(self, timeout=5.):
+        await self.cancel(list(self.tasks), timeout)
+
+    def counts(self):
+        """
+        Number of running tasks of each group.
+        """
+        return collections.Counter(group for group, _ in self.tasks.values())
+
+    def stats(self):
+        return {'running': dict(self.counts()),
+                'started': dict(self.started),
+                'failed': dict(self.failed),
+                'timed_out': dict(self.timed_out),
+                'asyncio_tasks': len(asyncio.all_tasks()),
+                'rss': rss_bytes()}
+
+    async def run(self, interval=60.):
+        """
+        Log the task counts and the memory every `interval` seconds.
+        """
+        while True:
+            await asyncio.sleep(interval)
+            stats = self.stats()
+            running = '，'.join(f'{group} {n}' for group, n in sorted(stats['running'].items())) or '无'
+            uprint(f'[{self.name}] 运行中的任务：{running}（asyncio 共 {stats["asyncio_tasks"]} 个），'
+                   f'内存 {stats["rss"] / 2 ** 20:.1f} MB')
+
+
+if __name__ == '__main__':
+    import itertools
+
+    from mock_servers import listing_title
+    from scenario import MockBotScenario
+
+    async def soak(n_announcements=1000, concurrency=20, n_tokens=50, max_hold=0.2, warmup=200):
+        """
+        React to `n_announcements` listings, `concurrency` at a time, each
+        position exiting on its deadline, and check that the tasks and the
+        memory stay flat after the first `warmup` ones. The mock exchange
+        keeps every order, so a little growth is expected from it.
+        """
+        scenario = await MockBotScenario(n_tokens=n_tokens, tick_interval=0.02).start()
+        refresh = scenario.refresh
+        refresh.strategy = {'max_hold': max_hold, 'rest_warmup': 0.05}
+        supervisor = refresh.supervisor
+        tokens = itertools.cycle(range(n_tokens))
+
+        baseline = None
+        for n in range(0, n_announcements, concurrency):
+            for i in range(n, min(n + concurrency, n_announcements)):
+                token = next(tokens)
+                # a new title each time, the same tokens come back
+                title = f'{listing_title(f"Token{token}", f"TOK{token}")} #{i}'
+                refresh.on_title(title, [f'TOK{token}'], [f'token{token}'], time.perf_counter(), -i - 1)
+            while supervisor.counts():
+                await asyncio.sleep(0.01)
+
+            stats = supervisor.stats()
+            if baseline is None and n + concurrency >= warmup:
+                baseline = stats
+            if (n + concurrency) % 200 == 0:
+                print(f'{n + concurrency:>5} announcements: {stats["asyncio_tasks"]} asyncio tasks, '
+                      f'RSS {stats["rss"] / 2 ** 20:.1f} MB')
+
+        print(f'started {stats["started"]}, failed {stats["failed"]}, timed out {stats["timed_out"]}')
+        growth = (stats['rss'] - baseline['rss']) / 2 ** 20
+        print(f'asyncio tasks {baseline["asyncio_tasks"]} -> {stats["asyncio_tasks"]}, '
+              f'RSS growth after the first {warmup} {growth:.1f} MB')
+        await scenario.close()
+
+    asyncio.run(soak())
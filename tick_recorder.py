@@ -0,0 +1,151 @@
+import asyncio
+import os
+import struct
+import time
+from datetime import datetime
+
+import numpy as np
+
+from utils import uprint
+
+# one record per ticker message, little endian:
+# receive time (ns since epoch), exchange time (ms), highest bid, lowest ask
+TICK_DTYPE = np.dtype([('recv_ns', '<i8'), ('exch_ms', '<i8'),
+                       ('bid', '<f8'), ('ask', '<f8')])
+TICK_STRUCT = struct.Struct('<qqdd')
+MAGIC = b'TICKREC1'
+HEADER = struct.Struct('<8sII')  # magic, record size, reserved
+
+
+class TickRecorder:
+    """
+    Append-only tick file. `record` only packs the tick in an in-memory
+    buffer, the buffers are written to disk by `flush` in a worker thread,
+    one write at a time so that the chunks stay in order.
+    """
+    def __init__(self, path, buffer_records=4096):
+        self.path = path
+        self.buffer_records = buffer_records
+        self.buffer = bytearray(buffer_records * TICK_STRUCT.size)
+        self.n_buffered = 0
+        self.full_buffers = []
+        self.n_records = 0
+        # write of the last flush, possibly still running in the executor
+        self.writing = None
+
+        if not os.path.exists(path) or os.path.getsize(path) == 0:
+            with open(path, 'wb') as f:
+                f.write(HEADER.pack(MAGIC, TICK_STRUCT.size, 0))
+
+    def record(self, recv_ns, exch_ms, bid, ask):
+        TICK_STRUCT.pack_into(self.buffer, self.n_buffered * TICK_STRUCT.size,
+                              recv_ns, exch_ms, bid, ask)
+        self.n_buffered += 1
+        self.n_records += 1
+
+        if self.n_buffered == self.buffer_records:
+            self.full_buffers.append(self.buffer)
+            self.buffer = bytearray(self.buffer_records * TICK_STRUCT.size)
+            self.n_buffered = 0
+
+    def _take_pending(self):
+        pending = self.full_buffers
+        if self.n_buffered:
+            pending.append(self.buffer[:self.n_buffered * TICK_STRUCT.size])
+            self.n_buffered = 0
+        self.full_buffers = []
+        return pending
+
+    def _write(self, chunks):
+        with open(self.path, 'ab') as f:
+            for chunk in chunks:
+                f.write(chunk)
+
+    async def _wait_writing(self):
+        # a cancelled flush leaves its write running in the executor
+        if self.writing is None:
+            return
+        try:
+            await asyncio.shield(self.writing)
+        except Exception as e:
+            uprint(f'写入 {self.path} 失败：{e!r}')
+        self.writing = None
+
+    async def flush(self):
+        await self._wait_writing()
+        chunks = self._take_pending()
+        if chunks:
+            self.writing = asyncio.get_event_loop().run_in_executor(None, self._write, chunks)
+            await self._wait_writing()
+
+    async def close(self):
+        await self._wait_writing()
+        self._write(self._take_pending())
+
+
+class TickRecorderPool:
+    """
+    One recorder per exchange and pair, under `directory`, flushed every
+    `flush_interval` seconds by `run`.
+    """
+    def __init__(self, directory, flush_interval=1.):
+        self.directory = directory
+        self.flush_interval = flush_interval
+        self.recorders = dict()
+        os.makedirs(directory, exist_ok=True)
+
+    def get(self, exch_name, pair):
+        key = (exch_name, pair)
+        if key not in self.recorders:
+            day = datetime.utcnow().strftime('%Y%m%d')
+            path = os.path.join(self.directory, f'{exch_name}_{pair}_{day}.ticks')
+            self.recorders[key] = TickRecorder(path)
+        return self.recorders[key]
+
+    async def run(self):
+        uprint(f'记录行情到 {self.directory}。')
+        try:
+            while True:
+                await asyncio.sleep(self.flush_interval)
+                await asyncio.gather(*[recorder.flush()
+                                       for recorder in list(self.recorders.values())])
+        finally:
+            for recorder in self.recorders.values():
+                await recorder.close()
+
+
+def read_ticks(path):
+    """
+    Memory-map a tick file as a structured array of `TICK_DTYPE`, without
+    copying. A record being written at the end of the file is left out.
+    """
+    with open(path, 'rb') as f:
+        magic, record_size, _ = HEADER.unpack(f.read(HEADER.size))
+
+    if magic != MAGIC or record_size != TICK_DTYPE.itemsize:
+        raise ValueError(f'{path} is not a tick file.')
+
+    n_records = (os.path.getsize(path) - HEADER.size) // record_size
+    if n_records == 0:
+        return np.zeros(0, dtype=TICK_DTYPE)
+
+    return np.memmap(path, dtype=TICK_DTYPE, mode='r', offset=HEADER.size,
+                     shape=(n_records,))
+
+
+if __name__ == '__main__':
+    import tempfile
+
+    with tempfile.TemporaryDirectory() as directory:
+        recorder = TickRecorder(os.path.join(directory, 'bench.ticks'))
+
+        n_ticks = 1000000
+        start = time.perf_counter()
+        for i in range(n_ticks):
+            recorder.record(time.time_ns(), i, 1. + i * 1e-6, 1.001 + i * 1e-6)
+        duration = time.perf_counter() - start
+        uprint(f'record: {duration / n_ticks * 1e9:.0f} ns per tick')
+
+        asyncio.run(recorder.close())
+        ticks = read_ticks(recorder.path)
+        uprint(f'read back {len(ticks)} ticks, last bid {ticks["bid"][-1]:.6f}')